@@ -0,0 +1 @@
+# turns benchmarks folder into proper package
@@ -0,0 +1,395 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from contextlib import contextmanager, redirect_stdout
+
+import numpy as np
+
+# Benchmarks for the SDT / meta-d' hot paths, on synthetic data at several
+# scales. Run from the repo root:
+#
+#     python -m benchmarks.bench                  # run everything, print a table
+#     python -m benchmarks.bench --quick          # small scales only (~seconds)
+#     python -m benchmarks.bench --only fit_meta  # cases whose id contains "fit_meta"
+#     python -m benchmarks.bench --save           # record results as the new baseline
+#     python -m benchmarks.bench --check          # non-zero exit on regressions vs the baseline
+#
+# For every case we record:
+#### wall_s  -- best wall time of one call, in seconds
+#### nfev    -- log-likelihood evaluations per call (fitters only; for the
+####            batch fitter, iterations, each evaluating every table at once)
+#### peak_mb -- peak memory allocated during one call (numpy included), in MB
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+TRIAL_SCALES = (100, 1_000, 10_000, 100_000, 1_000_000)
+RATING_LEVELS = (2, 4, 10)
+# binned slider scales; only for the fitters that scale to them (L-BFGS-B, batch)
+LONG_RATING_LEVELS = (50,)
+TABLE_SCALES = (1, 100, 10_000)
+# the scalar fitter takes ~0.1-1 s per table, so it only gets the small end
+SCALAR_TABLE_SCALES = (1, 10)
+# group sizes for the hierarchical sampler (4 chains, this many warmup + kept draws each)
+HIERARCHICAL_SUBJECTS = (20, 500)
+HIERARCHICAL_SAMPLES = 2000
+
+# --quick drops anything bigger than these
+QUICK_MAX_TRIALS = 10_000
+QUICK_MAX_TABLES = 100
+QUICK_MAX_SCALAR_TABLES = 1
+QUICK_MAX_SUBJECTS = 20
+
+# how far past the baseline counts as a regression (--check)
+TIME_TOLERANCE = 2.0  # x baseline wall time (timings are noisy)
+NFEV_TOLERANCE = 1.1  # x baseline evaluations (these are deterministic)
+MEMORY_TOLERANCE = 1.25  # x baseline peak memory, plus MEMORY_SLACK_MB
+MEMORY_SLACK_MB = 1.
+
+
+### ==================== synthetic data ==================== ###
+
+def synthetic_trials(n_trials, n_ratings=4, d_prime=1.5, seed=0):
+    """
+    Trials from an unbiased observer with meta-d' = d' (see utils/simulate.py),
+    with type 2 criteria spread evenly over 0-2 sd from the type 1 criterion.
+    :return: dict of column name -> numpy array (load_data's columns)
+    """
+
+    from utils.simulate import simulate_trials
+
+    trials = simulate_trials(
+        n_trials, d_prime=d_prime, n_ratings=n_ratings, t2c_rS2=np.linspace(0, 2, n_ratings + 1)[1:-1], seed=seed
+    )
+    return {col: trials[col].to_numpy() for col in ("stimID", "response", "rating", "responseRT")}
+
+
+def synthetic_tables(n_tables, n_ratings=4, n_trials=400, seed=0):
+    """
+    n_tables independent sessions of n_trials each, as padded count tables.
+    :return: nr_s1, nr_s2 arrays of shape (n_tables, 2 * n_ratings)
+    """
+
+    from utils.meta_d.trials_to_counts import trials_to_cells
+
+    trials = synthetic_trials(n_tables * n_trials, n_ratings, seed=seed)
+    valid, cell = trials_to_cells(trials["stimID"], trials["response"], trials["rating"], n_ratings)
+    table = np.repeat(np.arange(n_tables), n_trials)
+    counts = np.bincount(
+        table[valid] * 4 * n_ratings + cell[valid], minlength=n_tables * 4 * n_ratings
+    ).reshape(n_tables, 4 * n_ratings) + 1 / (2 * n_ratings)
+    return counts[:, :2 * n_ratings], counts[:, 2 * n_ratings:]
+
+
+def _write_mat(path, trials):
+    # same layout as grating2AFC S11.mat: a 1x1 struct "data" of row vectors
+    import scipy.io as sio
+    sio.savemat(path, {"data": {name: column[None, :] for name, column in trials.items()}})
+
+
+### ==================== cases ==================== ###
+
+class Case:
+    """
+    One benchmark: setup() builds the inputs (not timed), run(inputs) is timed.
+    count, if given, is (module, function name) whose calls are counted as nfev;
+    or a function of run's return value giving nfev.
+    """
+
+    def __init__(self, name, params, setup, run, count=None):
+        self.name = name
+        self.params = params
+        self.setup = setup
+        self.run = run
+        self.count = count
+
+    @property
+    def id(self):
+        return self.name + "".join(f" {key}={value}" for key, value in self.params.items())
+
+
+def _trials_to_counts_case(n_trials, n_ratings):
+    from utils.meta_d.trials_to_counts import trials_to_counts
+    return Case(
+        "trials_to_counts", {"n_trials": n_trials, "n_ratings": n_ratings},
+        lambda: synthetic_trials(n_trials, n_ratings),
+        lambda t: trials_to_counts(t["stimID"], t["response"], t["rating"], n_ratings, pad_cells=1),
+    )
+
+
+def _calc_d_prime_case(n_trials):
+    from utils.calc_d_prime import calc_d_prime
+    return Case(
+        "calc_d_prime", {"n_trials": n_trials},
+        lambda: synthetic_trials(n_trials),
+        lambda t: calc_d_prime(t["stimID"], t["response"], correction="loglinear"),
+    )
+
+
+def _load_data_case(n_trials, cached, tmp_dir):
+    from utils.load_data import load_data
+
+    def setup():
+        path = os.path.join(tmp_dir, f"bench_{n_trials}.mat")
+        if not os.path.exists(path):
+            _write_mat(path, synthetic_trials(n_trials))
+        if cached:
+            load_data(path)  # make sure the .trials.npz exists
+        return path
+
+    return Case(
+        "load_data", {"n_trials": n_trials, "cache": "hit" if cached else "off"},
+        setup,
+        lambda path: load_data(path, use_cache=cached),
+    )
+
+
+def _fit_meta_d_logL_case(n_ratings):
+    from utils.meta_d import fit_meta_d_MLE as mle
+
+    def setup():
+        nr_s1, nr_s2 = synthetic_tables(1, n_ratings)
+        fit = _quiet(mle.fit_meta_d_MLE, nr_s1[0], nr_s2[0])
+        units = fit["S1units"]
+        t2c1 = np.concatenate((units["t2c1_rS1"], units["t2c1_rS2"]))
+        t1c1 = units["meta_c1"] * units["d1"] / units["meta_d1"]
+        params = np.concatenate(([units["meta_d1"]], t2c1 - units["meta_c1"]))
+        input_obj = (np.array([nr_s1[0], nr_s2[0]]), n_ratings, units["d1"], t1c1, 1,
+                     mle.relative_criterion, mle.norm.cdf, mle.norm.pdf)
+        return params, input_obj
+
+    return Case(
+        "fit_meta_d_logL", {"n_ratings": n_ratings},
+        setup,
+        lambda inputs: mle.fit_meta_d_logL(*inputs),
+        count=(mle, "fit_meta_d_logL"),
+    )
+
+
+def _fit_meta_d_MLE_case(n_ratings, n_tables, analytic_grad, solver="trust-constr"):
+    from utils.meta_d import fit_meta_d_MLE as mle
+
+    def run(tables):
+        return [_quiet(mle.fit_meta_d_MLE, s1, s2, analytic_grad=analytic_grad, solver=solver)
+                for s1, s2 in zip(*tables)]
+
+    # L-BFGS-B always uses the analytic gradient
+    params = {"n_ratings": n_ratings, "n_tables": n_tables}
+    params.update({"analytic_grad": analytic_grad} if solver == "trust-constr" else {"solver": solver})
+    return Case(
+        "fit_meta_d_MLE", params,
+        lambda: synthetic_tables(n_tables, n_ratings),
+        run,
+        count=(mle, "fit_meta_d_logL"),
+    )
+
+
+def _fit_meta_d_MLE_batch_case(n_ratings, n_tables):
+    from utils.meta_d.fit_meta_d_batch import fit_meta_d_MLE_batch
+    return Case(
+        "fit_meta_d_MLE_batch", {"n_ratings": n_ratings, "n_tables": n_tables},
+        lambda: synthetic_tables(n_tables, n_ratings),
+        lambda tables: fit_meta_d_MLE_batch(*tables),
+        count=lambda fit: int(np.max(fit["nit"])),
+    )
+
+
+def _fast_estimate_case(n_ratings, n_tables):
+    from utils.meta_d.lookup import fast_estimate, load_lookup_index
+
+    def setup():
+        load_lookup_index()  # reading (or building) the index isn't part of the lookup
+        return synthetic_tables(n_tables, n_ratings)
+
+    return Case(
+        "fast_estimate", {"n_ratings": n_ratings, "n_tables": n_tables},
+        setup,
+        lambda tables: fast_estimate(*tables),
+    )
+
+
+def _fit_meta_d_hierarchical_case(n_subjects):
+    from utils.meta_d.hierarchical import fit_meta_d_hierarchical
+    return Case(
+        "fit_meta_d_hierarchical", {"n_subjects": n_subjects, "n_samples": HIERARCHICAL_SAMPLES},
+        lambda: synthetic_tables(n_subjects, n_trials=200),
+        lambda tables: fit_meta_d_hierarchical(*tables, n_samples=HIERARCHICAL_SAMPLES, n_warmup=HIERARCHICAL_SAMPLES),
+    )
+
+
+def all_cases(tmp_dir, quick=False):
+    trial_scales = [n for n in TRIAL_SCALES if not quick or n <= QUICK_MAX_TRIALS]
+    table_scales = [n for n in TABLE_SCALES if not quick or n <= QUICK_MAX_TABLES]
+    scalar_table_scales = [n for n in SCALAR_TABLE_SCALES if not quick or n <= QUICK_MAX_SCALAR_TABLES]
+
+    cases = []
+    for n_trials in trial_scales:
+        for n_ratings in RATING_LEVELS:
+            cases.append(_trials_to_counts_case(n_trials, n_ratings))
+    for n_trials in trial_scales:
+        cases.append(_calc_d_prime_case(n_trials))
+    for n_trials in trial_scales:
+        for cached in (False, True):
+            cases.append(_load_data_case(n_trials, cached, tmp_dir))
+    for n_ratings in RATING_LEVELS:
+        cases.append(_fit_meta_d_logL_case(n_ratings))
+    for n_ratings in RATING_LEVELS:
+        for n_tables in scalar_table_scales:
+            for analytic_grad in (False, True):
+                cases.append(_fit_meta_d_MLE_case(n_ratings, n_tables, analytic_grad))
+    for n_ratings in RATING_LEVELS + LONG_RATING_LEVELS:
+        for n_tables in scalar_table_scales:
+            cases.append(_fit_meta_d_MLE_case(n_ratings, n_tables, True, solver="L-BFGS-B"))
+    for n_ratings in RATING_LEVELS + LONG_RATING_LEVELS:
+        for n_tables in table_scales:
+            cases.append(_fit_meta_d_MLE_batch_case(n_ratings, n_tables))
+    for n_ratings in RATING_LEVELS + LONG_RATING_LEVELS:
+        for n_tables in table_scales:
+            cases.append(_fast_estimate_case(n_ratings, n_tables))
+    for n_subjects in HIERARCHICAL_SUBJECTS:
+        if not quick or n_subjects <= QUICK_MAX_SUBJECTS:
+            cases.append(_fit_meta_d_hierarchical_case(n_subjects))
+    return cases
+
+
+### ==================== measuring ==================== ###
+
+def _quiet(func, *args, **kwargs):
+    # keep any console output/warnings (e.g. zero cells) out of the results table
+    with redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return func(*args, **kwargs)
+
+
+@contextmanager
+def _counting(module, name):
+    calls = [0]
+    original = getattr(module, name)
+
+    def counted(*args, **kwargs):
+        calls[0] += 1
+        return original(*args, **kwargs)
+
+    setattr(module, name, counted)
+    try:
+        yield calls
+    finally:
+        setattr(module, name, original)
+
+
+def measure(case, min_time=0.2, max_repeats=50):
+    """
+    :param min_time: keep repeating fast cases until this much time has passed
+    :return: dict with wall_s, nfev, peak_mb
+    """
+
+    inputs = case.setup()
+
+    # first call: count evaluations and peak memory (tracemalloc slows things
+    # down, so it's kept out of the timed calls)
+    tracemalloc.start()
+    try:
+        if isinstance(case.count, tuple):
+            with _counting(*case.count) as calls:
+                case.run(inputs)
+            nfev = calls[0]
+        else:
+            result = case.run(inputs)
+            nfev = case.count(result) if case.count is not None else None
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    best = float("inf")
+    elapsed = 0.
+    for _ in range(max_repeats):
+        start = time.perf_counter()
+        case.run(inputs)
+        wall = time.perf_counter() - start
+        best = min(best, wall)
+        elapsed += wall
+        if elapsed >= min_time:
+            break
+
+    return {"wall_s": best, "nfev": nfev, "peak_mb": peak / 2 ** 20}
+
+
+def machine_info():
+    import scipy
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline):
+    """
+    :return: list of regression messages (empty = no regressions)
+    """
+
+    regressions = []
+    for case_id, result in results.items():
+        base = baseline.get(case_id)
+        if base is None:
+            continue
+        if result["wall_s"] > TIME_TOLERANCE * base["wall_s"]:
+            regressions.append(f"{case_id}: {result['wall_s']:.4g} s vs baseline {base['wall_s']:.4g} s")
+        if result["nfev"] is not None and base["nfev"] and result["nfev"] > NFEV_TOLERANCE * base["nfev"]:
+            regressions.append(f"{case_id}: nfev {result['nfev']} vs baseline {base['nfev']}")
+        if result["peak_mb"] > MEMORY_TOLERANCE * base["peak_mb"] + MEMORY_SLACK_MB:
+            regressions.append(f"{case_id}: {result['peak_mb']:.1f} MB vs baseline {base['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the SDT / meta-d' hot paths")
+    parser.add_argument("--quick", action="store_true", help="small scales only")
+    parser.add_argument("--only", help="run cases whose id contains this")
+    parser.add_argument("--save", action="store_true", help="save results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit non-zero on regressions vs the baseline")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    print(f"{'case':62s} {'wall time':>12s} {'nfev':>7s} {'peak mem':>12s}")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for case in all_cases(tmp_dir, quick=args.quick):
+            if args.only and args.only not in case.id:
+                continue
+            result = measure(case)
+            results[case.id] = result
+            base = baseline.get(case.id)
+            vs = f"  ({result['wall_s'] / base['wall_s']:.2f}x baseline)" if base else ""
+            nfev = "" if result["nfev"] is None else result["nfev"]
+            print(f"{case.id:62s} {result['wall_s']:10.4g} s {nfev:>7} {result['peak_mb']:9.2f} MB{vs}", flush=True)
+
+    if args.save:
+        # merge, so a --quick/--only run only replaces the cases it ran
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": machine_info(), "results": {**baseline, **results}}, f, indent=1, sort_keys=True)
+        print(f"saved baseline to {args.baseline}")
+
+    if args.check:
+        regressions = compare(results, baseline)
+        for regression in regressions:
+            print("REGRESSION", regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,94 +1,53 @@
 #!/usr/bin/env python
 
-import matplotlib.pyplot as plt
+import argparse
+import os
+import sys
+import warnings
+from functools import partial
+
 import numpy as np
-import pandas as pd
-import scipy.io as sio
-import scipy.stats as stats
-# TIL "seaborn" is from "samuel norman seaborn" => imported as sns
-import seaborn as sns
 # whoa, custom imports !!
-from utils.calc_d_prime import calc_d_prime
-from utils.meta_d.meta_d_prime_master import compute_meta_d_prime
-
-### ==================== STEP 1: EXTRACT DATA ==================== ###
+from utils.calc_d_prime import calc_d_prime_grouped
+from utils.load_data import load_data
+from utils.trial_data import half_labels
 
-def load_data(filename):
-    """
-    Takes in file name as a string and converts it to a pandas DataFrame.
-    Accepts .mat files.
-    :param filename:
-    :return:
-    """
+# Plotting (matplotlib, seaborn), scipy.stats and the meta-d' fitter are only
+# imported inside the tasks that use them: importing them all up front took
+# ~2 s, which every short-lived batch/worker process paid even if it never
+# drew a plot. (TIL "seaborn" is from "samuel norman seaborn" => imported as sns)
 
-    # grating2AFC S11.mat has the data we need in it! But it is binary/archive
-    # format, so not directly viewable. Scipy to the rescue :3
-
-    # Transfer data from .mat to variable w/ scipy.io
-    grating_all_mat_data = sio.loadmat(filename)
-
-    #print(grating_all_mat_data)
-    # The above print statement was used temporarily to set a breakpoint and
-    # extrapolate more about what data structure grating_all_mat_data has.
-    # Debug mode tells us 'data' = {ndarray: (1,1)}, so we will break this up more.
-
-    # We use grating_all_mat_data['data'] and not grating_all_mat_data[0] since
-    # grating_all_mat_data is a dictionary. We extract only the "data" key/category
-    # since that is the one of interest.
-    grating_all_data = grating_all_mat_data['data']
-
-    # Same concept with extracting specific categories using keys from the
-    # dictionary of "data."
-    # [0][0][0] at the end is to extract the data from matlab 1x1 structs :(
-    #### stim_id -- was grating right or left? (0 = left, 1 = right)
-    stim_id = grating_all_data['stimID'][0][0][0]
-    #### response -- subject chose which side they thought had grating
-    #### (same codes as above)
-    response = grating_all_data['response'][0][0][0]
-    #### rating -- confidence rating, from 1 (least confident) to 4 (most)
-    #### negative value means did not respond in time
-    rating = grating_all_data['rating'][0][0][0]
-    #### response_rt -- reaction time, between stimulus onset and subject response
-    response_rt = grating_all_data['responseRT'][0][0][0]
-
-    # We organize all of this info into a pandas dataframe!
-    # Note: pandas.DataFrame expects a dict-like structure;
-    # wrapping columns in {} is required to build it correctly.
-    grating_df = pd.DataFrame(
-        {
-            "stimID": stim_id,
-            "response": response,
-            "rating": rating,
-            "responseRT": response_rt,
-        }
-    )
+### ==================== STEP 1: EXTRACT DATA ==================== ###
 
-    # returns final dataframe :3
-    return grating_df
+# load_data lives in utils/load_data.py, so loading the data doesn't require
+# importing any plotting libraries. Imported here so "from main import
+# load_data" still works.
 
 ### ==================== STEP 2: ANALYZE DATA ==================== ###
 
 ## 1.1
 
-def task_1_1(data, first_half_n_trials):
+def task_1_1(data, first_half_n_trials, ax=None, save_to=None):
     """
     RTs bar chart comparing first + second halves of experiment, with SEM error
     bars
     :param data:
     :param first_half_n_trials:
+    :param ax: axes to draw into (default: a new figure, shown at the end)
+    :param save_to: save the figure to this file instead of showing it
     :return:
     """
 
+    import seaborn as sns
+    from utils.render import axes_or_new, show_or_save
+
     # Splitting data into first/second halves
     # Add "whichHalf" column with "1-500" or "501-1000" as values
-    data['whichHalf'] = np.where(
-        data.index < first_half_n_trials, # condition
-        "1-500",   # value if T
-        "501-1000" # value if F
-    )
+    # (categorical: one byte per row instead of one Python string per row)
+    data['whichHalf'] = half_labels(data.index, first_half_n_trials)
 
     # plot them!
-    plt.figure(figsize=(5, 4))
+    fig, ax_rt = axes_or_new(ax, figsize=(5, 4))
     sns.barplot(
         data = data, # cursed.
         x = "whichHalf",
@@ -96,15 +55,16 @@ def task_1_1(data, first_half_n_trials):
         errorbar = "se",
         capsize = 0.2,
         color = "0.6",
+        ax = ax_rt,
     )
 
     # The fact I ended up having to import matplotlib for this in the end is... sad
     # (for some reason I thought I could get away with just importing seaborn :'))
-    plt.title("Reaction Times: First vs Second Half")
-    plt.xlabel("Trial Halves")
-    plt.ylabel("Mean Reaction Time (s)")
-    plt.tight_layout()
-    plt.show()
+    ax_rt.set_title("Reaction Times: First vs Second Half")
+    ax_rt.set_xlabel("Trial Halves")
+    ax_rt.set_ylabel("Mean Reaction Time (s)")
+    fig.tight_layout()
+    show_or_save(fig, save_to, show=ax is None)
 
 ## 1.2
 
@@ -118,6 +78,8 @@ def task_1_2(data, total_n_trials, first_half_n_trials):
     :return:
     """
 
+    import scipy.stats as stats
+
     # Slice the "responseRT" series into two halves
     first_half_rts = data["responseRT"].iloc[:first_half_n_trials]
     second_half_rts = data["responseRT"].iloc[first_half_n_trials:total_n_trials]
@@ -132,15 +94,20 @@ def task_1_2(data, total_n_trials, first_half_n_trials):
 
 ## 1.3
 
-def task_1_3(filtered_trials_data):
+def task_1_3(filtered_trials_data, ax=None, save_to=None):
     """
     Bar chart comparing medians of confidence levels from 1 to 4
     :param filtered_trials_data:
+    :param ax: axes to draw into (default: a new figure, shown at the end)
+    :param save_to: save the figure to this file instead of showing it
     :return:
     """
 
+    import seaborn as sns
+    from utils.render import axes_or_new, show_or_save
+
     # Plot median RT for confidence levels 1-4
-    plt.figure(figsize=(5, 4))
+    fig, ax_rt = axes_or_new(ax, figsize=(5, 4))
     sns.barplot(
         data = filtered_trials_data,
         x = "rating",
@@ -148,38 +115,38 @@ def task_1_3(filtered_trials_data):
         estimator = np.median, # set equal to ("pi", 50) for error bar
         errorbar = None,
         color = "0.6",
+        ax = ax_rt,
     )
 
-    plt.title("Median Reaction Times by Confidence Level")
-    plt.xlabel("Confidence Rating")
-    plt.ylabel("Median Reaction Time (s)")
-    plt.tight_layout()
-    plt.show()
+    ax_rt.set_title("Median Reaction Times by Confidence Level")
+    ax_rt.set_xlabel("Confidence Rating")
+    ax_rt.set_ylabel("Median Reaction Time (s)")
+    fig.tight_layout()
+    show_or_save(fig, save_to, show=ax is None)
 
 ## 1.4
 
-def task_1_4(data):
+def task_1_4(data, ax=None, save_to=None):
     """
     Calculating d' for confidence levels 1-4 respectively, and plotting all together
     :param data:
+    :param ax: axes to draw into (default: a new figure, shown at the end)
+    :param save_to: save the figure to this file instead of showing it
     :return:
     """
 
+    import seaborn as sns
+    from utils.render import axes_or_new, show_or_save
+
     conf_levels = [1, 2, 3, 4]
-    d_primes = []
-    # we will add the according d' values in the loop below!
-
-    # goes through 1, 2, 3, and 4
-    for lvl in conf_levels:
-        # filter the data with the chosen confidence
-        subset = data[data["rating"] == lvl]
-        # converts pandas series into numpy arrays
-        d_val = calc_d_prime(subset["stimID"].to_numpy(), subset["response"].to_numpy())
-        # add the calculated d' to the d_primes array (list, actually)
-        d_primes.append(d_val)
+
+    # d' for every confidence level in one go (one row per rating in the data);
+    # reindex picks out 1-4 in order (NaN if a level never came up)
+    d_prime_table = calc_d_prime_grouped(data, by="rating")
+    d_primes = d_prime_table["d_prime"].reindex(conf_levels).to_numpy()
 
     # plot!
-    plt.figure(figsize=(5, 4))
+    fig, ax_d = axes_or_new(ax, figsize=(5, 4))
     sns.barplot(
         # no "data =" required here, since we passed in arrays.
         # if we used a dataframe, we pass that as data, and then
@@ -188,29 +155,53 @@ def task_1_4(data):
         y = d_primes,
         errorbar = None,
         color = "0.6",
+        ax = ax_d,
     )
 
-    plt.title("d′ by Confidence Level")
-    plt.xlabel("Confidence Rating")
-    plt.ylabel("d′")
-    plt.tight_layout()
-    plt.show()
+    ax_d.set_title("d′ by Confidence Level")
+    ax_d.set_xlabel("Confidence Rating")
+    ax_d.set_ylabel("d′")
+    fig.tight_layout()
+    show_or_save(fig, save_to, show=ax is None)
 
 ## 1.5
 
-def task_1_5(data, first_half_trials_in):
+def task_1_5(data, first_half_trials_in, n_workers=1, n_boot=0, cache=None, ax=None, save_to=None):
     """
-    Calculate and plot meta-d' for the first and second halves of the experiment.
+    Calculate and plot meta-d' for the first and second halves of the experiment,
+    optionally with bootstrapped 95% confidence intervals as error bars.
     :param data: full dataframe
     :param first_half_trials_in: number of trials in the first half (precomputed)
+    :param n_workers: processes to fit the halves with (1 = no process pool)
+    :param n_boot: bootstrap replicates per half (default 0 = no error bars; a
+                   few hundred is plenty for a figure, each one is a meta-d' fit)
+    :param cache: optional FitCache so re-runs don't refit the same halves
+    :param ax: axes to draw into (default: a new figure, shown at the end)
+    :param save_to: save the figure to this file instead of showing it
     """
 
+    from utils.render import axes_or_new, show_or_save
+    from utils.meta_d.meta_d_prime_master import compute_meta_d_prime_many
+    from utils.meta_d.bootstrap import bootstrap_meta_d_prime
+
     # Split data into halves using boolean indexing/filters
     first_half = data[data.index < first_half_trials_in]
     second_half = data[data.index >= first_half_trials_in]
 
-    fit_first = compute_meta_d_prime(first_half)
-    fit_second = compute_meta_d_prime(second_half)
+    # fits come back in the same order the halves went in
+    fits = compute_meta_d_prime_many(
+        [first_half, second_half],
+        n_workers=n_workers,
+        cache=cache,
+    )
+    # a half whose fit raised comes back as a (falsy) TaskError; surface its
+    # error here, with the worker's traceback, rather than failing on fit["meta_da"]
+    for half_name, fit in zip(("first", "second"), fits):
+        if not fit:
+            raise RuntimeError(
+                f"meta-d' fit for the {half_name} half failed: {fit.error!r}\n{fit.traceback}"
+            ) from fit.error
+    fit_first, fit_second = fits
 
     # For checking meta-d' stats
     """
@@ -227,25 +218,168 @@ def task_1_5(data, first_half_trials_in):
     print(f"M_diff: {fit_second['M_diff']:.3f}")
     """
 
+    meta_ds = [fit_first["meta_da"], fit_second["meta_da"]]
+
     # Plot meta-d' for both halves
     # I gave up on using seaborn let's just use matplotlib smh
-    plt.figure(figsize=(5, 4))
-    plt.bar(
-        ["First Half", "Second Half"],
-        [fit_first["meta_da"], fit_second["meta_da"]],
-        color="0.6"
+    labels = ["First Half", "Second Half"]
+    fig, ax_meta = axes_or_new(ax, figsize=(5, 4))
+    ax_meta.bar(labels, meta_ds, color="0.6")
+
+    # Error bars: BCa bootstrap intervals, drawn as they are. The bootstrap refits
+    # with the batched fitter (no bounds on the criteria), so on awkward data its
+    # interval can miss the trust-constr estimate on the bar -- say so rather
+    # than hide it behind a zero-length error bar.
+    if n_boot:
+        cis = [
+            bootstrap_meta_d_prime(half, n_boot=n_boot, method="bca", n_workers=n_workers, seed=0)["ci"]["meta_da"]
+            for half in (first_half, second_half)
+        ]
+        for half_name, meta_d, (low, high) in zip(("first", "second"), meta_ds, cis):
+            if not low <= meta_d <= high:
+                warnings.warn(
+                    f"meta-d' for the {half_name} half ({meta_d:.3f}) is outside its bootstrap "
+                    f"interval [{low:.3f}, {high:.3f}]",
+                    RuntimeWarning,
+                    stacklevel=2,
+                )
+        lows, highs = np.array(cis).T
+        ax_meta.errorbar(labels, (lows + highs) / 2, yerr=(highs - lows) / 2, fmt="none", ecolor="k", capsize=5)
+    ax_meta.set_ylabel("meta-d′ (95% CI)" if n_boot else "meta-d′")
+    ax_meta.set_title("Meta-d′: First vs Second Half")
+    fig.tight_layout()
+    show_or_save(fig, save_to, show=ax is None)
+
+## Figures for many subjects
+
+# every figure, by name (1.2 is a t-test, no figure)
+FIGURES = ("1.1", "1.3", "1.4", "1.5", "rolling", "rolling_meta_d")
+
+
+def render_subject_figures(filename, out_dir, figures=FIGURES, n_boot=0, cache=None, fmt="png"):
+    """
+    Headless: draw one subject's figures and save them to files instead of
+    showing them. Files are named "<.mat file name>_<figure>.<fmt>".
+    Figures are reused (cleared and redrawn) between subjects in the same process.
+    :param filename: .mat file of one subject/session
+    :param out_dir: folder to save into
+    :param figures: which of FIGURES to draw
+    :param n_boot: bootstrap replicates for the 1.5 error bars (0 = none)
+    :param cache: optional FitCache for the meta-d' fits
+    :param fmt: file format, e.g. "png", "pdf", "svg"
+    :return: dict of figure name -> saved file path
+    """
+
+    from utils.render import reusable_axes, use_headless
+    use_headless()
+    from utils.supplementary import rolling_averages, rolling_meta_d
+
+    data = load_data(filename, compact=True)
+    first_half_trials = data.shape[0] // 2
+    # same filters as the __main__ block below
+    valid_ratings = data[data["rating"] > 0]
+    valid_trials = data[
+        data["stimID"].isin([0, 1]) & data["response"].isin([0, 1]) & data["rating"].between(1, 4)
+    ]
+
+    stem = os.path.join(out_dir, os.path.splitext(os.path.basename(filename))[0])
+    paths = {name: f"{stem}_{name}.{fmt}" for name in figures}
+
+    if "1.1" in figures:
+        task_1_1(data, first_half_trials, ax=reusable_axes("bar")[1], save_to=paths["1.1"])
+    if "1.3" in figures:
+        task_1_3(valid_ratings, ax=reusable_axes("bar")[1], save_to=paths["1.3"])
+    if "1.4" in figures:
+        task_1_4(data, ax=reusable_axes("bar")[1], save_to=paths["1.4"])
+    if "1.5" in figures:
+        task_1_5(valid_trials, first_half_trials, n_boot=n_boot, cache=cache,
+                 ax=reusable_axes("bar")[1], save_to=paths["1.5"])
+    if "rolling" in figures:
+        rolling_averages(valid_trials, first_half_trials,
+                         axes=reusable_axes("rolling", nrows=2, figsize=(10, 8), sharex=True)[1],
+                         save_to=paths["rolling"])
+    if "rolling_meta_d" in figures:
+        rolling_meta_d(valid_trials, first_half_trials,
+                       ax=reusable_axes("rolling_meta_d", figsize=(10, 4))[1],
+                       save_to=paths["rolling_meta_d"])
+
+    return paths
+
+
+def render_cohort_figures(filenames, out_dir, figures=FIGURES, n_workers=None, n_boot=0, cache=None, fmt="png"):
+    """
+    render_subject_figures for many subjects at once, in a pool of worker processes.
+    :param filenames: one .mat file per subject/session
+    :param n_workers: number of processes (default: all CPUs; 1 = no process pool)
+    :return: list, one entry per file, in order: dict of saved paths, or a
+             TaskError (see utils/parallel.py) if that subject failed
+    """
+
+    from utils.parallel import parallel_map
+
+    os.makedirs(out_dir, exist_ok=True)
+    render = partial(
+        render_subject_figures,
+        out_dir=out_dir,
+        figures=figures,
+        n_boot=n_boot,
+        cache=cache,
+        fmt=fmt,
     )
-    plt.ylabel("meta-d′")
-    plt.title("Meta-d′: First vs Second Half")
-    plt.tight_layout()
-    plt.show()
+    return parallel_map(render, filenames, n_workers=n_workers)
 
 ### ==================== STEP 3: EXECUTE ALL ==================== ###
 
+TASKS = ("1.1", "1.2", "1.3", "1.4", "1.5")
+
+
 if __name__ == "__main__":
 
     ### ==================== Prep ==================== ###
 
+    # e.g. "python main.py --tasks 1.2 1.4" to run just the quick tasks, or
+    # "python main.py data/*.mat --figures-dir figures" to save every subject's
+    # figures without opening any windows
+    parser = argparse.ArgumentParser(description="Analysis of grating2AFC data (tasks 1.1-1.5)")
+    parser.add_argument("filenames", nargs="*", default=["grating2AFC S11.mat"], help=".mat file(s) to analyze")
+    parser.add_argument("--tasks", nargs="+", choices=TASKS, default=TASKS, help="which tasks to run")
+    parser.add_argument("--figures-dir", help="save figures here instead of showing them (headless)")
+    parser.add_argument("--format", default="png", help="file format for --figures-dir")
+    # how many processes to fit meta-d' with (None = all CPUs, 1 = no process pool)
+    parser.add_argument("--workers", type=int, default=None, help="processes for the meta-d' fits (default: all CPUs)")
+    parser.add_argument("--n-boot", type=int, default=0,
+                        help="bootstrap replicates for the task 1.5 meta-d' CIs (default: 0, no error bars)")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write cached trials/fits")
+    args = parser.parse_args()
+
+    # meta-d' fits are remembered on disk between runs (delete the file to refit)
+    fit_cache = None
+    if not args.no_cache:
+        from utils.meta_d.fit_cache import FitCache
+        fit_cache = FitCache(path="meta_d_fits.sqlite")
+
+    if args.figures_dir is not None:
+        # one subject per worker process; the rolling figures come along too
+        figures = [name for name in FIGURES if name in args.tasks or name.startswith("rolling")]
+        results = render_cohort_figures(
+            args.filenames,
+            args.figures_dir,
+            figures=figures,
+            n_workers=args.workers,
+            n_boot=args.n_boot,
+            cache=fit_cache,
+            fmt=args.format,
+        )
+        failed = [(filename, result) for filename, result in zip(args.filenames, results) if not result]
+        print(f"saved figures for {len(results) - len(failed)} of {len(results)} files to {args.figures_dir}")
+        for filename, error in failed:
+            print(f"  {filename}: {error.error!r}", file=sys.stderr)
+        sys.exit(1 if failed else 0)
+
+    if len(args.filenames) != 1:
+        parser.error("several files can only be analyzed with --figures-dir")
+    filename = args.filenames[0]
+
     # "grating2AFC S11" probably stands for:
     #
     # grating -- the sinusoidal visual grating of the experiment
@@ -253,7 +387,7 @@ if __name__ == "__main__":
     # S11 -- Subject 11. they ran this on multiple subjects for sure, and this is only one
 
     # gimme dataframe :3
-    loaded_data = load_data("grating2AFC S11.mat")
+    loaded_data = load_data(filename, use_cache=not args.no_cache, compact=True)
 
     # {insert dataframe}.shape returns (rows, columns)
     # [0] is to extract number of rows
@@ -265,49 +399,52 @@ if __name__ == "__main__":
 
     ### ==================== 1.1 ==================== ###
 
-    # RTs bar chart comparing first + second halves of experiment, with SEM error
-    # bars
-    task_1_1(loaded_data, first_half_trials)
+    if "1.1" in args.tasks:
+        # RTs bar chart comparing first + second halves of experiment, with SEM error
+        # bars
+        task_1_1(loaded_data, first_half_trials)
 
     ### ==================== 1.2 ==================== ###
 
-    # T-test to see if RTs for the first and second half of the experiment differed
-    # significantly.
-    p_val = task_1_2(loaded_data, total_trials, first_half_trials)
-    print(
-        "1.2: \n\n"
-        "T-test results comparing RTs for first and second half of experiment:\n"
-        f"p-value: {p_val:.3g}\n" # .3g = 3 sigfigs w/ scientific notation
-        "Using a metric of minimal significance at p <= 0.05, "
-        "if this were displayed with a bar-chart, there would be a bracket with "
-        "two asterisks (**) above it — as the p-val is less than 0.01. This is a "
-        "significant result."
-    )
+    if "1.2" in args.tasks:
+        # T-test to see if RTs for the first and second half of the experiment differed
+        # significantly.
+        p_val = task_1_2(loaded_data, total_trials, first_half_trials)
+        print(
+            "1.2: \n\n"
+            "T-test results comparing RTs for first and second half of experiment:\n"
+            f"p-value: {p_val:.3g}\n" # .3g = 3 sigfigs w/ scientific notation
+            "Using a metric of minimal significance at p <= 0.05, "
+            "if this were displayed with a bar-chart, there would be a bracket with "
+            "two asterisks (**) above it — as the p-val is less than 0.01. This is a "
+            "significant result."
+        )
 
     ### ==================== 1.3 ==================== ###
 
-    # Filtering out invalid data for confidence (negative numbers)
-    valid_data = loaded_data[loaded_data["rating"] > 0]
+    if "1.3" in args.tasks:
+        # Filtering out invalid data for confidence (negative numbers)
+        valid_data = loaded_data[loaded_data["rating"] > 0]
 
-    # Bar chart comparing medians of confidence levels from 1 to 4
-    task_1_3(valid_data)
+        # Bar chart comparing medians of confidence levels from 1 to 4
+        task_1_3(valid_data)
 
     ### ==================== 1.4 ==================== ###
 
-    # Calculating d' for confidence levels 1-4 respectively
-    task_1_4(loaded_data)
+    if "1.4" in args.tasks:
+        # Calculating d' for confidence levels 1-4 respectively
+        task_1_4(loaded_data)
 
     ### ==================== 1.5 ==================== ###
 
-    # Define valid ranges
-    valid_stim_mask = loaded_data["stimID"].isin([0, 1])
-    valid_resp_mask = loaded_data["response"].isin([0, 1])
-    valid_rating_mask = loaded_data["rating"].between(1, 4)  # assuming 4-point confidence
-
-    # Apply all filters at once
-    valid_data_2 = loaded_data[valid_stim_mask & valid_resp_mask & valid_rating_mask]
-
-    # Calculating and plotting meta-d' for first half and second half of experiment.
-    task_1_5(valid_data_2, first_half_trials)
+    if "1.5" in args.tasks:
+        # Define valid ranges
+        valid_stim_mask = loaded_data["stimID"].isin([0, 1])
+        valid_resp_mask = loaded_data["response"].isin([0, 1])
+        valid_rating_mask = loaded_data["rating"].between(1, 4)  # assuming 4-point confidence
 
+        # Apply all filters at once
+        valid_data_2 = loaded_data[valid_stim_mask & valid_resp_mask & valid_rating_mask]
 
+        # Calculating and plotting meta-d' for first half and second half of experiment.
+        task_1_5(valid_data_2, first_half_trials, args.workers, n_boot=args.n_boot, cache=fit_cache)
@@ -0,0 +1,46 @@
+import warnings
+
+import numpy as np
+import pytest
+from utils.simulate import simulate_trials
+from utils.meta_d.bootstrap import BOOT_STATS, _bca_quantiles, bootstrap_meta_d_prime
+
+
+@pytest.fixture(scope="module")
+def session():
+    return simulate_trials(300, d_prime=1.5, meta_d=1., seed=1)
+
+
+@pytest.mark.parametrize("method", ["percentile", "bca"])
+def test_intervals_cover_every_stat(session, method):
+    result = bootstrap_meta_d_prime(session, n_boot=100, method=method, seed=0)
+    assert set(result["ci"]) == set(BOOT_STATS)
+    for stat in BOOT_STATS:
+        low, high = result["ci"][stat]
+        assert np.isfinite(low) and np.isfinite(high) and low <= high
+        assert result["replicates"][stat].shape == (100,)
+    assert result["method"] == method and result["ci_level"] == 0.95
+
+
+def test_same_seed_same_replicates(session):
+    # chunks carry their own seeds, so the draws don't depend on chunking/workers
+    first = bootstrap_meta_d_prime(session, n_boot=60, chunk_size=25, seed=7)
+    again = bootstrap_meta_d_prime(session, n_boot=60, chunk_size=25, seed=7, n_workers=2)
+    other = bootstrap_meta_d_prime(session, n_boot=60, chunk_size=25, seed=8)
+    np.testing.assert_array_equal(first["replicates"]["meta_da"], again["replicates"]["meta_da"])
+    assert first["ci"] == again["ci"]
+    assert not np.array_equal(first["replicates"]["meta_da"], other["replicates"]["meta_da"])
+
+
+def test_small_unpadded_sample_stays_quiet():
+    session = simulate_trials(40, d_prime=1., meta_d=1., seed=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        result = bootstrap_meta_d_prime(session, pad_cells=0, n_boot=50, method="bca", seed=0)
+    assert all(np.isfinite(result["ci"][stat]).all() for stat in BOOT_STATS)
+
+
+def test_bca_with_every_replicate_on_one_side():
+    quantiles = _bca_quantiles(np.arange(1., 11.), 0., 0., np.array([0.025, 0.975]))
+    assert np.all(np.isfinite(quantiles))
+    assert 0 < quantiles[0] < quantiles[1] < 1
@@ -0,0 +1,77 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import norm
+from utils.simulate import simulate_trials
+from utils.calc_d_prime import CORRECTIONS, calc_d_prime, calc_d_prime_grouped
+
+
+@pytest.fixture(scope="module")
+def session():
+    data = simulate_trials(120, n_subjects=3, d_prime=[0.8, 1.5, 2.5], c1=[-0.3, 0., 0.4], p_miss=0.05, seed=5)
+    data["half"] = np.where(data["trial"] < 60, "first", "second")
+    return data
+
+
+def _subset_c(stim, resp, correction):
+    # criterion c from scratch, as calc_d_prime would compute its rates
+    stim, resp = stim[resp >= 0], resp[resp >= 0]
+    hits, n_signal = np.sum((stim == 1) & (resp == 1)), np.sum(stim == 1)
+    false_hits, n_noise = np.sum((stim == 0) & (resp == 1)), np.sum(stim == 0)
+    if correction == "loglinear":
+        hit_rate, fa_rate = (hits + 0.5) / (n_signal + 1), (false_hits + 0.5) / (n_noise + 1)
+    else:
+        hit_rate, fa_rate = hits / n_signal, false_hits / n_noise
+        if correction == "1/2N":
+            hit_rate = np.clip(hit_rate, 1 / (2 * n_signal), 1 - 1 / (2 * n_signal))
+            fa_rate = np.clip(fa_rate, 1 / (2 * n_noise), 1 - 1 / (2 * n_noise))
+    return -(norm.ppf(hit_rate) + norm.ppf(fa_rate)) / 2
+
+
+@pytest.mark.parametrize("by", ["rating", ["subject", "half"]])
+@pytest.mark.parametrize("correction", CORRECTIONS)
+def test_groups_match_calc_d_prime_on_each_subset(session, by, correction):
+    with warnings.catch_warnings():
+        # small rating groups can have rates of exactly 0 or 1 without a correction
+        warnings.simplefilter("ignore", RuntimeWarning)
+        grouped = calc_d_prime_grouped(session, by, correction=correction)
+
+        valid = session[session["response"] >= 0]
+        for group, subset in valid.groupby(by):
+            row = grouped.loc[group]
+            stim, resp = subset["stimID"].to_numpy(), subset["response"].to_numpy()
+            np.testing.assert_allclose(row["d_prime"], calc_d_prime(stim, resp, correction), rtol=1e-12)
+            np.testing.assert_allclose(row["c"], _subset_c(stim, resp, correction), rtol=1e-12)
+        assert len(grouped) == valid.groupby(by).ngroups
+
+
+def _extreme_groups():
+    # group "perfect": HR = 1, FAR = 0; group "inverted": HR = 0, FAR = 1
+    stim = np.tile([1, 1, 1, 0, 0, 0], 2)
+    resp = np.concatenate(([1, 1, 1, 0, 0, 0], [0, 0, 0, 1, 1, 1]))
+    return pd.DataFrame({"stimID": stim, "response": resp, "group": ["perfect"] * 6 + ["inverted"] * 6})
+
+
+@pytest.mark.parametrize("correction", ["loglinear", "1/2N"])
+def test_corrections_keep_rates_of_0_and_1_finite(correction):
+    data = _extreme_groups()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        grouped = calc_d_prime_grouped(data, "group", correction=correction)
+        for group, subset in data.groupby("group"):
+            d = calc_d_prime(subset["stimID"].to_numpy(), subset["response"].to_numpy(), correction)
+            assert np.isfinite(d)
+            assert grouped.loc[group, "d_prime"] == pytest.approx(d)
+    assert np.all(np.isfinite(grouped[["hit_rate", "false_hits_rate", "d_prime", "c", "beta"]]))
+    assert np.all((grouped[["hit_rate", "false_hits_rate"]] > 0) & (grouped[["hit_rate", "false_hits_rate"]] < 1))
+    assert grouped.loc["perfect", "d_prime"] > 0 > grouped.loc["inverted", "d_prime"]
+
+
+def test_no_correction_gives_infinite_d_prime_and_warns():
+    with pytest.warns(RuntimeWarning, match="correction="):
+        grouped = calc_d_prime_grouped(_extreme_groups(), "group")
+    assert grouped.loc["perfect", "d_prime"] == np.inf
+    assert grouped.loc["inverted", "d_prime"] == -np.inf
+    assert np.isnan(grouped.loc["perfect", "c"])
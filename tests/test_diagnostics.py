@@ -0,0 +1,21 @@
+import numpy as np
+from utils.meta_d.diagnostics import diagnostics_table, summarize_diagnostics
+
+
+def _fit(wall_time, n_tables=None):
+    # just the diagnostics part of a scalar (n_tables=None) or batch fit
+    shape = () if n_tables is None else (n_tables,)
+    return {'diagnostics': {
+        'wall_time': np.full(shape, wall_time), 'nit': np.full(shape, 5), 'nfev': np.full(shape, 9),
+        'converged': np.full(shape, True), 'meta_d_at_bound': np.full(shape, False),
+        'criteria_at_bound': np.full(shape, 0), 'zero_cells': np.full(shape, 0),
+    }}
+
+
+def test_slowest_names_fits_not_rows():
+    # the batch fit takes three rows, so row numbers and fit positions differ
+    fits = [_fit(0.5, n_tables=3), _fit(0.1), None, _fit(2.0)]
+    table = diagnostics_table(fits, labels=["batch", "a", "failed", "b"])
+    slowest = summarize_diagnostics(table, slowest=2)['slowest']
+    assert slowest['fit'].tolist() == [3, 0]
+    assert slowest['label'].tolist() == ["b", "batch"]
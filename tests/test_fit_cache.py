@@ -0,0 +1,42 @@
+import numpy as np
+from utils.meta_d import fit_meta_d_MLE
+from utils.meta_d.fit_cache import FitCache, fit_cache_key
+
+NR_S1 = [20.125, 15.125, 10.125, 5.125, 4.125, 3.125, 2.125, 1.125]
+NR_S2 = NR_S1[::-1]
+
+
+def test_key_depends_on_counts_and_settings():
+    key = fit_cache_key(NR_S1, NR_S2, pad_cells=1)
+    assert key == fit_cache_key(np.array(NR_S1), tuple(NR_S2), pad_cells=1)
+    assert key != fit_cache_key(NR_S2, NR_S1, pad_cells=1)
+    assert key != fit_cache_key(NR_S1, NR_S2, pad_cells=0)
+    assert key != fit_cache_key(NR_S1, NR_S2, s=1.2, pad_cells=1)
+
+
+def test_fit_version_bump_invalidates_stored_fits(tmp_path, monkeypatch):
+    path = str(tmp_path / "fits.sqlite")
+    key = fit_cache_key(NR_S1, NR_S2)
+    FitCache(path=path).put(key, {"meta_da": 1.5})
+
+    # a fresh process (empty memory tier) still finds it on disk...
+    assert FitCache(path=path).get(key) == {"meta_da": 1.5}
+
+    # ...until the fitting code's version changes: the old fit is never looked up again
+    monkeypatch.setattr(fit_meta_d_MLE, "FIT_VERSION", fit_meta_d_MLE.FIT_VERSION + 1)
+    new_key = fit_cache_key(NR_S1, NR_S2)
+    assert new_key != key
+    cache = FitCache(path=path)
+    assert cache.get(new_key) is None
+    assert cache.misses == 1
+
+
+def test_cached_fits_are_copies():
+    cache = FitCache()
+    fit = {"meta_da": 1.5, "S1units": {"t2c1_rS2": np.array([0.5, 1.])}}
+    cache.put("k", fit)
+    fit["meta_da"] = 0.
+    got = cache.get("k")
+    got["S1units"]["t2c1_rS2"][0] = 9.
+    assert cache.get("k")["meta_da"] == 1.5
+    assert cache.get("k")["S1units"]["t2c1_rS2"][0] == 0.5
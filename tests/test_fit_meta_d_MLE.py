@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from scipy.optimize import approx_fprime
+from scipy.stats import norm
+from utils.meta_d.fit_meta_d_batch import criteria_to_increments
+from utils.meta_d.fit_meta_d_MLE import (
+    fit_meta_d_logL, fit_meta_d_logL_grad, fit_meta_d_logL_hess, fit_meta_d_logL_increments, fit_meta_d_MLE,
+    fit_meta_d_probs, relative_criterion,
+)
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"analytic_grad": True}, {"solver": "L-BFGS-B"}, {"init": "lookup"}])
+def test_single_rating_table(kwargs):
+    # one rating: no type 2 criteria (and no ordering constraints) to fit
+    fit = fit_meta_d_MLE([3, 1], [1, 3], **kwargs)
+    assert np.isfinite(fit["meta_da"])
+    assert fit["logL"] == 0.
+    assert len(fit["t2ca_rS1"]) == len(fit["t2ca_rS2"]) == 0
+
+
+def test_single_rating_table_matches_original():
+    # nothing moves meta-d' away from the heuristic start (value from the original port)
+    fit = fit_meta_d_MLE([3, 1], [1, 3])
+    assert fit["meta_da"] == pytest.approx(1.3465448300054244, abs=1e-6)
+
+
+def _simulated_tables(n_tables, nRatings, seed):
+    # count tables from ordinary observers (padded as compute_meta_d_prime does)
+    rng = np.random.default_rng(seed)
+    tables = []
+    for _ in range(n_tables):
+        d = rng.uniform(0.5, 2.5)
+        criteria = np.sort(rng.normal(0., 1., 2 * nRatings - 1))
+        edges = np.concatenate(([-np.inf], criteria, [np.inf]))
+        p_s1 = np.diff(norm.cdf(edges, -d / 2))
+        p_s2 = np.diff(norm.cdf(edges, d / 2))
+        pad = 1 / (2 * nRatings)
+        tables.append((rng.multinomial(200, p_s1) + pad, rng.multinomial(200, p_s2) + pad))
+    return tables
+
+
+@pytest.mark.parametrize("nRatings, s", [(3, 1), (4, 1), (4, 1.3)])
+def test_solvers_agree_on_ordinary_tables(nRatings, s):
+    for nR_S1, nR_S2 in _simulated_tables(4, nRatings, seed=nRatings):
+        trust = fit_meta_d_MLE(nR_S1, nR_S2, s=s)
+        lbfgs = fit_meta_d_MLE(nR_S1, nR_S2, s=s, solver="L-BFGS-B")
+        assert lbfgs["diagnostics"]["converged"]
+        assert lbfgs["logL"] == pytest.approx(trust["logL"], abs=1e-4)
+        assert lbfgs["meta_da"] == pytest.approx(trust["meta_da"], abs=1e-3)
+
+
+def _input_obj(counts, nRatings, s, d1=1.2, t1c1=0.1):
+    return (np.asarray(counts, dtype=float), nRatings, d1, t1c1, s, relative_criterion, norm.cdf, norm.pdf)
+
+
+def _random_parameters(rng, nRatings):
+    # [meta_d1, ordered type 2 criteria on either side of the type 1 criterion (0)]
+    below = -np.cumsum(rng.uniform(0.2, 1., nRatings - 1))[::-1]
+    above = np.cumsum(rng.uniform(0.2, 1., nRatings - 1))
+    return np.concatenate(([rng.uniform(-1., 3.)], below, above))
+
+
+@pytest.mark.parametrize("nRatings, s", [(2, 1), (4, 1), (4, 0.7), (6, 1.4)])
+def test_analytic_gradient_matches_finite_differences(nRatings, s):
+    rng = np.random.default_rng(nRatings)
+    for _ in range(5):
+        counts = rng.integers(1, 60, (2, 2 * nRatings)) + 0.5
+        inputObj = _input_obj(counts, nRatings, s)
+        params = _random_parameters(rng, nRatings)
+        numeric = approx_fprime(params, fit_meta_d_logL, 1e-6, inputObj)
+        np.testing.assert_allclose(fit_meta_d_logL_grad(params, inputObj), numeric, rtol=1e-4, atol=1e-3)
+
+        # and through the L-BFGS-B reparameterization
+        theta = np.concatenate((params[:1], criteria_to_increments(params[None, 1:], nRatings)[0]))
+        value, grad = fit_meta_d_logL_increments(theta, inputObj)
+        numeric = approx_fprime(theta, lambda t: fit_meta_d_logL_increments(t, inputObj)[0], 1e-6)
+        np.testing.assert_allclose(grad, numeric, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("nRatings, s", [(3, 1), (4, 1.3)])
+def test_fisher_hessian_matches_finite_differences_at_expected_counts(nRatings, s):
+    # the Hessian is the expected (Fisher) information, which is the exact
+    # Hessian when the counts equal their expectation under the parameters
+    rng = np.random.default_rng(nRatings)
+    for _ in range(3):
+        params = _random_parameters(rng, nRatings)
+        n_side = rng.uniform(20., 200., (2, 2))
+        pr = fit_meta_d_probs(params, _input_obj(np.ones((2, 2 * nRatings)), nRatings, s))[0]
+        counts = np.repeat(n_side, nRatings, axis=1) * pr
+        inputObj = _input_obj(counts, nRatings, s)
+        numeric = np.array([
+            approx_fprime(params, lambda p: fit_meta_d_logL_grad(p, inputObj)[k], 1e-6)
+            for k in range(len(params))
+        ])
+        np.testing.assert_allclose(fit_meta_d_logL_hess(params, inputObj), numeric, rtol=1e-4, atol=1e-3)
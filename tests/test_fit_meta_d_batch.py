@@ -0,0 +1,42 @@
+import warnings
+
+import numpy as np
+import pytest
+from utils.simulate import simulate_trials
+from utils.meta_d.trials_to_counts import trials_to_counts
+from utils.meta_d.fit_meta_d_MLE import fit_meta_d_MLE
+from utils.meta_d.fit_meta_d_batch import fit_meta_d_MLE_batch
+
+STATS = ('meta_da', 'da', 'M_ratio', 'M_diff', 'logL')
+
+
+def _tables(n_tables, n_ratings=4, n_trials=300):
+    rng = np.random.default_rng(0)
+    tables = []
+    for seed in range(n_tables):
+        trials = simulate_trials(n_trials, d_prime=rng.uniform(0.8, 2.), meta_d=rng.uniform(0.3, 2.),
+                                 c1=rng.uniform(-0.3, 0.3), n_ratings=n_ratings, seed=seed)
+        tables.append(trials_to_counts(trials['stimID'], trials['response'], trials['rating'], n_ratings, 1))
+    return np.array([t[0] for t in tables]), np.array([t[1] for t in tables])
+
+
+@pytest.mark.parametrize("n_ratings,s", [(4, 1), (3, 1.3)])
+def test_batch_matches_scalar_fits(n_ratings, s):
+    nr_s1, nr_s2 = _tables(6, n_ratings)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        batch = fit_meta_d_MLE_batch(nr_s1, nr_s2, s=s)
+    assert batch['converged'].all()
+    for i, (s1, s2) in enumerate(zip(nr_s1, nr_s2)):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            fit = fit_meta_d_MLE(s1, s2, s=s, analytic_grad=True)
+        for stat in STATS:
+            assert batch[stat][i] == pytest.approx(fit[stat], abs=1e-4), stat
+        np.testing.assert_allclose(batch['t2ca_rS2'][i], fit['t2ca_rS2'], atol=1e-4)
+
+
+def test_single_table_gives_one_row():
+    nr_s1, nr_s2 = _tables(1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        batch = fit_meta_d_MLE_batch(nr_s1[0], nr_s2[0])
+    assert batch['meta_da'].shape == (1,)
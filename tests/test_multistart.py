@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from utils.meta_d.fit_meta_d_MLE import fit_meta_d_MLE
+from utils.meta_d.multistart import fit_meta_d_MLE_multistart
+
+# a well-behaved table: every start should find the same optimum
+NR_S1 = np.array([52, 32, 35, 37, 26, 12, 4, 2]) + 1 / 8
+NR_S2 = np.array([2, 5, 15, 22, 33, 38, 40, 45]) + 1 / 8
+
+
+def test_stops_once_starts_agree():
+    fit = fit_meta_d_MLE_multistart(NR_S1, NR_S2, n_starts=16, wave_size=4, confirm=2)
+    report = fit['multistart']
+    assert report['stopped_early']
+    assert report['n_starts'] < 16
+    assert report['n_confirmed'] >= 2
+    assert len(report['logL']) == report['n_starts']
+    assert fit['logL'] >= fit_meta_d_MLE(NR_S1, NR_S2)['logL'] - 1e-6
+
+
+def test_runs_every_start_and_warns_when_unconfirmed():
+    with pytest.warns(RuntimeWarning, match="starts reached the best logL"):
+        fit = fit_meta_d_MLE_multistart(NR_S1, NR_S2, n_starts=8, wave_size=4, confirm=9)
+    report = fit['multistart']
+    assert not report['stopped_early']
+    assert report['n_starts'] == 8
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from utils.simulate import simulate_trials
+from utils.meta_d.trials_to_counts import trials_to_cells, trials_to_counts
+from utils.meta_d.rolling_meta_d import rolling_counts
+
+
+@pytest.fixture(scope="module")
+def session():
+    # some missed trials, so invalid ones sit inside the windows too
+    return simulate_trials(203, d_prime=1.5, p_miss=0.1, seed=3)
+
+
+# steps that overlap windows, tile them exactly, skip trials between them, and
+# (step=3, window=20 on 203 trials) end exactly on the last trial
+@pytest.mark.parametrize("window, step", [(20, 1), (20, 3), (25, 7), (20, 20), (20, 30), (203, 1)])
+def test_windows_match_recounting(session, window, step):
+    n_ratings = 4
+    valid, cell = trials_to_cells(session["stimID"], session["response"], session["rating"], n_ratings)
+    starts, counts = rolling_counts(cell, valid, n_ratings, window, step)
+
+    np.testing.assert_array_equal(starts, np.arange(0, len(session) - window + 1, step))
+    for start, row in zip(starts, counts):
+        trials = session.iloc[start:start + window]
+        nr_s1, nr_s2 = trials_to_counts(trials["stimID"], trials["response"], trials["rating"], n_ratings)
+        np.testing.assert_array_equal(row, np.concatenate((nr_s1, nr_s2)))
+
+
+def test_window_longer_than_session(session):
+    valid, cell = trials_to_cells(session["stimID"], session["response"], session["rating"], 4)
+    starts, counts = rolling_counts(cell, valid, 4, window=len(session) + 1)
+    assert starts.shape == (0,) and counts.shape == (0, 16)
@@ -0,0 +1,34 @@
+import warnings
+
+import pytest
+from utils.render import use_headless
+from utils.simulate import simulate_trials
+
+use_headless()
+
+import main  # noqa: E402
+from utils.meta_d import bootstrap  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def session():
+    return simulate_trials(400, d_prime=1.5, meta_d=1., seed=1)
+
+
+def test_no_bootstrap_by_default(session, tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("bootstrapped without n_boot")
+    monkeypatch.setattr(bootstrap, "bootstrap_meta_d_prime", fail)
+    main.task_1_5(session, 200, save_to=str(tmp_path / "1.5.png"))
+    assert (tmp_path / "1.5.png").exists()
+
+
+def test_warns_when_estimate_outside_interval(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(bootstrap, "bootstrap_meta_d_prime",
+                        lambda *args, **kwargs: {"ci": {"meta_da": (50., 60.)}})
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        main.task_1_5(session, 200, n_boot=10, save_to=str(tmp_path / "1.5.png"))
+    messages = [str(w.message) for w in caught if issubclass(w.category, RuntimeWarning)]
+    assert any("first half" in m and "outside its bootstrap interval" in m for m in messages)
+    assert any("second half" in m and "outside its bootstrap interval" in m for m in messages)
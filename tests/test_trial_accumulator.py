@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from utils.simulate import simulate_trials
+from utils.trial_accumulator import TrialAccumulator
+
+
+@pytest.fixture(scope="module")
+def session():
+    data = simulate_trials(301, d_prime=1.2, p_miss=0.05, seed=4)
+    # a few unrecorded RTs on otherwise valid trials
+    data.loc[data.index[::37], "responseRT"] = np.nan
+    return data
+
+
+def _add_batch(acc, trials):
+    return acc.add_batch(trials["stimID"], trials["response"], trials["rating"], trials["responseRT"])
+
+
+def _assert_same_snapshot(got, expected):
+    assert got.keys() == expected.keys()
+    for key, value in expected.items():
+        np.testing.assert_allclose(got[key], value, rtol=1e-12, err_msg=key)
+
+
+@pytest.mark.parametrize("split", [0, 1, 150, 300, 301])
+def test_merged_halves_match_one_pass(session, split):
+    whole = _add_batch(TrialAccumulator(), session)
+    first = _add_batch(TrialAccumulator(), session.iloc[:split])
+    second = _add_batch(TrialAccumulator(), session.iloc[split:])
+    _assert_same_snapshot(first.merge(second).snapshot(), whole.snapshot())
+
+
+def test_one_pass_matches_trial_by_trial_and_pandas(session):
+    whole = _add_batch(TrialAccumulator(), session)
+    by_trial = TrialAccumulator()
+    for row in session.itertuples():
+        by_trial.add(row.stimID, row.response, row.rating, row.responseRT)
+    _assert_same_snapshot(by_trial.snapshot(), whole.snapshot())
+
+    rts = session.loc[session["response"].isin([0, 1]), "responseRT"].dropna()
+    assert whole.rt_n == len(rts)
+    assert whole.rt_mean == pytest.approx(rts.mean(), rel=1e-12)
+    assert whole.rt_var == pytest.approx(rts.var(), rel=1e-12)
+
+
+def test_merge_needs_matching_n_ratings():
+    with pytest.raises(ValueError):
+        TrialAccumulator(4).merge(TrialAccumulator(6))
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+from utils import trial_cache
+from utils.trial_cache import cache_path, load_cached_columns
+
+
+def _session(tmp_path):
+    # a stand-in source file, and a parser that counts how often it runs
+    source = tmp_path / "session.mat"
+    source.write_bytes(b"trials v1")
+    calls = []
+
+    def parse(path):
+        calls.append(path)
+        return {"rating": np.array([1, 2, 3, 4]), "responseRT": np.array([0.5, 0.6, 0.7, 0.8])}
+
+    return str(source), parse, calls
+
+
+def test_second_load_comes_from_the_cache(tmp_path):
+    source, parse, calls = _session(tmp_path)
+    first = load_cached_columns(source, parse)
+    second = load_cached_columns(source, parse)
+    assert len(calls) == 1
+    np.testing.assert_array_equal(first["rating"], second["rating"])
+    assert second["responseRT"].dtype == np.float64
+
+
+def test_corrupt_bundle_is_rebuilt(tmp_path):
+    source, parse, calls = _session(tmp_path)
+    load_cached_columns(source, parse)
+    path = cache_path(source)
+
+    # truncated mid-write by something other than us
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+    columns = load_cached_columns(source, parse)
+    assert len(calls) == 2
+    np.testing.assert_array_equal(columns["rating"], [1, 2, 3, 4])
+
+    # and the rewritten bundle is good again
+    load_cached_columns(source, parse)
+    assert len(calls) == 2
+
+    # not a zip at all
+    with open(path, "wb") as f:
+        f.write(b"garbage")
+    load_cached_columns(source, parse)
+    assert len(calls) == 3
+
+
+def test_changed_source_is_reparsed(tmp_path):
+    source, parse, calls = _session(tmp_path)
+    load_cached_columns(source, parse)
+    with open(source, "wb") as f:
+        f.write(b"trials v2, longer")
+    load_cached_columns(source, parse)
+    assert len(calls) == 2
+
+
+def test_copied_source_restamps_the_cache(tmp_path):
+    source, parse, calls = _session(tmp_path)
+    load_cached_columns(source, parse)
+    # same content, new mtime: hashed, not re-parsed
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    load_cached_columns(source, parse)
+    load_cached_columns(source, parse)
+    assert len(calls) == 1
+
+
+def test_old_format_is_rebuilt(tmp_path, monkeypatch):
+    source, parse, calls = _session(tmp_path)
+    load_cached_columns(source, parse)
+    monkeypatch.setattr(trial_cache, "CACHE_FORMAT", trial_cache.CACHE_FORMAT + 1)
+    load_cached_columns(source, parse)
+    assert len(calls) == 2
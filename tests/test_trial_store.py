@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.trial_store import TrialStore, build_trial_store
+
+
+def _trials(n, offset):
+    return pd.DataFrame({
+        "stimID": np.arange(n) % 2,
+        "response": (np.arange(n) + 1) % 2,
+        "rating": np.arange(n) % 4 + 1,
+        "responseRT": offset + np.arange(n) / 10,
+    })
+
+
+def test_frame_needs_a_selection(tmp_path):
+    store = build_trial_store(str(tmp_path / "store"), [("S1", 1, _trials(5, 0.)), ("S2", 1, _trials(3, 1.))])
+    with pytest.raises(ValueError):
+        store.frame()
+    # the pooled store stays memory-mapped
+    assert isinstance(store.columns()["responseRT"], np.memmap)
+    pd.testing.assert_frame_equal(store.frame("S2"), _trials(3, 1.), check_dtype=False)
+
+
+@pytest.mark.parametrize("column, values", [
+    ("rating", [1, 2, 40000]),    # wraps around in int16
+    ("response", [0., 1., 0.5]),  # would be truncated to 0
+    ("stimID", [0., np.nan, 1.]),
+])
+def test_rejects_values_the_store_cant_hold(tmp_path, column, values):
+    trials = _trials(3, 0.)
+    trials[column] = values
+    with pytest.raises(ValueError, match=column):
+        build_trial_store(str(tmp_path / "store"), [("S1", 1, trials)])
+    # nothing half-written is left behind
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_whole_numbered_floats_are_fine(tmp_path):
+    trials = _trials(4, 0.).astype({"rating": float})
+    store = build_trial_store(str(tmp_path / "store"), [("S1", 1, trials)])
+    np.testing.assert_array_equal(store.columns("S1")["rating"], [1, 2, 3, 4])
+
+
+def test_failed_rebuild_keeps_the_old_store(tmp_path):
+    path = str(tmp_path / "store")
+    build_trial_store(path, [("S1", 1, _trials(5, 0.))])
+
+    def sessions():
+        yield "S2", 1, _trials(3, 1.)
+        raise RuntimeError("loader failed")
+
+    with pytest.raises(RuntimeError):
+        build_trial_store(path, sessions())
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["store"]
+    pd.testing.assert_frame_equal(TrialStore(path).frame("S1"),
+                                  _trials(5, 0.), check_dtype=False)
+
+    # a successful rebuild replaces it
+    store = build_trial_store(path, [("S2", 1, _trials(3, 1.))])
+    assert store.subjects == ["S2"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["store"]
+
+
+def test_wont_overwrite_other_directories(tmp_path):
+    (tmp_path / "notes.txt").write_text("keep me")
+    with pytest.raises(FileExistsError):
+        build_trial_store(str(tmp_path), [("S1", 1, _trials(2, 0.))])
@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from utils.meta_d.trials_to_counts import trials_to_counts
+
+# the shipped example session, at the repo root
+DATA_CSV = Path(__file__).resolve().parent.parent / "grating2AFC_S11.csv"
+
+
+def _loop_counts(stim_id, response, rating, n_ratings, pad_cells=0, pad_amount=None):
+    # the original trials2counts port, loop for loop
+    kept = [
+        (s, rp, rt) for s, rp, rt in zip(stim_id, response, rating)
+        if (s == 0 or s == 1) and (rp == 0 or rp == 1) and (rt >= 1 and rt <= n_ratings)
+    ]
+    if pad_amount is None:
+        pad_amount = 1 / (2 * n_ratings)
+    nr_s1, nr_s2 = [], []
+    for resp, ratings in ((0, range(n_ratings, 0, -1)), (1, range(1, n_ratings + 1))):
+        for r in ratings:
+            nr_s1.append(sum(1 for s, rp, rt in kept if s == 0 and rp == resp and rt == r))
+            nr_s2.append(sum(1 for s, rp, rt in kept if s == 1 and rp == resp and rt == r))
+    if pad_cells:
+        nr_s1 = [n + pad_amount for n in nr_s1]
+        nr_s2 = [n + pad_amount for n in nr_s2]
+    return nr_s1, nr_s2
+
+
+def _random_trials(n, n_ratings, seed):
+    # mostly valid trials, plus missed responses, odd codes and out-of-range ratings
+    rng = np.random.default_rng(seed)
+    stim_id = rng.choice([0, 1, 1, 0, 2, -1], n)
+    response = rng.choice([0, 1, 0, 1, -1], n)
+    rating = rng.integers(-1, n_ratings + 2, n)
+    return stim_id, response, rating
+
+
+@pytest.mark.parametrize("n_ratings", [2, 4, 6])
+@pytest.mark.parametrize("pad_cells", [0, 1])
+def test_matches_the_original_loop(n_ratings, pad_cells):
+    stim_id, response, rating = _random_trials(2000, n_ratings, seed=n_ratings)
+    expected = _loop_counts(stim_id, response, rating, n_ratings, pad_cells)
+    nr_s1, nr_s2 = trials_to_counts(stim_id, response, rating, n_ratings, pad_cells)
+    np.testing.assert_array_equal(nr_s1, expected[0])
+    np.testing.assert_array_equal(nr_s2, expected[1])
+
+
+def test_matches_on_the_shipped_session():
+    data = pd.read_csv(DATA_CSV)
+    expected = _loop_counts(data["stimID"], data["response"], data["rating"], 4, 1)
+    # compact int8 columns count the same as int64 ones
+    for dtype in (np.int64, np.int8):
+        columns = data[["stimID", "response", "rating"]].astype(dtype)
+        nr_s1, nr_s2 = trials_to_counts(columns["stimID"], columns["response"], columns["rating"], 4, 1)
+        np.testing.assert_array_equal(nr_s1, expected[0])
+        np.testing.assert_array_equal(nr_s2, expected[1])
+
+
+def test_docstring_example():
+    nr_s1, nr_s2 = trials_to_counts([0, 1, 0, 0, 1, 1, 1, 1], [0, 1, 1, 1, 0, 0, 1, 1], [1, 2, 3, 4, 4, 3, 2, 1], 4)
+    assert list(nr_s1) == [0, 0, 0, 1, 0, 0, 1, 1]
+    assert list(nr_s2) == [1, 1, 0, 0, 1, 2, 0, 0]
+
+
+def test_length_mismatch_is_rejected():
+    with pytest.raises(ValueError):
+        trials_to_counts([0, 1], [0, 1, 1], [1, 2], 4)
@@ -1,13 +1,64 @@
+import warnings
 import numpy as np
-from scipy.stats import norm
+import pandas as pd
+# ndtri is the same function as scipy.stats.norm.ppf, without the ~1 s import
+from scipy.special import ndtri
 
-def calc_d_prime(stim, resp):
+# corrections for hit/false alarm rates of exactly 0 or 1 (which give d' = +-inf)
+#### 'loglinear' -- Hautus (1995): add 0.5 to the counts and 1 to the totals
+#### '1/2N'      -- Macmillan & Kaplan (1985): 0 -> 1/(2N), 1 -> 1 - 1/(2N)
+CORRECTIONS = (None, 'loglinear', '1/2N')
+
+
+def _rates(hits, total_signal, false_hits, total_noise, correction=None):
+    """
+    Hit and false hit rates (scalars or arrays), with an optional correction.
+
+    :return: hit_rate, false_hits_rate
+    """
+
+    if correction not in CORRECTIONS:
+        raise ValueError(f"correction must be one of {CORRECTIONS}")
+
+    hits = np.asarray(hits, dtype=float)
+    total_signal = np.asarray(total_signal, dtype=float)
+    false_hits = np.asarray(false_hits, dtype=float)
+    total_noise = np.asarray(total_noise, dtype=float)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if correction == 'loglinear':
+            hit_rate = (hits + 0.5) / (total_signal + 1)
+            false_hits_rate = (false_hits + 0.5) / (total_noise + 1)
+        else:
+            hit_rate = hits / total_signal
+            false_hits_rate = false_hits / total_noise
+            if correction == '1/2N':
+                hit_rate = np.clip(hit_rate, 1 / (2 * total_signal), 1 - 1 / (2 * total_signal))
+                false_hits_rate = np.clip(false_hits_rate, 1 / (2 * total_noise), 1 - 1 / (2 * total_noise))
+
+    # Edge case: no signal or noise trials :(
+    hit_rate = np.where(total_signal > 0, hit_rate, np.nan)
+    false_hits_rate = np.where(total_noise > 0, false_hits_rate, np.nan)
+
+    if correction is None and np.any(np.isin(hit_rate, (0, 1)) | np.isin(false_hits_rate, (0, 1))):
+        warnings.warn(
+            "hit or false hit rate of exactly 0 or 1 gives an infinite d'; "
+            "pass correction='loglinear' or '1/2N' to avoid this",
+            RuntimeWarning,
+            stacklevel=3,
+        )
+
+    return hit_rate, false_hits_rate
+
+
+def calc_d_prime(stim, resp, correction=None):
     """
     Compute d′ directly from stimulus IDs and responses.
     Filters out invalid responses automatically.
 
     :param stim: 0 = noise (left), 1 = signal (right)
     :param resp: 0 = said 'left', 1 = said 'right', <0 = invalid (ignored)
+    :param correction: None, 'loglinear' or '1/2N' (see CORRECTIONS above)
     :return: d-prime value (float)
     """
 
@@ -35,13 +86,64 @@ def calc_d_prime(stim, resp):
         return np.nan
 
     # Calculate rates (turns them into 0 <= value <= 1)
-    hit_rate = hits / total_signal
-    false_hits_rate = false_hits / total_noise
+    hit_rate, false_hits_rate = _rates(hits, total_signal, false_hits, total_noise, correction)
 
     # Calculate final d′
-    # .ppf is (percent point function); finds what z-score it’s supposed to be
-    # assuming a standard normal curve (mean = 0, sd = 1)
-    z_hit_rate = norm.ppf(hit_rate)
-    z_false_hit_rate = norm.ppf(false_hits_rate)
+    # ndtri (= norm.ppf, the percent point function) finds what z-score it’s
+    # supposed to be assuming a standard normal curve (mean = 0, sd = 1)
+    z_hit_rate = ndtri(hit_rate)
+    z_false_hit_rate = ndtri(false_hits_rate)
+
+    return z_hit_rate - z_false_hit_rate
+
+
+def calc_d_prime_grouped(data, by, correction=None, stim_col="stimID", resp_col="response"):
+    """
+    Compute d′, criterion c and beta for every group of a dataframe in one pass
+    (e.g. by="rating", or by=["subject", "half"]), instead of filtering and
+    calling calc_d_prime once per group.
+
+    :param data: pandas DataFrame with stimulus and response columns
+    :param by: column name, or list of column names, to group on
+    :param correction: None, 'loglinear' or '1/2N' (see CORRECTIONS above)
+    :param stim_col: stimulus column (0 = noise, 1 = signal)
+    :param resp_col: response column (0/1, <0 = invalid and ignored)
+    :return: DataFrame indexed by group with counts, rates, d_prime, c and beta
+    """
+
+    # Filter out invalid responses (negative codes), same as calc_d_prime
+    data = data[data[resp_col] >= 0]
+    stim = data[stim_col]
+    resp = data[resp_col]
+
+    # one indicator column per count, then a single groupby-sum does every group
+    indicators = pd.DataFrame(
+        {
+            "hits": (stim == 1) & (resp == 1),
+            "total_signal": stim == 1,
+            "false_hits": (stim == 0) & (resp == 1),
+            "total_noise": stim == 0,
+        },
+        index=data.index,
+    ).astype(np.int64)
+    by = [by] if isinstance(by, str) else list(by)
+    counts = indicators.groupby([data[col] for col in by], observed=True).sum()
+
+    hit_rate, false_hits_rate = _rates(
+        counts["hits"], counts["total_signal"], counts["false_hits"], counts["total_noise"], correction
+    )
+    z_hit_rate = ndtri(hit_rate)
+    z_false_hit_rate = ndtri(false_hits_rate)
+
+    result = counts.copy()
+    result["hit_rate"] = hit_rate
+    result["false_hits_rate"] = false_hits_rate
+    # criterion c = -(Z(HR) + Z(FAR)) / 2, and beta = exp(d' * c)
+    # (uncorrected rates of 0/1 give infinite z-scores, so c and beta can be nan;
+    #  _rates has already warned about that)
+    with np.errstate(invalid='ignore', over='ignore'):
+        result["d_prime"] = z_hit_rate - z_false_hit_rate
+        result["c"] = -(z_hit_rate + z_false_hit_rate) / 2
+        result["beta"] = np.exp(result["d_prime"] * result["c"])
 
-    return z_hit_rate - z_false_hit_rate
\ No newline at end of file
+    return result
@@ -0,0 +1,90 @@
+import pandas as pd
+from utils.trial_cache import load_cached_columns
+from utils.trial_data import compact_trials
+
+# Loading lives here (not in main.py) so scripts and worker processes that
+# only need the data don't pay for importing the plotting libraries.
+# scipy.io is only imported when a .mat file actually has to be parsed
+# (i.e. not when its columns are already cached).
+
+
+def read_mat_columns(filename):
+    """
+    Parses the trial columns we care about out of a .mat file.
+    (load_data caches the result, so this only runs when the file is new/changed)
+    :param filename:
+    :return: dict of column name -> numpy array
+    """
+
+    # grating2AFC S11.mat has the data we need in it! But it is binary/archive
+    # format, so not directly viewable. Scipy to the rescue :3
+
+    # Transfer data from .mat to variable w/ scipy.io
+    import scipy.io as sio
+    grating_all_mat_data = sio.loadmat(filename)
+
+    #print(grating_all_mat_data)
+    # The above print statement was used temporarily to set a breakpoint and
+    # extrapolate more about what data structure grating_all_mat_data has.
+    # Debug mode tells us 'data' = {ndarray: (1,1)}, so we will break this up more.
+
+    # We use grating_all_mat_data['data'] and not grating_all_mat_data[0] since
+    # grating_all_mat_data is a dictionary. We extract only the "data" key/category
+    # since that is the one of interest.
+    grating_all_data = grating_all_mat_data['data']
+
+    # Same concept with extracting specific categories using keys from the
+    # dictionary of "data."
+    # [0][0][0] at the end is to extract the data from matlab 1x1 structs :(
+    #### stim_id -- was grating right or left? (0 = left, 1 = right)
+    stim_id = grating_all_data['stimID'][0][0][0]
+    #### response -- subject chose which side they thought had grating
+    #### (same codes as above)
+    response = grating_all_data['response'][0][0][0]
+    #### rating -- confidence rating, from 1 (least confident) to 4 (most)
+    #### negative value means did not respond in time
+    rating = grating_all_data['rating'][0][0][0]
+    #### response_rt -- reaction time, between stimulus onset and subject response
+    response_rt = grating_all_data['responseRT'][0][0][0]
+
+    return {
+        "stimID": stim_id,
+        "response": response,
+        "rating": rating,
+        "responseRT": response_rt,
+    }
+
+
+def load_data(filename, use_cache=True, compact=False):
+    """
+    Takes in file name as a string and converts it to a pandas DataFrame.
+    Accepts .mat files.
+    :param filename:
+    :param use_cache: reuse the typed columns saved next to the .mat file
+                      (see utils/trial_cache.py) instead of re-parsing it
+    :param compact: store the stimID/response/rating codes as int8, RTs stay
+                    float64 (see utils/trial_data.py). The .mat columns already
+                    load as uint8/int16, so this saves ~1.2x (13 -> 11 bytes per
+                    trial); ~2.9x against int64 columns, e.g. from a CSV
+    :return:
+    """
+
+    columns = load_cached_columns(filename, read_mat_columns, use_cache=use_cache)
+
+    # We organize all of this info into a pandas dataframe!
+    # Note: pandas.DataFrame expects a dict-like structure;
+    # wrapping columns in {} is required to build it correctly.
+    grating_df = pd.DataFrame(
+        {
+            "stimID": columns["stimID"],
+            "response": columns["response"],
+            "rating": columns["rating"],
+            "responseRT": columns["responseRT"],
+        }
+    )
+
+    if compact:
+        grating_df = compact_trials(grating_df)
+
+    # returns final dataframe :3
+    return grating_df
@@ -0,0 +1,144 @@
+import numpy as np
+from scipy.special import ndtr, ndtri
+from utils.parallel import parallel_map
+from utils.meta_d.trials_to_counts import infer_n_ratings, trials_to_counts
+from utils.meta_d.fit_meta_d_batch import fit_meta_d_MLE_batch
+
+# fit fields we keep for every replicate
+BOOT_STATS = ('meta_da', 'da', 'M_ratio', 'M_diff')
+
+
+def _fit_stats(nr_s1, nr_s2, init):
+    # fit a stack of tables (warm started at init) and keep only BOOT_STATS
+    # (small or degenerate resamples hit log(0)/0-by-0 on the way; the fitter
+    # handles those, and its 'converged' flags record how it went)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fit = fit_meta_d_MLE_batch(nr_s1, nr_s2, init=init)
+    stats = {stat: fit[stat] for stat in BOOT_STATS}
+    stats['converged'] = fit['converged']
+    return stats
+
+
+def _fit_replicates(task):
+    # runs in a worker: draw one chunk of replicate count tables and fit them
+    seed, size, raw_s1, raw_s2, pad_amount, init = task
+    rng = np.random.default_rng(seed)
+
+    # resampling trials with replacement within each stimulus class is the
+    # same as a multinomial draw over that stimulus' response/rating cells
+    boot_s1 = rng.multinomial(int(raw_s1.sum()), raw_s1 / raw_s1.sum(), size=size)
+    boot_s2 = rng.multinomial(int(raw_s2.sum()), raw_s2 / raw_s2.sum(), size=size)
+
+    return _fit_stats(boot_s1 + pad_amount, boot_s2 + pad_amount, init)
+
+
+def _jackknife_acceleration(raw_s1, raw_s2, pad_amount, init, estimates):
+    # BCa acceleration from a leave-one-trial-out jackknife. Dropping any trial
+    # from the same cell gives the same table, so only one fit per non-empty
+    # cell is needed, weighted by that cell's count.
+    raw = np.stack((raw_s1, raw_s2))
+    cells = np.argwhere(raw > 0)
+    weights = raw[tuple(cells.T)]
+
+    jack = np.repeat(raw[None], len(cells), axis=0)
+    jack[np.arange(len(cells)), cells[:, 0], cells[:, 1]] -= 1
+    fits = _fit_stats(jack[:, 0] + pad_amount, jack[:, 1] + pad_amount, init)
+
+    acceleration = {}
+    for stat in estimates:
+        theta = fits[stat]
+        diff = np.sum(weights * theta) / np.sum(weights) - theta
+        denom = 6 * np.sum(weights * diff ** 2) ** 1.5
+        acceleration[stat] = np.sum(weights * diff ** 3) / denom if denom > 0 else 0.
+    return acceleration
+
+
+def _bca_quantiles(boot, estimate, acceleration, quantiles):
+    # BCa-adjusted quantile levels. The bias correction comes from where the
+    # estimate sits among the replicates; that share is kept within
+    # [1/(n+1), n/(n+1)], so replicates all on one side of the estimate give
+    # the most extreme finite correction rather than z0 = +-inf (and nan quantiles)
+    n = boot.size
+    share = np.mean(boot < estimate) + 0.5 * np.mean(boot == estimate)
+    z0 = ndtri(np.clip(share, 1 / (n + 1), n / (n + 1)))
+    z = z0 + ndtri(quantiles)
+    return ndtr(z0 + z / (1 - acceleration * z))
+
+
+def bootstrap_meta_d_prime(data, n_ratings=4, pad_cells=1, n_boot=2000, ci=0.95, method='percentile',
+                           n_workers=1, chunk_size=500, seed=None):
+    """
+    Bootstrap confidence intervals for meta-d', d', M_ratio and M_diff.
+
+    Trials are resampled within each stimulus class (as multinomial draws of the
+    trials_to_counts tables), every replicate is fitted with the batched fitter
+    warm-started from the full-data solution, and chunks of replicates are
+    spread over worker processes.
+
+    :param data: pandas DataFrame with 'stimID', 'response', and 'rating'
+    :param n_ratings: number of confidence ratings (default 4); 'infer' takes
+                      the highest rating in the data (see infer_n_ratings)
+    :param pad_cells: whether to pad counts (after resampling) to avoid log(0) issues
+    :param n_boot: number of bootstrap replicates
+    :param ci: confidence level of the intervals
+    :param method: 'percentile' or 'bca' (bias-corrected and accelerated)
+    :param n_workers: processes to fit replicates with (1 = no process pool)
+    :param chunk_size: replicates drawn and fitted per task
+    :param seed: seed for the resampling; results don't depend on n_workers
+    :return: dict with the full-data estimate of each stat, plus 'ci'
+             ({stat: (low, high)}), 'replicates' ({stat: array}) and
+             'converged' (fraction of replicate fits that converged)
+    """
+
+    if method not in ('percentile', 'bca'):
+        raise ValueError("method must be 'percentile' or 'bca'")
+
+    if n_ratings == 'infer':
+        n_ratings = infer_n_ratings(data['rating'])
+    raw_s1, raw_s2 = trials_to_counts(data['stimID'], data['response'], data['rating'], n_ratings)
+    raw_s1 = np.asarray(raw_s1, dtype=float)
+    raw_s2 = np.asarray(raw_s2, dtype=float)
+    pad_amount = 1 / (2 * n_ratings) if pad_cells else 0.
+
+    # full-data fit: the point estimates, and the warm start for every replicate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        full = fit_meta_d_MLE_batch(raw_s1 + pad_amount, raw_s2 + pad_amount)
+    init = full['params'][0]
+    estimates = {stat: full[stat][0] for stat in BOOT_STATS}
+
+    # one independent seed per chunk, so the draws don't depend on scheduling
+    sizes = [min(chunk_size, n_boot - start) for start in range(0, n_boot, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(seeds[i], sizes[i], raw_s1, raw_s2, pad_amount, init) for i in range(len(sizes))]
+    chunks = parallel_map(_fit_replicates, tasks, n_workers=n_workers, chunk_size=1)
+
+    failed = [chunk for chunk in chunks if not chunk]
+    if failed:
+        raise RuntimeError(f"bootstrap fits failed: {failed[0].error!r}")
+
+    replicates = {
+        key: np.concatenate([chunk[key] for chunk in chunks])
+        for key in BOOT_STATS + ('converged',)
+    }
+    converged = replicates.pop('converged')
+
+    alpha = (1 - ci) / 2
+    if method == 'bca':
+        acceleration = _jackknife_acceleration(raw_s1, raw_s2, pad_amount, init, estimates)
+
+    intervals = {}
+    for stat in BOOT_STATS:
+        boot = replicates[stat][np.isfinite(replicates[stat])]
+        quantiles = np.array([alpha, 1 - alpha])
+        if method == 'bca' and boot.size:
+            quantiles = _bca_quantiles(boot, estimates[stat], acceleration[stat], quantiles)
+        low, high = np.quantile(boot, quantiles) if boot.size else (np.nan, np.nan)
+        intervals[stat] = (low, high)
+
+    result = dict(estimates)
+    result['ci'] = intervals
+    result['ci_level'] = ci
+    result['method'] = method
+    result['replicates'] = replicates
+    result['converged'] = np.mean(converged)
+    return result
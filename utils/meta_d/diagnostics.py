@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+# Tabulating fit['diagnostics'] (from fit_meta_d_MLE, or fit_meta_d_MLE_batch
+# for a whole stack) over many fits, to find the slow, non-converged and
+# boundary-stuck ones without reading any console output.
+
+# fields every fit's diagnostics have (the scalar fitter adds njev, status,
+# message and warnings)
+DIAGNOSTIC_FIELDS = (
+    'wall_time', 'nit', 'nfev', 'converged', 'meta_d_at_bound', 'criteria_at_bound', 'zero_cells',
+)
+
+
+def diagnostics_table(fits, labels=None):
+    """
+    One row per fit.
+
+    :param fits: list of fit dicts (scalar or batch; a batch fit adds one row
+                 per table). Failed fits (e.g. utils.parallel.TaskError, or None)
+                 get a row with failed=True.
+    :param labels: optional list, one label per entry of fits (e.g. subject IDs);
+                   rows from a batch fit share their entry's label
+    :return: DataFrame with a "fit" column (position in fits), "label" if
+             labels were given, "failed", and the diagnostics fields
+    """
+
+    if labels is not None and len(labels) != len(fits):
+        raise ValueError("labels must have one entry per fit")
+
+    frames = []
+    for i, fit in enumerate(fits):
+        if not fit:
+            rows = pd.DataFrame({'failed': [True]})
+        else:
+            diagnostics = fit['diagnostics']
+            # scalar fit -> one row; batch fit -> one row per table
+            n_rows = np.size(diagnostics['converged'])
+            rows = pd.DataFrame({
+                key: value if np.ndim(value) else [value] * n_rows
+                for key, value in diagnostics.items()
+                if key != 'warnings' and np.ndim(value) <= 1
+            })
+            if 'warnings' in diagnostics:
+                rows['warnings'] = '; '.join(diagnostics['warnings'])
+            rows.insert(0, 'failed', False)
+        rows.insert(0, 'fit', i)
+        if labels is not None:
+            rows.insert(1, 'label', labels[i])
+        frames.append(rows)
+
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=('fit', 'failed'))
+
+
+def summarize_diagnostics(table, slowest=5):
+    """
+    Roll a diagnostics_table up into a few numbers (tables from several batches
+    can be pd.concat-ed first).
+
+    :param slowest: how many of the slowest fits to list
+    :return: dict; 'slowest' is a DataFrame with the "fit" (and "label")
+             of the slowest fits, slowest first
+    """
+
+    done = table[~table['failed']]
+    # the rows of one batch fit all belong to the same entry of fits
+    keys = [col for col in ('fit', 'label') if col in table.columns]
+    converged = done['converged'].astype(bool)
+    wall_time = done['wall_time']
+    return {
+        'n_fits': len(table),
+        'n_failed': int(table['failed'].sum()),
+        'n_not_converged': int((~converged).sum()),
+        'n_meta_d_at_bound': int(done['meta_d_at_bound'].astype(bool).sum()),
+        'n_criteria_at_bound': int((done['criteria_at_bound'] > 0).sum()),
+        'n_with_zero_cells': int((done['zero_cells'] > 0).sum()),
+        'wall_time_total': float(wall_time.sum()),
+        'wall_time_mean': float(wall_time.mean()),
+        'wall_time_max': float(wall_time.max()),
+        'nfev_mean': float(done['nfev'].mean()),
+        'nfev_max': int(done['nfev'].max()) if len(done) else 0,
+        'slowest': (done.sort_values('wall_time', ascending=False, kind='stable')
+                    .drop_duplicates(keys)[keys].head(slowest).reset_index(drop=True)),
+    }
@@ -0,0 +1,129 @@
+import copy
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def fit_cache_key(nr_s1, nr_s2, s=1, **settings):
+    """
+    Content hash for a meta-d' fit: same counts + same settings = same key.
+
+    :param nr_s1: counts for S1 presentations (as fed to the fitter)
+    :param nr_s2: counts for S2 presentations
+    :param s: sd(S1) / sd(S2)
+    :param settings: anything else the result depends on (pad_cells, n_ratings, ...)
+    :return: hex digest string
+    """
+    # imported here so the cache doesn't pull in scipy.optimize until a fit runs
+    from utils.meta_d.fit_meta_d_MLE import FIT_VERSION
+
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(nr_s1, dtype=np.float64).tobytes())
+    h.update(b'|')
+    h.update(np.ascontiguousarray(nr_s2, dtype=np.float64).tobytes())
+    h.update(json.dumps(
+        {'s': float(s), 'fit_version': FIT_VERSION, **settings},
+        sort_keys=True,
+        default=str,
+    ).encode())
+    return h.hexdigest()
+
+
+class FitCache:
+    """
+    Memoizes fit dicts by fit_cache_key.
+
+    Two tiers: an in-memory LRU of up to maxsize fits, and (if path is given) a
+    SQLite file holding up to max_disk_entries fits, least recently used
+    evicted first. The disk tier survives restarts and can be shared by worker
+    processes; each process keeps its own memory tier.
+    """
+
+    def __init__(self, maxsize=1024, path=None, max_disk_entries=100_000):
+        self.maxsize = maxsize
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._db = None
+
+    # connections can't be pickled (e.g. when sent to worker processes),
+    # so each process opens its own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_db'] = None
+        return state
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS fits '
+                '(key TEXT PRIMARY KEY, fit BLOB NOT NULL, last_used REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS fits_last_used ON fits (last_used)')
+            self._db.commit()
+        return self._db
+
+    def _remember(self, key, fit):
+        self._memory[key] = fit
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        :return: a copy of the cached fit dict, or None
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(self._memory[key])
+
+        if self.path is not None:
+            db = self._connection()
+            row = db.execute('SELECT fit FROM fits WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                db.execute('UPDATE fits SET last_used = ? WHERE key = ?', (time.time(), key))
+                db.commit()
+                fit = pickle.loads(row[0])
+                self._remember(key, fit)
+                self.hits += 1
+                return copy.deepcopy(fit)
+
+        self.misses += 1
+        return None
+
+    def put(self, key, fit):
+        self._remember(key, copy.deepcopy(fit))
+
+        if self.path is not None:
+            db = self._connection()
+            db.execute(
+                'INSERT OR REPLACE INTO fits (key, fit, last_used) VALUES (?, ?, ?)',
+                (key, pickle.dumps(fit, protocol=pickle.HIGHEST_PROTOCOL), time.time()),
+            )
+            # size-bounded: drop the least recently used rows past the limit
+            db.execute(
+                'DELETE FROM fits WHERE key IN '
+                '(SELECT key FROM fits ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_disk_entries,),
+            )
+            db.commit()
+
+    def clear(self):
+        self._memory.clear()
+        if self.path is not None and os.path.exists(self.path):
+            db = self._connection()
+            db.execute('DELETE FROM fits')
+            db.commit()
+
+    def __len__(self):
+        return len(self._memory)
@@ -140,71 +140,114 @@ function fit = fit_meta_d_MLE(nR_S1, nR_S2, s, fncdf, fninv)
 ###### If the code looks messy. It's because this was directly ported from MATLAB,
 ###### and they didn't bother refactoring it.
 
+import time
+import warnings
+
 import numpy as np
 from scipy.stats import norm
+from scipy import sparse
 from scipy.optimize import Bounds, LinearConstraint, minimize, SR1
+from utils.meta_d.fit_meta_d_batch import MIN_GAP, criteria_to_increments, increments_to_criteria
 
+# bump whenever a change to the fitting code can change its results
+# (cached fits from older versions are then ignored -- see fit_cache.py)
+FIT_VERSION = 2
 
-# returns negative log-likelihood of parameters given experimental data
+# parameter bounds: meta-d' in [-10, 10], type 2 criteria within 20 of meta_c1.
+# A fit sitting on one of these (within BOUND_TOL) is flagged in its diagnostics.
+META_D_BOUND = 10.
+CRITERION_BOUND = 20.
+BOUND_TOL = 1e-4
+
+# from this many criteria (2 * nRatings - 1) on, the ordering constraints are
+# handed to trust-constr as a sparse matrix (faster from about 20 ratings;
+# slower below that)
+SPARSE_MIN_CRITERIA = 39
+
+# 'trust-constr' -- the original: criteria directly, ordering as linear constraints
+# 'L-BFGS-B'     -- criteria as log-spaced increments away from the type 1
+#                   criterion, so the ordering holds by construction and only
+#                   simple bounds are left (see fit_meta_d_logL_increments).
+#                   Those bound each spacing to CRITERION_BOUND rather than
+#                   each criterion, so the feasible set is a little wider
+SOLVERS = ('trust-constr', 'L-BFGS-B')
+
+
+class ZeroCountWarning(RuntimeWarning):
+    """
+    nR_S1 or nR_S2 contain zeros (see the help text above for what to do about it).
+    """
+
+
+# relative criterion: the type 1 criterion for the meta-d' fit sits at the same
+# place (relative to d') as the observed type 1 criterion
+# (replaces the old eval('meta_d1 * (t1c1 / d1)') string from the MATLAB port)
+def relative_criterion(meta_d1, t1c1, d1):
+    return meta_d1 * (t1c1 / d1)
+
+
+# share of the counts above each cut point: element i is sum(counts[i+1:]) / sum(counts)
+# (the rating HR/FAR curves). Long scales take one reversed cumulative sum
+# instead of a sum per cut; shorter ones (the dense-constraint path) keep the
+# original per-cut sums, so fits on the usual scales round exactly as before
+def tail_rates(counts):
+    counts = np.asarray(counts, dtype=float)
+    if len(counts) <= SPARSE_MIN_CRITERIA:
+        return np.array([sum(counts[c:]) for c in range(1, len(counts))]) / sum(counts)
+    return np.cumsum(counts[::-1])[::-1][1:] / np.sum(counts)
+
+
+# type 2 response probabilities for parameters given experimental data
 # parameters[0] = meta d'
 # parameters[1:end] = type-2 criteria locations
-def fit_meta_d_logL(parameters, inputObj):
+#
+# inputObj holds the counts pre-split once by fit_meta_d_MLE as a (2, 2*nRatings)
+# array -- row 0 is nR_S1, row 1 is nR_S2 -- so nothing gets rebuilt per call.
+# Row 0 is always evaluated under the S1 distribution and row 1 under S2:
+#   nR_S1[:nRatings] = correct "S1" responses, nR_S1[nRatings:] = incorrect "S2" responses
+#   nR_S2[:nRatings] = incorrect "S1" responses, nR_S2[nRatings:] = correct "S2" responses
+#
+# returns pr (same shape as the counts, each half of a row sums to 1) plus the
+# intermediate values the gradient/Hessian below need
+def fit_meta_d_probs(parameters, inputObj):
     meta_d1 = parameters[0]
     t2c1 = parameters[1:]
-    nR_S1, nR_S2, nRatings, d1, t1c1, s, constant_criterion, fncdf, fninv = inputObj
-
-    # define mean and SD of S1 and S2 distributions
-    S1mu = -meta_d1 / 2
-    S1sd = 1
-    S2mu = meta_d1 / 2
-    S2sd = S1sd / s
+    counts, nRatings, d1, t1c1, s, constant_criterion, fncdf, fnpdf = inputObj
 
-    # adjust so that the type 1 criterion is set at 0
+    # define mean and SD of S1 and S2 distributions, adjusted so that the type 1
+    # criterion is set at 0
     # (this is just to work with optimization toolbox constraints...
     #  to simplify defining the upper and lower bounds of type 2 criteria)
-    S1mu = S1mu - eval(constant_criterion)
-    S2mu = S2mu - eval(constant_criterion)
+    mt1c1 = constant_criterion(meta_d1, t1c1, d1)
+    mu = np.array([[-meta_d1 / 2 - mt1c1], [meta_d1 / 2 - mt1c1]])
+    sd = np.array([[1.], [1. / s]])
 
-    t1c1 = 0
+    # all criteria, with the type 1 criterion (0) in the middle:
+    # [-inf, t2c1 (S1 responses), 0, t2c1 (S2 responses), inf]
+    t2c1x = np.concatenate(([-np.inf], t2c1[:nRatings - 1], [0.], t2c1[nRatings - 1:], [np.inf]))
 
-    # set up MLE analysis
-    # get type 2 response counts
-    # S1 responses
-    nC_rS1 = [nR_S1[i] for i in range(nRatings)]
-    nI_rS1 = [nR_S2[i] for i in range(nRatings)]
-    # S2 responses
-    nC_rS2 = [nR_S2[i + nRatings] for i in range(nRatings)]
-    nI_rS2 = [nR_S1[i + nRatings] for i in range(nRatings)]
+    # every CDF value we need, in one call -- shape (2, 2*nRatings + 1)
+    cdf = fncdf(t2c1x, mu, sd)
 
     # get type 2 probabilities
-    C_area_rS1 = fncdf(t1c1, S1mu, S1sd)
-    I_area_rS1 = fncdf(t1c1, S2mu, S2sd)
+    # areas under each distribution on the "S1" (below 0) and "S2" side
+    area_rS1 = cdf[:, nRatings:nRatings + 1]
+    area_rS2 = 1 - area_rS1
 
-    C_area_rS2 = 1 - fncdf(t1c1, S2mu, S2sd)
-    I_area_rS2 = 1 - fncdf(t1c1, S1mu, S1sd)
+    pr = np.empty(counts.shape)
+    pr[:, :nRatings] = (cdf[:, 1:nRatings + 1] - cdf[:, :nRatings]) / area_rS1
+    pr[:, nRatings:] = ((1 - cdf[:, nRatings:-1]) - (1 - cdf[:, nRatings + 1:])) / area_rS2
 
-    t2c1x = [-np.inf]
-    t2c1x.extend(t2c1[0:(nRatings - 1)])
-    t2c1x.append(t1c1)
-    t2c1x.extend(t2c1[(nRatings - 1):])
-    t2c1x.append(np.inf)
+    return pr, t2c1x, mu, sd, cdf
 
-    prC_rS1 = [(fncdf(t2c1x[i + 1], S1mu, S1sd) - fncdf(t2c1x[i], S1mu, S1sd)) / C_area_rS1 for i in range(nRatings)]
-    prI_rS1 = [(fncdf(t2c1x[i + 1], S2mu, S2sd) - fncdf(t2c1x[i], S2mu, S2sd)) / I_area_rS1 for i in range(nRatings)]
 
-    prC_rS2 = [
-        ((1 - fncdf(t2c1x[nRatings + i], S2mu, S2sd)) - (1 - fncdf(t2c1x[nRatings + i + 1], S2mu, S2sd))) / C_area_rS2
-        for i in range(nRatings)]
-    prI_rS2 = [
-        ((1 - fncdf(t2c1x[nRatings + i], S1mu, S1sd)) - (1 - fncdf(t2c1x[nRatings + i + 1], S1mu, S1sd))) / I_area_rS2
-        for i in range(nRatings)]
+# returns negative log-likelihood of parameters given experimental data
+# (see fit_meta_d_probs for the layout of parameters and inputObj)
+def fit_meta_d_logL(parameters, inputObj):
+    pr = fit_meta_d_probs(parameters, inputObj)[0]
 
     # calculate logL
-    logL = np.sum([
-        nC_rS1[i] * np.log(prC_rS1[i]) \
-        + nI_rS1[i] * np.log(prI_rS1[i]) \
-        + nC_rS2[i] * np.log(prC_rS2[i]) \
-        + nI_rS2[i] * np.log(prI_rS2[i]) for i in range(nRatings)])
+    logL = np.sum(inputObj[0] * np.log(pr))
 
     if np.isinf(logL) or np.isnan(logL):
         #        logL=-np.inf
@@ -212,27 +255,138 @@ def fit_meta_d_logL(parameters, inputObj):
     return -logL
 
 
-def fit_meta_d_MLE(nR_S1, nR_S2, s=1, fncdf=norm.cdf, fninv=norm.ppf):
+# derivatives of the type 2 probabilities w.r.t. the parameters
+# returns pr (2, 2*nRatings) and dpr (2, 2*nRatings, nParameters)
+#
+# Only valid when fnpdf is the density of fncdf (i.e. the default normal pair),
+# and relies on constant_criterion being linear in meta_d1 (true for
+# relative_criterion).
+def fit_meta_d_probs_jacobian(parameters, inputObj):
+    pr, t2c1x, mu, sd, cdf = fit_meta_d_probs(parameters, inputObj)
+    counts, nRatings, d1, t1c1, s, constant_criterion, fncdf, fnpdf = inputObj
+    nBins = 2 * nRatings
+
+    # d(mu)/d(meta_d1) for the S1 and S2 distributions
+    dmu = np.array([[-1 / 2], [1 / 2]]) - constant_criterion(1., t1c1, d1)
+
+    # densities at every criterion (0 at +-inf)
+    pdf = fnpdf(t2c1x, mu, sd)
+
+    # pr = D / Z, where D is the area of a rating bin and Z the area on that
+    # response's side of the type 1 criterion
+    lower = np.arange(nBins) < nRatings
+    area_rS1 = cdf[:, nRatings:nRatings + 1]
+    Z = np.where(lower, area_rS1, 1 - area_rS1)
+
+    # moving a distribution by dmu shifts every cdf value by -pdf * dmu
+    dD_dm = -dmu * (pdf[:, 1:] - pdf[:, :-1])
+    dZ_dm = np.where(lower, -1, 1) * pdf[:, nRatings:nRatings + 1] * dmu
+
+    # moving criterion x_i only changes the two bins on either side of it
+    bins = np.arange(nBins)
+    dD_dx = np.zeros((2, nBins, nBins + 1))
+    dD_dx[:, bins, bins] = -pdf[:, :-1]
+    dD_dx[:, bins, bins + 1] = pdf[:, 1:]
+    # keep only the free criteria (drop -inf, the type 1 criterion and inf)
+    free = np.r_[1:nRatings, nRatings + 1:nBins]
+
+    dpr = np.empty((2, nBins, len(parameters)))
+    dpr[:, :, 0] = (dD_dm - pr * dZ_dm) / Z
+    dpr[:, :, 1:] = dD_dx[:, :, free] / Z[:, :, None]
+
+    return pr, dpr
+
+
+# gradient of fit_meta_d_logL
+def fit_meta_d_logL_grad(parameters, inputObj):
+    pr, dpr = fit_meta_d_probs_jacobian(parameters, inputObj)
+    grad = -np.einsum('ji,jik->k', inputObj[0] / pr, dpr)
+    # same idea as the -1e300 clamp above: keep the optimizer away from inf/nan
+    return np.nan_to_num(grad)
+
+
+# Gauss-Newton (expected Fisher information) Hessian of fit_meta_d_logL
+# each response side of each stimulus is its own multinomial, so
+# I = sum over bins of N_side / pr * dpr dpr'
+def fit_meta_d_logL_hess(parameters, inputObj):
+    pr, dpr = fit_meta_d_probs_jacobian(parameters, inputObj)
+    counts, nRatings = inputObj[0], inputObj[1]
+    n_side = np.repeat(np.add.reduceat(counts, [0, nRatings], axis=1), nRatings, axis=1)
+    hess = np.einsum('ji,jik,jil->kl', n_side / pr, dpr, dpr)
+    return np.nan_to_num(hess)
+
+
+# fit_meta_d_logL and its gradient in the reparameterized form used by the
+# L-BFGS-B solver: theta = [meta_d1, log increments between neighbouring
+# criteria, moving out from the type 1 criterion] (as in fit_meta_d_batch.py)
+# both are per trial (divided by the total count): unscaled, the first
+# L-BFGS-B step is far too long and the line search gives up right away
+def fit_meta_d_logL_increments(theta, inputObj):
+    t2c1, dc_dtheta = increments_to_criteria(theta[None, 1:], inputObj[1])
+    parameters = np.concatenate((theta[:1], t2c1[0]))
+    grad = fit_meta_d_logL_grad(parameters, inputObj)
+    n_trials = np.sum(inputObj[0])
+    return (fit_meta_d_logL(parameters, inputObj) / n_trials,
+            np.concatenate((grad[:1], grad[1:] @ dc_dtheta[0])) / n_trials)
+
+
+# turns a warm start into a feasible starting point for the current data
+# init is either a previous fit dict (from fit_meta_d_MLE or one row of
+# fit_meta_d_MLE_batch), or a parameter vector [meta_d1, t2c1 - meta_c1] in
+# the fitted frame (e.g. a row of the batch fitter's 'params')
+def warm_start_guess(init, nRatings, d1, t1c1, constant_criterion, LB, UB):
+    if isinstance(init, dict):
+        meta_d1 = float(init['S1units']['meta_d1'])
+        t2c1 = np.concatenate((init['S1units']['t2c1_rS1'], init['S1units']['t2c1_rS2']))
+        # the previous fit's criteria are absolute; the optimizer works relative
+        # to this data's type 1 criterion
+        guess = np.concatenate(([meta_d1], t2c1 - constant_criterion(meta_d1, t1c1, d1)))
+    else:
+        guess = np.array(init, dtype=float)
+
+    if guess.shape != (2 * nRatings - 1,):
+        raise ValueError('init does not match the number of ratings')
+
+    # keep inside the bounds, and strictly ordered (constraint gap is 1e-5)
+    guess = np.clip(guess, np.add(LB, 1e-5), np.subtract(UB, 1e-5))
+    if np.any(np.diff(guess[1:]) < 1e-5):
+        return None
+    return guess
+
+
+# analytic_grad: if True, hand the optimizer the closed-form gradient and the
+# Gauss-Newton Hessian above instead of finite differences + SR1 updates
+# (needs fnpdf to be the density of fncdf)
+# init: warm start from a previous solution instead of the rating HR/FAR
+# heuristic (see warm_start_guess); falls back to the heuristic if unusable.
+# 'lookup' starts from the precomputed index in utils/meta_d/lookup.py instead
+# (about halves trust-constr's fitting time); the index only covers s = 1, so
+# other s use the heuristic
+# solver: 'trust-constr' (default) or 'L-BFGS-B', which fits the same model
+# reparameterized to need no linear constraints -- several times faster, always
+# uses the analytic gradient (so fnpdf must be the density of fncdf). Its
+# criteria are bounded only through their spacings (see SOLVERS), so on extreme
+# tables, where trust-constr stops at CRITERION_BOUND, it can go further
+def fit_meta_d_MLE(nR_S1, nR_S2, s=1, fncdf=norm.cdf, fninv=norm.ppf, fnpdf=norm.pdf, analytic_grad=False,
+                   init=None, solver='trust-constr'):
     # check inputs
+    if solver not in SOLVERS:
+        raise ValueError(f'solver must be one of {SOLVERS}')
     if (len(nR_S1) % 2) != 0:
         raise ('input arrays must have an even number of elements')
     if len(nR_S1) != len(nR_S2):
         raise ('input arrays must have the same number of elements')
-    if any(np.array(nR_S1) == 0) or any(np.array(nR_S2) == 0):
-        print(' ')
-        print('WARNING!!')
-        print('---------')
-        print('Your inputs')
-        print(' ')
-        print('nR_S1:')
-        print(nR_S1)
-        print('nR_S2:')
-        print(nR_S2)
-        print(' ')
-        print('contain zeros! This may interfere with proper estimation of meta-d''.')
-        print('See ''help fit_meta_d_MLE'' for more information.')
-        print(' ')
-        print(' ')
+
+    start_time = time.perf_counter()
+    zero_cells = int(np.sum(np.array(nR_S1) == 0) + np.sum(np.array(nR_S2) == 0))
+    if zero_cells:
+        # also counted in fit['diagnostics']['zero_cells']
+        warnings.warn(
+            f"Your inputs nR_S1 = {list(nR_S1)}, nR_S2 = {list(nR_S2)} contain zeros! This may "
+            "interfere with proper estimation of meta-d'. See help(fit_meta_d_MLE) for more information.",
+            ZeroCountWarning,
+            stacklevel=2,
+        )
 
     nRatings = int(len(nR_S1) / 2)  # number of ratings in the experiment
     nCriteria = int(2 * nRatings - 1)  # number criteria to be fitted
@@ -248,46 +402,50 @@ def fit_meta_d_MLE(nR_S1, nR_S2, s=1, fncdf=norm.cdf, fninv=norm.ppf):
     # want t2c(i)   <= t2c(i+1)
     # -->  t2c(i+1) >= t2c(i) + 1e-5 (i.e. very small deviation from equality)
     # -->  t2c(i) - t2c(i+1) <= -1e-5
-    A = []
-    ub = []
-    lb = []
-    for ii in range(nCriteria - 2):
-        tempArow = []
-        tempArow.extend(np.zeros(ii + 1))
-        tempArow.extend([1, -1])
-        tempArow.extend(np.zeros((nCriteria - 2) - ii - 1))
-        A.append(tempArow)
-        ub.append(-1e-5)
-        lb.append(-np.inf)
+    # one row per neighbouring pair, banded (a 1 and a -1 next to each other);
+    # sparse for long rating scales, where a dense A (nCriteria^2) slows every
+    # trust-constr iteration down
+    # (a single rating has no type 2 criteria, so nothing to constrain)
+    nPairs = nCriteria - 2
+    constraints = []
+    if nPairs > 0:
+        A = sparse.diags([np.ones(nPairs), -np.ones(nPairs)], [1, 2], shape=(nPairs, nCriteria), format='csr')
+        if nCriteria < SPARSE_MIN_CRITERIA:
+            A = A.toarray()
+        ub = np.full(nPairs, -1e-5)
+        lb = np.full(nPairs, -np.inf)
+        constraints.append(LinearConstraint(A, lb, ub))
 
     # lower bounds on parameters
-    LB = []
-    LB.append(-10.)  # meta-d'
-    LB.extend(-20 * np.ones((nCriteria - 1) // 2))  # criteria lower than t1c
-    LB.extend(np.zeros((nCriteria - 1) // 2))  # criteria higher than t1c
+    LB = np.concatenate((
+        [-META_D_BOUND],  # meta-d'
+        np.full((nCriteria - 1) // 2, -CRITERION_BOUND),  # criteria lower than t1c
+        np.zeros((nCriteria - 1) // 2),  # criteria higher than t1c
+    ))
 
     # upper bounds on parameters
-    UB = []
-    UB.append(10.)  # meta-d'
-    UB.extend(np.zeros((nCriteria - 1) // 2))  # criteria lower than t1c
-    UB.extend(20 * np.ones((nCriteria - 1) // 2))  # criteria higher than t1c
+    UB = np.concatenate((
+        [META_D_BOUND],  # meta-d'
+        np.zeros((nCriteria - 1) // 2),  # criteria lower than t1c
+        np.full((nCriteria - 1) // 2, CRITERION_BOUND),  # criteria higher than t1c
+    ))
 
     """
     prepare other inputs for scipy.optimize.minimum()
     """
     # select constant criterion type
-    constant_criterion = 'meta_d1 * (t1c1 / d1)'  # relative criterion
+    constant_criterion = relative_criterion
 
     # set up initial guess at parameter values
-    ratingHR = []
-    ratingFAR = []
-    for c in range(1, int(nRatings * 2)):
-        ratingHR.append(sum(nR_S2[c:]) / sum(nR_S2))
-        ratingFAR.append(sum(nR_S1[c:]) / sum(nR_S1))
+    # rating HR/FAR at every criterion c = 1 .. 2*nRatings-1
+    nR_S1 = np.asarray(nR_S1, dtype=float)
+    nR_S2 = np.asarray(nR_S2, dtype=float)
+    ratingHR = tail_rates(nR_S2)
+    ratingFAR = tail_rates(nR_S1)
 
     # obtain index in the criteria array to mark Type I and Type II criteria
     t1_index = nRatings - 1
-    t2_index = list(set(list(range(0, 2 * nRatings - 1))) - set([t1_index]))
+    t2_index = np.delete(np.arange(2 * nRatings - 1), t1_index)
 
     d1 = (1 / s) * fninv(ratingHR[t1_index]) - fninv(ratingFAR[t1_index])
     meta_d1 = d1
@@ -297,31 +455,77 @@ def fit_meta_d_MLE(nR_S1, nR_S2, s=1, fncdf=norm.cdf, fninv=norm.ppf):
     t2c1 = c1[t2_index]
 
     # initial values for the minimization function
-    guess = [meta_d1]
-    guess.extend(list(t2c1 - eval(constant_criterion)))
+    guess = np.concatenate(([meta_d1], t2c1 - constant_criterion(meta_d1, t1c1, d1)))
+
+    # no console output: status, iterations etc. go in fit['diagnostics']
+    options = {'verbose': 0}
+    if isinstance(init, str) and init == 'lookup':
+        if s == 1:
+            # imported here so the plain fitter never loads (or builds) the index
+            from utils.meta_d.lookup import lookup_guess
+            init = lookup_guess(nR_S1, nR_S2)[0]
+        else:
+            init = None
+    if init is not None:
+        warm = warm_start_guess(init, nRatings, d1, t1c1, constant_criterion, LB, UB)
+        if warm is not None:
+            guess = warm
+            # already close: start with a small barrier/trust region instead of
+            # spending iterations shrinking them from trust-constr's defaults
+            options.update(initial_barrier_parameter=1e-4, initial_tr_radius=0.1)
 
     # other inputs for the minimization function
-    inputObj = [nR_S1, nR_S2, nRatings, d1, t1c1, s, constant_criterion, fncdf, fninv]
+    counts = np.array([nR_S1, nR_S2], dtype=float)
+    inputObj = [counts, nRatings, d1, t1c1, s, constant_criterion, fncdf, fnpdf]
     bounds = Bounds(LB, UB)
-    constraints = [LinearConstraint(A, lb, ub)] if len(A) > 0 else []
+
+    if analytic_grad:
+        jac, hess = fit_meta_d_logL_grad, fit_meta_d_logL_hess
+    else:
+        jac, hess = '2-point', SR1()
 
     # noinspection PyTypeChecker
     # minimization of negative log-likelihood
-    results = minimize(
-        fit_meta_d_logL,
-        guess,
-        args=(tuple(inputObj),),  # cast to tuple[Any]
-        method='trust-constr',
-        jac='2-point',
-        hess=SR1(),
-        constraints=constraints,
-        options={'verbose': 1},
-        bounds=bounds
-    )
+    # (warnings raised along the way are recorded in the diagnostics, not printed)
+    with warnings.catch_warnings(record=True) as caught, np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('always')
+        if solver == 'L-BFGS-B':
+            # meta-d' within +-10 as in LB/UB, and neighbouring criteria at least
+            # 1e-5 apart (the linear constraints), but the criteria themselves are
+            # only bounded through their spacings (each gap at most 20), so the
+            # outer ones can end up further than 20 from meta_c1 -- unlike the
+            # LB/UB box trust-constr uses. Ordinary tables never get near either
+            # limit; on extreme ones the two solvers can settle differently.
+            theta = np.concatenate(([guess[0]], criteria_to_increments(np.atleast_2d(guess[1:]), nRatings)[0]))
+            theta_bounds = [(-META_D_BOUND, META_D_BOUND)] + [(np.log(MIN_GAP), np.log(CRITERION_BOUND))] * (nCriteria - 1)
+            results = minimize(
+                fit_meta_d_logL_increments,
+                theta,
+                args=(tuple(inputObj),),
+                method='L-BFGS-B',
+                jac=True,
+                bounds=theta_bounds,
+                options={'maxiter': 1000, 'ftol': 1e-15, 'gtol': 1e-9},
+            )
+            # back to [meta_d1, t2c1 - meta_c1] and the summed -logL for everything below
+            results.x = np.concatenate((results.x[:1], increments_to_criteria(results.x[None, 1:], nRatings, jacobian=False)[0]))
+            results.fun = results.fun * np.sum(counts)
+        else:
+            results = minimize(
+                fit_meta_d_logL,
+                guess,
+                args=(tuple(inputObj),),  # cast to tuple[Any]
+                method='trust-constr',
+                jac=jac,
+                hess=hess,
+                constraints=constraints,
+                options=options,
+                bounds=bounds
+            )
 
     # quickly process some of the output
     meta_d1 = results.x[0]
-    t2c1 = results.x[1:] + eval(constant_criterion)
+    t2c1 = results.x[1:] + constant_criterion(meta_d1, t1c1, d1)
     logL = -results.fun
 
     # data is fit, now to package it...
@@ -330,15 +534,15 @@ def fit_meta_d_MLE(nR_S1, nR_S2, s=1, fncdf=norm.cdf, fninv=norm.ppf):
     # I_nR and C_nR are rating trial counts for incorrect and correct trials
     # element i corresponds to # (in)correct w/ rating i
     I_nR_rS2 = nR_S1[nRatings:]
-    I_nR_rS1 = list(np.flip(nR_S2[0:nRatings], axis=0))
+    I_nR_rS1 = nR_S2[nRatings - 1::-1]
 
-    C_nR_rS2 = nR_S2[nRatings:];
-    C_nR_rS1 = list(np.flip(nR_S1[0:nRatings], axis=0))
+    C_nR_rS2 = nR_S2[nRatings:]
+    C_nR_rS1 = nR_S1[nRatings - 1::-1]
 
-    obs_FAR2_rS2 = [sum(I_nR_rS2[(i + 1):]) / sum(I_nR_rS2) for i in range(nRatings - 1)]
-    obs_HR2_rS2 = [sum(C_nR_rS2[(i + 1):]) / sum(C_nR_rS2) for i in range(nRatings - 1)]
-    obs_FAR2_rS1 = [sum(I_nR_rS1[(i + 1):]) / sum(I_nR_rS1) for i in range(nRatings - 1)]
-    obs_HR2_rS1 = [sum(C_nR_rS1[(i + 1):]) / sum(C_nR_rS1) for i in range(nRatings - 1)]
+    obs_FAR2_rS2 = tail_rates(I_nR_rS2).tolist()
+    obs_HR2_rS2 = tail_rates(C_nR_rS2).tolist()
+    obs_FAR2_rS1 = tail_rates(I_nR_rS1).tolist()
+    obs_HR2_rS1 = tail_rates(C_nR_rS1).tolist()
 
     # find estimated t2FAR and t2HR
     S1mu = -meta_d1 / 2
@@ -346,7 +550,7 @@ def fit_meta_d_MLE(nR_S1, nR_S2, s=1, fncdf=norm.cdf, fninv=norm.ppf):
     S2mu = meta_d1 / 2
     S2sd = S1sd / s;
 
-    mt1c1 = eval(constant_criterion)
+    mt1c1 = constant_criterion(meta_d1, t1c1, d1)
 
     C_area_rS2 = 1 - fncdf(mt1c1, S2mu, S2sd)
     I_area_rS2 = 1 - fncdf(mt1c1, S1mu, S1sd)
@@ -354,27 +558,15 @@ def fit_meta_d_MLE(nR_S1, nR_S2, s=1, fncdf=norm.cdf, fninv=norm.ppf):
     C_area_rS1 = fncdf(mt1c1, S1mu, S1sd)
     I_area_rS1 = fncdf(mt1c1, S2mu, S2sd)
 
-    est_FAR2_rS2 = []
-    est_HR2_rS2 = []
-
-    est_FAR2_rS1 = []
-    est_HR2_rS1 = []
-
-    for i in range(nRatings - 1):
-        t2c1_lower = t2c1[(nRatings - 1) - (i + 1)]
-        t2c1_upper = t2c1[(nRatings - 1) + i]
-
-        I_FAR_area_rS2 = 1 - fncdf(t2c1_upper, S1mu, S1sd)
-        C_HR_area_rS2 = 1 - fncdf(t2c1_upper, S2mu, S2sd)
+    # criteria moving out from the type 1 criterion, rating 2 .. nRatings
+    t2c1_lower = t2c1[nRatings - 2::-1]
+    t2c1_upper = t2c1[nRatings - 1:]
 
-        I_FAR_area_rS1 = fncdf(t2c1_lower, S2mu, S2sd)
-        C_HR_area_rS1 = fncdf(t2c1_lower, S1mu, S1sd)
+    est_FAR2_rS2 = ((1 - fncdf(t2c1_upper, S1mu, S1sd)) / I_area_rS2).tolist()
+    est_HR2_rS2 = ((1 - fncdf(t2c1_upper, S2mu, S2sd)) / C_area_rS2).tolist()
 
-        est_FAR2_rS2.append(I_FAR_area_rS2 / I_area_rS2)
-        est_HR2_rS2.append(C_HR_area_rS2 / C_area_rS2)
-
-        est_FAR2_rS1.append(I_FAR_area_rS1 / I_area_rS1)
-        est_HR2_rS1.append(C_HR_area_rS1 / C_area_rS1)
+    est_FAR2_rS1 = (fncdf(t2c1_lower, S2mu, S2sd) / I_area_rS1).tolist()
+    est_HR2_rS1 = (fncdf(t2c1_lower, S1mu, S1sd) / C_area_rS1).tolist()
 
     # package output
     fit = {}
@@ -388,7 +580,7 @@ def fit_meta_d_MLE(nR_S1, nR_S2, s=1, fncdf=norm.cdf, fninv=norm.ppf):
 
     fit['M_ratio'] = fit['meta_da'] / fit['da']
 
-    mt1c1 = eval(constant_criterion)
+    mt1c1 = constant_criterion(meta_d1, t1c1, d1)
     fit['meta_ca'] = (np.sqrt(2) * s / np.sqrt(1 + s ** 2)) * mt1c1
 
     t2ca = (np.sqrt(2) * s / np.sqrt(1 + s ** 2)) * np.array(t2c1)
@@ -417,9 +609,59 @@ def fit_meta_d_MLE(nR_S1, nR_S2, s=1, fncdf=norm.cdf, fninv=norm.ppf):
     fit['est_FAR2_rS2'] = est_FAR2_rS2
     fit['obs_FAR2_rS2'] = obs_FAR2_rS2
 
+    fit['diagnostics'] = fit_diagnostics(results, time.perf_counter() - start_time, zero_cells, caught)
+
     return fit
 
 
+def fit_diagnostics(results, wall_time, zero_cells=0, caught=()):
+    """
+    How a fit went, as plain fields (see utils/meta_d/diagnostics.py to
+    tabulate/summarize them over many fits).
+
+    :param results: scipy.optimize.minimize result (trust-constr or L-BFGS-B),
+                    with x in the [meta_d1, t2c1 - meta_c1] parameterization
+    :param wall_time: seconds spent fitting
+    :param zero_cells: number of zero cells in nR_S1 + nR_S2
+    :param caught: warnings recorded during the fit
+    :return: dict
+    """
+    return {
+        'wall_time': wall_time,
+        'nit': int(results.nit),
+        'nfev': int(results.nfev),
+        'njev': int(results.njev),
+        # solver specific, e.g. trust-constr: 0 = hit maxiter, 1 = gtol, 2 = xtol;
+        # L-BFGS-B: 0 = converged, 1 = hit maxiter, 2 = other stop
+        'status': int(results.status),
+        'converged': bool(results.success),
+        'message': results.message,
+        'meta_d_at_bound': bool(abs(results.x[0]) >= META_D_BOUND - BOUND_TOL),
+        'criteria_at_bound': int(np.sum(np.abs(results.x[1:]) >= CRITERION_BOUND - BOUND_TOL)),
+        'zero_cells': zero_cells,
+        'warnings': sorted({f'{w.category.__name__}: {w.message}' for w in caught}),
+    }
+
+
+def fit_meta_d_sequence(tables, s=1, init=None, **kwargs):
+    """
+    Fit a sequence of similar count tables (sliding windows, bootstrap
+    replicates, parameter sweeps...), warm-starting each fit from the previous one.
+
+    :param tables: iterable of (nR_S1, nR_S2) pairs
+    :param s: sd(S1) / sd(S2)
+    :param init: optional warm start for the first table
+    :param kwargs: passed on to fit_meta_d_MLE (e.g. analytic_grad=True)
+    :return: list of fit dicts, in order
+    """
+    fits = []
+    for nR_S1, nR_S2 in tables:
+        fit = fit_meta_d_MLE(nR_S1, nR_S2, s=s, init=init, **kwargs)
+        fits.append(fit)
+        init = fit
+    return fits
+
+
 if __name__ == '__main__':
 
     # try using the function
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched version of fit_meta_d_MLE for fitting many count tables at once.
+
+fit_meta_d_MLE fits one (nR_S1, nR_S2) pair per call through
+scipy.optimize.minimize, so fitting thousands of tables (subjects, sessions,
+conditions, bootstrap replicates) spends most of its time in per-call Python
+overhead. Here every table is stacked into (N, 2*nRatings) arrays and the
+likelihood, its gradient and the Gauss-Newton Hessian are evaluated for all
+tables in one go. The optimizer is a damped (Levenberg-Marquardt style) Fisher
+scoring loop that runs on all still-unconverged tables in parallel.
+
+The model, the relative type 1 criterion and the bounds on meta-d' are the same
+as fit_meta_d_MLE (normal distributions only). Instead of linear constraints,
+the ordered type 2 criteria are written as log-spaced increments moving away
+from the type 1 criterion, so the ordering can never be violated:
+
+    "S1" side: t2c1 = -cumsum(exp(theta))   (read from 0 outwards)
+    "S2" side: t2c1 = +cumsum(exp(theta))
+
+Output is columnar: a dict with the same keys as fit_meta_d_MLE, where each
+value is an array with one entry (or row) per table.
+"""
+
+import time
+
+import numpy as np
+from scipy.special import ndtr, ndtri
+
+# meta-d' bounds, same as fit_meta_d_MLE
+META_D_BOUND = 10.
+# only used to flag fits in the diagnostics, like fit_meta_d_MLE does (the
+# criteria themselves aren't bounded here)
+CRITERION_BOUND = 20.
+BOUND_TOL = 1e-4
+# smallest gap allowed between neighbouring criteria (fit_meta_d_MLE uses 1e-5)
+MIN_GAP = 1e-5
+# rough cap on the elements of each per-table derivative array held at once
+# (tables are stepped in blocks of BLOCK_ELEMENTS // (2 * nBins^2))
+BLOCK_ELEMENTS = 2 ** 21
+
+
+def _as_tables(nR):
+    # promote a single table to a stack of one
+    tables = np.asarray(nR, dtype=float)
+    if tables.ndim == 1:
+        tables = tables[None, :]
+    return tables
+
+
+def initial_guess_batch(nR_S1, nR_S2, s=1):
+    """
+    Vectorized version of the initial guess used by fit_meta_d_MLE.
+
+    :param nR_S1: (N, 2*nRatings) counts for S1 presentations
+    :param nR_S2: (N, 2*nRatings) counts for S2 presentations
+    :param s: sd(S1) / sd(S2)
+    :return: d1 (N,), t1c1 (N,), guess (N, 2*nRatings - 1) in the fitted frame
+             (meta-d' followed by criteria relative to the type 1 criterion)
+    """
+    nR_S1 = _as_tables(nR_S1)
+    nR_S2 = _as_tables(nR_S2)
+    nRatings = nR_S1.shape[1] // 2
+    t1_index = nRatings - 1
+
+    # ratingHR[c-1] = sum(nR_S2[c:]) / sum(nR_S2), for c = 1 .. 2*nRatings - 1
+    tail_S2 = np.cumsum(nR_S2[:, ::-1], axis=1)[:, ::-1]
+    tail_S1 = np.cumsum(nR_S1[:, ::-1], axis=1)[:, ::-1]
+    ratingHR = tail_S2[:, 1:] / tail_S2[:, :1]
+    ratingFAR = tail_S1[:, 1:] / tail_S1[:, :1]
+
+    d1 = (1 / s) * ndtri(ratingHR[:, t1_index]) - ndtri(ratingFAR[:, t1_index])
+    c1 = (-1 / (1 + s)) * (ndtri(ratingHR) + ndtri(ratingFAR))
+    t1c1 = c1[:, t1_index]
+    t2c1 = np.delete(c1, t1_index, axis=1)
+
+    # meta_d1 starts at d1, so the relative criterion is just t1c1
+    guess = np.column_stack((d1, t2c1 - t1c1[:, None]))
+    return d1, t1c1, guess
+
+
+def criteria_to_increments(t2c1, nRatings):
+    """
+    Ordered type 2 criteria (fitted frame, type 1 criterion at 0) -> log increments.
+
+    :param t2c1: (N, 2*nRatings - 2) criteria, "S1" side first
+    :param nRatings: number of ratings
+    :return: (N, 2*nRatings - 2) log increments, "S1" side first
+    """
+    t2c1 = np.asarray(t2c1, dtype=float)
+    zero = np.zeros((t2c1.shape[0], 1))
+    # "S1" side read from the type 1 criterion outwards
+    rS1 = np.concatenate((zero, -t2c1[:, nRatings - 2::-1]), axis=1)
+    rS2 = np.concatenate((zero, t2c1[:, nRatings - 1:]), axis=1)
+    gaps = np.concatenate((np.diff(rS1, axis=1), np.diff(rS2, axis=1)), axis=1)
+    # heuristic guesses can tie (or be inf/nan with empty cells), so keep them sane
+    gaps = np.clip(np.nan_to_num(gaps, nan=0.5, posinf=0.5), MIN_GAP, 20.)
+    return np.log(gaps)
+
+
+def increments_to_criteria(theta, nRatings, jacobian=True):
+    """
+    Inverse of criteria_to_increments.
+
+    :param jacobian: also return d(t2c1)/d(theta)
+    :return: t2c1 (N, 2*nRatings - 2) [, dc_dtheta (N, 2*nRatings - 2, 2*nRatings - 2)]
+    """
+    gaps = np.exp(theta)
+    k = nRatings - 1
+    rS1 = -np.cumsum(gaps[:, :k], axis=1)[:, ::-1]
+    rS2 = np.cumsum(gaps[:, k:], axis=1)
+    t2c1 = np.concatenate((rS1, rS2), axis=1)
+    if not jacobian:
+        return t2c1
+
+    # criterion i depends on every increment between it and the type 1 criterion
+    lower = np.tril(np.ones((k, k)))
+    dc_dtheta = np.zeros((theta.shape[0], 2 * k, 2 * k))
+    dc_dtheta[:, :k, :k] = -lower[::-1] * gaps[:, None, :k]
+    dc_dtheta[:, k:, k:] = lower * gaps[:, None, k:]
+    return t2c1, dc_dtheta
+
+
+def fit_meta_d_probs_batch(params, counts, t1c1_d1, s=1, jacobian=False):
+    """
+    Stacked version of fit_meta_d_probs / fit_meta_d_probs_jacobian.
+
+    :param params: (N, 2*nRatings - 1) meta-d' followed by type 2 criteria
+    :param counts: (N, 2, 2*nRatings) nR_S1 and nR_S2 for each table
+    :param t1c1_d1: (N,) t1c1 / d1, i.e. the relative criterion per unit meta-d'
+    :param s: sd(S1) / sd(S2)
+    :param jacobian: also return d(pr)/d(params)
+    :return: pr (N, 2, 2*nRatings) [, dpr (N, 2, 2*nRatings, 2*nRatings - 1)]
+    """
+    N, _, nBins = counts.shape
+    nRatings = nBins // 2
+    meta_d1 = params[:, 0]
+
+    # S1 / S2 means and sds with the type 1 criterion moved to 0
+    dmu = np.stack((-0.5 - t1c1_d1, 0.5 - t1c1_d1), axis=1)[:, :, None]
+    mu = meta_d1[:, None, None] * dmu
+    sd = np.array([[1.], [1. / s]])
+
+    inf = np.full((N, 1), np.inf)
+    t2c1x = np.concatenate((-inf, params[:, 1:nRatings], np.zeros((N, 1)),
+                            params[:, nRatings:], inf), axis=1)
+    z = (t2c1x[:, None, :] - mu) / sd
+    cdf = ndtr(z)
+
+    area_rS1 = cdf[:, :, nRatings:nRatings + 1]
+    pr = np.empty(counts.shape)
+    pr[:, :, :nRatings] = (cdf[:, :, 1:nRatings + 1] - cdf[:, :, :nRatings]) / area_rS1
+    pr[:, :, nRatings:] = ((1 - cdf[:, :, nRatings:-1]) - (1 - cdf[:, :, nRatings + 1:])) / (1 - area_rS1)
+    if not jacobian:
+        return pr
+
+    # same derivation as fit_meta_d_probs_jacobian, with a leading table axis
+    with np.errstate(invalid='ignore'):
+        pdf = np.where(np.isinf(z), 0., np.exp(-z ** 2 / 2) / np.sqrt(2 * np.pi) / sd)
+    lower = np.arange(nBins) < nRatings
+    Z = np.where(lower, area_rS1, 1 - area_rS1)
+    dD_dm = -dmu * (pdf[:, :, 1:] - pdf[:, :, :-1])
+    dZ_dm = np.where(lower, -1, 1) * pdf[:, :, nRatings:nRatings + 1] * dmu
+
+    bins = np.arange(nBins)
+    dD_dx = np.zeros((N, 2, nBins, nBins + 1))
+    dD_dx[:, :, bins, bins] = -pdf[:, :, :-1]
+    dD_dx[:, :, bins, bins + 1] = pdf[:, :, 1:]
+    free = np.r_[1:nRatings, nRatings + 1:nBins]
+
+    dpr = np.empty((N, 2, nBins, nBins - 1))
+    dpr[..., 0] = (dD_dm - pr * dZ_dm) / Z
+    dpr[..., 1:] = dD_dx[..., free] / Z[..., None]
+    return pr, dpr
+
+
+def fit_meta_d_logL_batch(params, counts, t1c1_d1, s=1):
+    """
+    Negative log-likelihood of each table, clamped like fit_meta_d_logL.
+
+    :return: (N,) negative log-likelihoods
+    """
+    pr = fit_meta_d_probs_batch(params, counts, t1c1_d1, s)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logL = np.sum(counts * np.log(pr), axis=(1, 2))
+    return -np.where(np.isfinite(logL), logL, -1e+300)
+
+
+def _fit_meta_d_derivs_batch(params, counts, t1c1_d1, s):
+    # gradient and expected Fisher information of the negative logL
+    nRatings = counts.shape[2] // 2
+    pr, dpr = fit_meta_d_probs_batch(params, counts, t1c1_d1, s, jacobian=True)
+    n_side = np.repeat(np.add.reduceat(counts, [0, nRatings], axis=2), nRatings, axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grad = -np.einsum('nji,njik->nk', counts / pr, dpr)
+        # sum over bins of n_side / pr * dpr dpr', as one stacked matmul W'W
+        weighted = (np.sqrt(n_side / pr)[..., None] * dpr).reshape(len(params), -1, dpr.shape[-1])
+        hess = np.matmul(weighted.transpose(0, 2, 1), weighted)
+    return np.nan_to_num(grad), np.nan_to_num(hess)
+
+
+def _damped_steps(theta, params, counts, t1c1_d1, s, damping, nRatings):
+    # one damped Gauss-Newton step in theta for each of the given tables
+    nParams = theta.shape[1]
+
+    # derivatives in the natural parameters, chained into theta
+    grad, hess = _fit_meta_d_derivs_batch(params, counts, t1c1_d1, s)
+    T = np.zeros((len(theta), nParams, nParams))
+    T[:, 0, 0] = 1.
+    T[:, 1:, 1:] = increments_to_criteria(theta[:, 1:], nRatings)[1]
+    grad = np.matmul(grad[:, None, :], T)[:, 0]
+    hess = np.matmul(np.matmul(T.transpose(0, 2, 1), hess), T)
+
+    # damping scales with the curvature
+    eye = np.eye(nParams)
+    diag = np.einsum('nii->ni', hess)
+    lhs = hess + damping[:, None, None] * (diag[:, :, None] * eye + eye)
+    return -np.linalg.solve(lhs, grad[:, :, None])[:, :, 0]
+
+
+def _to_theta(params, nRatings):
+    return np.column_stack((params[:, 0], criteria_to_increments(params[:, 1:], nRatings)))
+
+
+def _from_theta(theta, nRatings):
+    return np.column_stack((theta[:, 0], increments_to_criteria(theta[:, 1:], nRatings, jacobian=False)))
+
+
+def fit_meta_d_MLE_batch(nR_S1, nR_S2, s=1, init=None, max_iter=200, xtol=1e-8, ftol=1e-12):
+    """
+    Fit meta-d' to a stack of count tables at once.
+
+    :param nR_S1: (N, 2*nRatings) counts for S1 presentations (or one table)
+    :param nR_S2: (N, 2*nRatings) counts for S2 presentations (or one table)
+    :param s: sd(S1) / sd(S2)
+    :param init: optional (N, 2*nRatings - 1) or (2*nRatings - 1,) starting
+                 parameters [meta_d1, t2c1 - meta_c1] in S1 units, e.g. the
+                 'params' column of an earlier fit. Defaults to the
+                 fit_meta_d_MLE heuristic guess.
+    :param max_iter: maximum number of Fisher scoring iterations
+    :param xtol: stop a table once its largest parameter step is below this
+    :param ftol: ...or once its relative improvement in logL is below this
+    :return: dict of arrays, one entry (row) per table
+    """
+    nR_S1 = _as_tables(nR_S1)
+    nR_S2 = _as_tables(nR_S2)
+    if nR_S1.shape != nR_S2.shape:
+        raise ValueError('nR_S1 and nR_S2 must have the same shape')
+    if nR_S1.shape[1] % 2 != 0:
+        raise ValueError('count tables must have an even number of elements')
+
+    start_time = time.perf_counter()
+    N, nBins = nR_S1.shape
+    nRatings = nBins // 2
+    counts = np.stack((nR_S1, nR_S2), axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, t1c1, guess = initial_guess_batch(nR_S1, nR_S2, s)
+        t1c1_d1 = t1c1 / d1
+    if init is not None:
+        guess = np.broadcast_to(np.asarray(init, dtype=float), guess.shape).copy()
+    guess[:, 0] = np.clip(guess[:, 0], -META_D_BOUND, META_D_BOUND)
+
+    theta = _to_theta(guess, nRatings)
+    params = _from_theta(theta, nRatings)
+    nll = fit_meta_d_logL_batch(params, counts, t1c1_d1, s)
+
+    damping = np.full(N, 1e-3)
+    nit = np.zeros(N, dtype=int)
+    converged = np.zeros(N, dtype=bool)
+    # tables whose type 1 fit is undefined (e.g. all-zero rows) are not fitted
+    active = np.isfinite(t1c1_d1) & np.isfinite(nll) & (nll < 1e+300)
+    # the derivatives take O(nRatings^2) memory per table, so long rating
+    # scales are stepped a block of tables at a time
+    block = max(1, BLOCK_ELEMENTS // (2 * nBins * nBins))
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        nit[idx] += 1
+
+        # damped Gauss-Newton step
+        step = np.concatenate([
+            _damped_steps(theta[b], params[b], counts[b], t1c1_d1[b], s, damping[b], nRatings)
+            for b in np.split(idx, np.arange(block, idx.size, block))
+        ])
+
+        new_theta = theta[idx] + step
+        new_theta[:, 0] = np.clip(new_theta[:, 0], -META_D_BOUND, META_D_BOUND)
+        new_params = _from_theta(new_theta, nRatings)
+        new_nll = fit_meta_d_logL_batch(new_params, counts[idx], t1c1_d1[idx], s)
+
+        improved = np.isfinite(new_nll) & (new_nll <= nll[idx])
+        accept = idx[improved]
+        change = nll[accept] - new_nll[improved]
+        moved = np.max(np.abs(new_theta[improved] - theta[accept]), axis=1)
+
+        theta[accept] = new_theta[improved]
+        params[accept] = new_params[improved]
+        nll[accept] = new_nll[improved]
+        damping[accept] = np.maximum(damping[accept] / 3, 1e-9)
+        damping[idx[~improved]] *= 4
+
+        # done once steps/improvements are negligible, or no step helps at all
+        done = (moved < xtol) | (change <= ftol * np.maximum(1., np.abs(nll[accept])))
+        converged[accept[done]] = True
+        converged[idx[~improved][damping[idx[~improved]] > 1e+10]] = True
+        active &= ~converged
+
+    fit = _package_batch(params, nll, d1, t1c1, s, nRatings, converged, nit)
+    fit['diagnostics'] = _batch_diagnostics(params, counts, converged, nit, time.perf_counter() - start_time)
+    return fit
+
+
+def _batch_diagnostics(params, counts, converged, nit, wall_time):
+    # same fields as fit_meta_d_MLE's fit['diagnostics'], one entry per table
+    N = len(params)
+    return {
+        # the tables are fitted together, so each gets an even share
+        'wall_time': np.full(N, wall_time / max(N, 1)),
+        'nit': nit,
+        # one likelihood evaluation per iteration, plus the starting point
+        'nfev': nit + 1,
+        'converged': converged,
+        'meta_d_at_bound': np.abs(params[:, 0]) >= META_D_BOUND - BOUND_TOL,
+        'criteria_at_bound': np.sum(np.abs(params[:, 1:]) >= CRITERION_BOUND - BOUND_TOL, axis=1),
+        'zero_cells': np.sum(counts == 0, axis=(1, 2)),
+    }
+
+
+def _package_batch(params, nll, d1, t1c1, s, nRatings, converged, nit):
+    # mirror the fit dict from fit_meta_d_MLE, one entry per table
+    meta_d1 = params[:, 0]
+    mt1c1 = meta_d1 * (t1c1 / d1)
+    t2c1 = params[:, 1:] + mt1c1[:, None]
+    rms = np.sqrt(2 / (1 + s ** 2)) * s
+
+    fit = {}
+    fit['da'] = rms * d1
+    fit['s'] = np.full(d1.shape, s, dtype=float)
+    fit['meta_da'] = rms * meta_d1
+    fit['M_diff'] = fit['meta_da'] - fit['da']
+    fit['M_ratio'] = fit['meta_da'] / fit['da']
+    fit['meta_ca'] = rms * mt1c1
+    t2ca = rms * t2c1
+    fit['t2ca_rS1'] = t2ca[:, :nRatings - 1]
+    fit['t2ca_rS2'] = t2ca[:, nRatings - 1:]
+
+    fit['S1units'] = {}
+    fit['S1units']['d1'] = d1
+    fit['S1units']['meta_d1'] = meta_d1
+    fit['S1units']['s'] = fit['s']
+    fit['S1units']['meta_c1'] = mt1c1
+    fit['S1units']['t2c1_rS1'] = t2c1[:, :nRatings - 1]
+    fit['S1units']['t2c1_rS2'] = t2c1[:, nRatings - 1:]
+
+    fit['logL'] = -nll
+    # raw fitted parameters, usable as init= for a follow-up fit
+    fit['params'] = params
+    fit['converged'] = converged
+    fit['nit'] = nit
+    return fit
@@ -0,0 +1,201 @@
+import time
+
+import numpy as np
+from utils.meta_d.fit_meta_d_batch import (
+    criteria_to_increments, fit_meta_d_logL_batch, fit_meta_d_MLE_batch, increments_to_criteria, initial_guess_batch,
+)
+
+# Hierarchical meta-d' for a group of subjects (in the spirit of HMeta-d,
+# Fleming, 2017), sampled with plain NumPy:
+#
+#   log M_j  ~ N(mu, sigma^2)          M_j = meta-d'_j / d'_j, subject j
+#   mu       ~ N(MU_PRIOR_MEAN, MU_PRIOR_SD^2)
+#   sigma^2  ~ InvGamma(SIGMA2_PRIOR_SHAPE, SIGMA2_PRIOR_SCALE)
+#   type 2 criteria of each subject: log spacings (as in fit_meta_d_batch.py)
+#                                    ~ N(GAP_PRIOR_MEAN, GAP_PRIOR_SD^2), not pooled
+#
+# d' and the type 1 criterion are fixed at each subject's point estimates, as
+# in fit_meta_d_MLE. Subjects are independent given (mu, sigma), so every
+# iteration proposes a new (log M_j, criteria_j) block for all subjects of all
+# chains at once -- one fit_meta_d_logL_batch call -- and accepts/rejects them
+# row by row (adaptive random-walk Metropolis); mu and sigma^2 then get
+# conjugate Gibbs updates.
+
+MU_PRIOR_MEAN = 0.
+MU_PRIOR_SD = 1.
+SIGMA2_PRIOR_SHAPE = 1.
+SIGMA2_PRIOR_SCALE = 0.05
+GAP_PRIOR_MEAN = np.log(0.5)
+GAP_PRIOR_SD = 1.5
+
+# random-walk Metropolis tuning: acceptance rate aimed at during warmup
+TARGET_ACCEPTANCE = 0.234
+
+
+def _rhat(draws):
+    # Gelman-Rubin potential scale reduction; draws (n_chains, n_draws, ...)
+    n = draws.shape[1]
+    within = np.mean(np.var(draws, axis=1, ddof=1), axis=0)
+    between = n * np.var(np.mean(draws, axis=1), axis=0, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(((n - 1) / n * within + between / n) / within)
+
+
+def _log_likelihood(x, d1, counts, t1c1_d1, s, nRatings):
+    # logL of each row's (log M, log criterion spacings); -inf where it's clamped
+    params = np.column_stack((np.exp(x[:, 0]) * d1, increments_to_criteria(x[:, 1:], nRatings, jacobian=False)))
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        nll = fit_meta_d_logL_batch(params, counts, t1c1_d1, s)
+    return np.where(np.isfinite(nll) & (nll < 1e+300), -nll, -np.inf)
+
+
+def _log_prior(x, mu, sigma):
+    # subject-level prior of each row, given its chain's mu and sigma (up to a constant)
+    return (-0.5 * ((x[:, 0] - mu) / sigma) ** 2
+            - 0.5 * np.sum(((x[:, 1:] - GAP_PRIOR_MEAN) / GAP_PRIOR_SD) ** 2, axis=1))
+
+
+def fit_meta_d_hierarchical(nR_S1, nR_S2, s=1, n_samples=2000, n_warmup=2000, n_chains=4, thin=1, seed=0):
+    """
+    Sample the hierarchical meta-d' model for a group of subjects.
+
+    :param nR_S1: (n_subjects, 2*nRatings) counts for S1 presentations, one
+                  row per subject (as from trials_to_counts; pad them if
+                  subjects have empty cells)
+    :param nR_S2: (n_subjects, 2*nRatings) counts for S2 presentations
+    :param s: sd(S1) / sd(S2)
+    :param n_samples: draws kept per chain (after thinning)
+    :param n_warmup: adaptation iterations per chain, discarded
+    :param n_chains: independent chains (sampled together)
+    :param thin: keep every thin-th draw
+    :param seed: random seed
+    :return: dict with
+             'mu_logM', 'sigma_logM' -- (n_chains, n_samples) group draws
+             'logM' -- (n_chains, n_samples, n_subjects) subject draws
+             'group_M_ratio' -- posterior mean of exp(mu), and
+             'group_M_ratio_ci' -- its 95% interval
+             'M_ratio', 'M_ratio_sd', 'meta_da', 'da' -- per-subject posterior
+             means / sds (nan for subjects left out)
+             'included' -- subjects in the model (d' > 0 and a usable type 1 fit)
+             'acceptance' -- per-subject Metropolis acceptance rate
+             'rhat' -- {'mu_logM', 'sigma_logM', 'logM_max'} convergence checks
+             'wall_time'
+    """
+    start_time = time.perf_counter()
+    rng = np.random.default_rng(seed)
+
+    # d', the type 1 criterion, and per-subject MLEs to start from
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1_all, t1c1_all, _ = initial_guess_batch(nR_S1, nR_S2, s)
+        t1c1_d1_all = t1c1_all / d1_all
+        mle = fit_meta_d_MLE_batch(nR_S1, nR_S2, s=s)
+    counts_all = np.stack((np.atleast_2d(nR_S1), np.atleast_2d(nR_S2)), axis=1).astype(float)
+    n_subjects, _, nBins = counts_all.shape
+    nRatings = nBins // 2
+    included = np.isfinite(d1_all) & (d1_all > 0) & np.isfinite(t1c1_d1_all)
+    if not included.any():
+        raise ValueError("no subject has d' > 0 and a usable type 1 fit")
+    J = int(included.sum())
+
+    # one row per (chain, subject)
+    d1 = np.tile(d1_all[included], n_chains)
+    t1c1_d1 = np.tile(t1c1_d1_all[included], n_chains)
+    counts = np.tile(counts_all[included], (n_chains, 1, 1))
+    n_rows, p = n_chains * J, nBins - 1
+
+    # start each chain near the MLE, jittered
+    m_ratio = np.clip(np.nan_to_num(mle['M_ratio'][included], nan=1.), 0.05, 5.)
+    x = np.column_stack((np.log(m_ratio), criteria_to_increments(mle['params'][included, 1:], nRatings)))
+    x = np.tile(x, (n_chains, 1)) + 0.1 * rng.standard_normal((n_rows, p))
+    logM = x[:, 0].reshape(n_chains, J)
+    mu = logM.mean(axis=1)
+    sigma = np.maximum(logM.std(axis=1), 0.1)
+
+    def row(values):
+        return np.repeat(values, J)
+
+    loglik = _log_likelihood(x, d1, counts, t1c1_d1, s, nRatings)
+
+    # proposal: scale * chol @ z; start isotropic, then use each row's warmup
+    # covariance from half way through warmup on
+    chol = np.broadcast_to(np.eye(p), (n_rows, p, p)).copy()
+    log_scale = np.full(n_rows, np.log(0.1))
+    sum_x = np.zeros((n_rows, p))
+    sum_xx = np.zeros((n_rows, p, p))
+    n_sum = 0
+
+    n_iter = n_warmup + n_samples * thin
+    keep_mu = np.empty((n_chains, n_samples))
+    keep_sigma = np.empty((n_chains, n_samples))
+    keep_logM = np.empty((n_chains, n_samples, J))
+    sum_meta_d = np.zeros(n_rows)
+    accepted = np.zeros(n_rows)
+
+    for it in range(n_iter):
+        # subjects: one batched Metropolis step for every (chain, subject) row
+        step = np.matmul(chol, rng.standard_normal((n_rows, p, 1)))[:, :, 0]
+        proposal = x + np.exp(log_scale)[:, None] * step
+        loglik_new = _log_likelihood(proposal, d1, counts, t1c1_d1, s, nRatings)
+        ratio = loglik_new + _log_prior(proposal, row(mu), row(sigma)) - loglik - _log_prior(x, row(mu), row(sigma))
+        with np.errstate(invalid='ignore'):
+            accept = np.log(rng.random(n_rows)) < ratio
+        x[accept] = proposal[accept]
+        loglik[accept] = loglik_new[accept]
+
+        # group: conjugate updates per chain
+        logM = x[:, 0].reshape(n_chains, J)
+        precision = 1 / MU_PRIOR_SD ** 2 + J / sigma ** 2
+        mean = (MU_PRIOR_MEAN / MU_PRIOR_SD ** 2 + logM.sum(axis=1) / sigma ** 2) / precision
+        mu = mean + rng.standard_normal(n_chains) / np.sqrt(precision)
+        shape = SIGMA2_PRIOR_SHAPE + J / 2
+        scale = SIGMA2_PRIOR_SCALE + 0.5 * np.sum((logM - mu[:, None]) ** 2, axis=1)
+        sigma = np.sqrt(scale / rng.gamma(shape, size=n_chains))
+
+        if it < n_warmup:
+            # Robbins-Monro: nudge each row's scale toward the target acceptance
+            log_scale += (accept - TARGET_ACCEPTANCE) / (it + 1) ** 0.6
+            if it >= n_warmup // 4:
+                sum_x += x
+                sum_xx += x[:, :, None] * x[:, None, :]
+                n_sum += 1
+            if it == n_warmup // 2 and n_sum > p:
+                cov = sum_xx / n_sum - (sum_x / n_sum)[:, :, None] * (sum_x / n_sum)[:, None, :]
+                chol = np.linalg.cholesky(cov + 1e-6 * np.eye(p))
+                log_scale[:] = np.log(2.38 / np.sqrt(p))
+            continue
+
+        accepted += accept
+        draw, kept = divmod(it - n_warmup, thin)
+        if kept == 0:
+            keep_mu[:, draw] = mu
+            keep_sigma[:, draw] = sigma
+            keep_logM[:, draw] = logM
+            sum_meta_d += np.exp(x[:, 0]) * d1
+
+    def per_subject(values, fill=np.nan):
+        out = np.full(n_subjects, fill, dtype=float)
+        out[included] = values
+        return out
+
+    m_draws = np.exp(keep_logM)
+    group = np.exp(keep_mu).ravel()
+    rms = np.sqrt(2 / (1 + s ** 2)) * s
+    return {
+        'mu_logM': keep_mu,
+        'sigma_logM': keep_sigma,
+        'logM': keep_logM,
+        'group_M_ratio': float(np.mean(group)),
+        'group_M_ratio_ci': tuple(np.quantile(group, [0.025, 0.975])),
+        'M_ratio': per_subject(m_draws.mean(axis=(0, 1))),
+        'M_ratio_sd': per_subject(m_draws.std(axis=(0, 1))),
+        'meta_da': per_subject(rms * sum_meta_d.reshape(n_chains, J).mean(axis=0) / n_samples),
+        'da': rms * d1_all,
+        'included': included,
+        'acceptance': per_subject(accepted.reshape(n_chains, J).mean(axis=0) / (n_iter - n_warmup)),
+        'rhat': {
+            'mu_logM': float(_rhat(keep_mu)),
+            'sigma_logM': float(_rhat(keep_sigma)),
+            'logM_max': float(np.max(_rhat(keep_logM))),
+        },
+        'wall_time': time.perf_counter() - start_time,
+    }
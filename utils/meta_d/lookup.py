@@ -0,0 +1,282 @@
+import os
+import zipfile
+
+import numpy as np
+from scipy.special import ndtr, ndtri
+from utils.meta_d.fit_meta_d_batch import META_D_BOUND, MIN_GAP, fit_meta_d_MLE_batch, initial_guess_batch
+
+# Precomputed lookup index for meta-d' starting values (and quick estimates).
+#
+# For a given meta-d' and relative type 1 criterion (meta_c1 = meta-d' * t1c1 / d1,
+# as in fit_meta_d_MLE) the model fixes the type 2 ROC of each response: the
+# type 2 criteria only pick points along it. The index stores those curves --
+# z(type 2 HR) at a grid of z(type 2 FAR) -- over a grid of meta-d' and
+# t1c1 / d1, in an .npz file. A count table is then looked up by
+#   1. interpolating every stored curve at the table's observed type 2 FARs,
+#   2. taking the meta-d' whose curves pass closest to the observed HRs
+#      (refined between grid points with a parabola), and
+#   3. reading each type 2 criterion off its observed HR and FAR under that meta-d'.
+# All tables are looked up at once, a block at a time.
+
+# the index is built on first use and kept in the user's cache directory
+# ($XDG_CACHE_HOME, or ~/.cache), not in the package, which may be read-only
+LOOKUP_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "meta_d", "meta_d_lookup.npz",
+)
+# bump if the index layout or grids change, so old files get rebuilt
+LOOKUP_FORMAT = 1
+
+META_D_GRID = np.linspace(-1., 5., 61)
+RATIO_GRID = np.linspace(-2., 2., 41)  # t1c1 / d1
+Z_FAR_GRID = np.linspace(-3.5, 3.5, 57)
+
+# rough cap on the elements of the per-block interpolation array
+BLOCK_ELEMENTS = 2 ** 20
+
+# loaded indexes, by path (each process reads the file once)
+_loaded = {}
+
+
+def _type2_roc(meta_d, ratio, z_far):
+    # z(type 2 HR) at z(type 2 FAR) for every grid point:
+    # (len(ratio), 2 responses ("S1", "S2"), len(z_far), len(meta_d)) -- meta-d'
+    # last, so a lookup gathers contiguous rows
+    m = meta_d[None, None, :]
+    mc = m * ratio[:, None, None]
+    far = ndtr(z_far)[None, :, None]
+
+    # "S2" responses (x > mc): FAR from S1 trials, HR from S2 trials
+    t = -m / 2 - ndtri(far * ndtr(-(mc + m / 2)))
+    hr_rS2 = ndtr(-(t - m / 2)) / ndtr(-(mc - m / 2))
+    # "S1" responses (x < mc): FAR from S2 trials, HR from S1 trials
+    t = m / 2 + ndtri(far * ndtr(mc - m / 2))
+    hr_rS1 = ndtr(t + m / 2) / ndtr(mc + m / 2)
+
+    hr = np.stack((hr_rS1, hr_rS2), axis=1)
+    return ndtri(np.clip(np.nan_to_num(hr, nan=0.5), 1e-12, 1 - 1e-12))
+
+
+def build_lookup_index(path=LOOKUP_FILE):
+    """
+    Compute the index and save it to path (if path can't be written, e.g. a
+    read-only home, the index is only returned).
+
+    :return: the index (dict of arrays)
+    """
+    index = {
+        "_format": np.array(LOOKUP_FORMAT),
+        "meta_d": META_D_GRID,
+        "ratio": RATIO_GRID,
+        "z_far": Z_FAR_GRID,
+        "z_hr": _type2_roc(META_D_GRID, RATIO_GRID, Z_FAR_GRID),
+    }
+    if path is not None:
+        # write to a temp file first, so a crash never leaves a half-written
+        # index, and processes building it at the same time don't clash
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.savez(tmp, **index)
+            os.replace(tmp, path)
+        except OSError:
+            # saving is only an optimization; it takes well under a second to rebuild
+            pass
+    return index
+
+
+def load_lookup_index(path=LOOKUP_FILE):
+    """
+    The index at path, built (and saved) first if it's missing or outdated.
+
+    :return: the index (dict of arrays)
+    """
+    if path in _loaded:
+        return _loaded[path]
+    index = None
+    if path is not None and os.path.exists(path):
+        try:
+            with np.load(path, allow_pickle=False) as bundle:
+                if int(bundle["_format"]) == LOOKUP_FORMAT:
+                    index = {key: bundle[key] for key in bundle.files}
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # unreadable/corrupt index: just rebuild it below
+            pass
+    if index is None:
+        index = build_lookup_index(path)
+    _loaded[path] = index
+    return index
+
+
+def _normal_pdf(z):
+    return np.exp(-0.5 * z ** 2) / np.sqrt(2 * np.pi)
+
+
+def _grid_position(grid, values):
+    # index of the grid cell each value falls in, and how far along it (0..1);
+    # values outside the grid are clamped to its ends
+    step = grid[1] - grid[0]
+    pos = np.clip((values - grid[0]) / step, 0, len(grid) - 1 - 1e-9)
+    cell = pos.astype(int)
+    return cell, pos - cell
+
+
+def _observed_type2(nR_S1, nR_S2, nRatings):
+    # observed type 2 FAR/HR (from rating 2 up) per response side: (N, 2, nRatings - 1)
+    # each, in the same order as fit_meta_d_MLE's obs_*2_rS1 / obs_*2_rS2,
+    # plus the number of trials behind each FAR and HR (N, 2)
+    def tail(counts):
+        tails = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+        return tails[:, 1:] / tails[:, :1], tails[:, 0]
+
+    far_rS1, n_far_rS1 = tail(nR_S2[:, nRatings - 1::-1])
+    hr_rS1, n_hr_rS1 = tail(nR_S1[:, nRatings - 1::-1])
+    far_rS2, n_far_rS2 = tail(nR_S1[:, nRatings:])
+    hr_rS2, n_hr_rS2 = tail(nR_S2[:, nRatings:])
+    far = np.stack((far_rS1, far_rS2), axis=1)
+    hr = np.stack((hr_rS1, hr_rS2), axis=1)
+    n_far = np.stack((n_far_rS1, n_far_rS2), axis=1)
+    n_hr = np.stack((n_hr_rS1, n_hr_rS2), axis=1)
+    return far, hr, n_far, n_hr
+
+
+def _lookup_meta_d(index, ratio, z_far, z_hr, weight):
+    # meta-d' whose type 2 ROCs pass closest to the observed (z_far, z_hr)
+    # points, for a block of tables; z_* (N, 2, K), weight (N, 2, K)
+    meta_d, z_hr_grid = index["meta_d"], index["z_hr"]
+    r_cell, r_frac = _grid_position(index["ratio"], ratio)
+    z_cell, z_frac = _grid_position(index["z_far"], z_far)
+    n_ratio, _, n_z, n_meta = z_hr_grid.shape
+    z_hr_grid = z_hr_grid.reshape(-1, n_meta)
+
+    # bilinear in (t1c1 / d1, z FAR), for every meta-d' on the grid: (N, 2, K, n_meta)
+    def rows(r, z):
+        # flat row of (ratio cell r, response side, z FAR cell z)
+        return np.take(z_hr_grid, (r[:, None, None] * 2 + np.arange(2)[None, :, None]) * n_z + z, axis=0)
+
+    r1 = np.minimum(r_cell + 1, n_ratio - 1)
+    z1 = np.minimum(z_cell + 1, n_z - 1)
+    fz, fr = z_frac[..., None], r_frac[:, None, None, None]
+    curve = ((1 - fr) * ((1 - fz) * rows(r_cell, z_cell) + fz * rows(r_cell, z1))
+             + fr * ((1 - fz) * rows(r1, z_cell) + fz * rows(r1, z1)))
+
+    sse = np.sum(weight[..., None] * (curve - z_hr[..., None]) ** 2, axis=(1, 2))
+    best = np.argmin(sse, axis=1)
+
+    # parabola through the best grid point and its neighbours
+    inner = np.clip(best, 1, len(meta_d) - 2)
+    rows = np.arange(len(sse))
+    below, at, above = sse[rows, inner - 1], sse[rows, inner], sse[rows, inner + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.clip(0.5 * (below - above) / (below - 2 * at + above), -0.5, 0.5)
+    shift = np.where((best == inner) & np.isfinite(shift), shift, 0.)
+    return meta_d[best] + shift * (meta_d[1] - meta_d[0])
+
+
+def _criterion_reading(rate, n, tail, offset):
+    # offset + z(rate * tail): where a criterion has to sit for rate (a share of
+    # the trials in tail) to come out, and its delta-method variance
+    z = ndtri(rate * tail)
+    var = rate * (1 - rate) / n * (tail / _normal_pdf(z)) ** 2
+    return offset + z, var
+
+
+def _criteria_from_rates(meta_d, mc, far, hr, n_far, n_hr, nRatings):
+    # type 2 criteria (fitted frame: relative to meta_c1) that reproduce the
+    # observed FAR and HR under meta_d -- the two readings combined by inverse
+    # variance, then put in order moving out from meta_c1
+    m, mc = meta_d[:, None], mc[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # "S1" side, below mc: FAR = Phi(t - m/2) / Phi(mc - m/2), HR = Phi(t + m/2) / Phi(mc + m/2)
+        from_far = _criterion_reading(far[:, 0], n_far[:, :1], ndtr(mc - m / 2), m / 2)
+        from_hr = _criterion_reading(hr[:, 0], n_hr[:, :1], ndtr(mc + m / 2), -m / 2)
+        rS1 = mc - _combine(from_far, from_hr)
+        # "S2" side, above mc: the same with -t (FAR from S1 trials, HR from S2 trials)
+        from_far = _criterion_reading(far[:, 1], n_far[:, 1:], ndtr(-(mc + m / 2)), m / 2)
+        from_hr = _criterion_reading(hr[:, 1], n_hr[:, 1:], ndtr(-(mc - m / 2)), -m / 2)
+        rS2 = -_combine(from_far, from_hr) - mc
+
+    # distances from meta_c1, increasing by at least MIN_GAP
+    steps = np.arange(1, nRatings) * MIN_GAP
+    rS1 = np.maximum.accumulate(np.maximum(np.nan_to_num(rS1, nan=0.5, posinf=5.), 0.), axis=1) + steps
+    rS2 = np.maximum.accumulate(np.maximum(np.nan_to_num(rS2, nan=0.5, posinf=5.), 0.), axis=1) + steps
+    return np.concatenate((-rS1[:, ::-1], rS2), axis=1)
+
+
+def _combine(*readings):
+    # inverse-variance mean of (value, variance) readings, skipping unusable ones
+    values = np.stack([value for value, _ in readings])
+    weights = 1 / np.stack([var for _, var in readings])
+    usable = np.isfinite(values) & np.isfinite(weights)
+    weights = np.where(usable, weights, 0.)
+    return np.sum(weights * np.where(usable, values, 0.), axis=0) / np.sum(weights, axis=0)
+
+
+def _check_equal_variance(s):
+    if s != 1:
+        raise ValueError("the lookup index only covers the equal-variance model (s = 1)")
+
+
+def lookup_guess(nR_S1, nR_S2, s=1, index=None):
+    """
+    Starting values for fit_meta_d_MLE / fit_meta_d_MLE_batch from the index.
+
+    :param nR_S1: (N, 2*nRatings) counts for S1 presentations (or one table)
+    :param nR_S2: (N, 2*nRatings) counts for S2 presentations (or one table)
+    :param s: sd(S1) / sd(S2); the index is built for s = 1 only, anything
+              else raises ValueError
+    :param index: from load_lookup_index (default: the one at LOOKUP_FILE)
+    :return: (N, 2*nRatings - 1) [meta_d1, t2c1 - meta_c1], usable as init
+    """
+    _check_equal_variance(s)
+    if index is None:
+        index = load_lookup_index()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, t1c1, heuristic = initial_guess_batch(nR_S1, nR_S2)
+        ratio = np.nan_to_num(t1c1 / d1, nan=0., posinf=0., neginf=0.)
+    nR_S1 = np.atleast_2d(np.asarray(nR_S1, dtype=float))
+    nR_S2 = np.atleast_2d(np.asarray(nR_S2, dtype=float))
+    N, nRatings = len(nR_S1), nR_S1.shape[1] // 2
+
+    far, hr, n_far, n_hr = _observed_type2(nR_S1, nR_S2, nRatings)
+    # z-transform the rates, keeping empty or all-in-one-bin cells finite, and
+    # weight each ROC point by its inverse (binomial, delta method) variance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_far, p_hr = np.clip(far, 1e-4, 1 - 1e-4), np.clip(hr, 1e-4, 1 - 1e-4)
+        z_far, z_hr = ndtri(p_far), ndtri(p_hr)
+        var = (p_far * (1 - p_far) / (n_far[:, :, None] * _normal_pdf(z_far) ** 2)
+               + p_hr * (1 - p_hr) / (n_hr[:, :, None] * _normal_pdf(z_hr) ** 2))
+        weight = 1 / var
+    weight = np.where(np.isfinite(z_far) & np.isfinite(z_hr) & np.isfinite(weight), weight, 0.)
+    z_far, z_hr = np.nan_to_num(z_far), np.nan_to_num(z_hr)
+
+    meta_d = np.empty(N)
+    block = max(1, BLOCK_ELEMENTS // (len(index["meta_d"]) * 2 * max(nRatings - 1, 1)))
+    for start in range(0, N, block):
+        rows = slice(start, start + block)
+        meta_d[rows] = _lookup_meta_d(index, ratio[rows], z_far[rows], z_hr[rows], weight[rows])
+    # nothing to go on (e.g. no trials on one side): fit_meta_d_MLE's own starting meta-d'
+    blind = np.sum(weight, axis=(1, 2)) == 0
+    meta_d[blind] = np.clip(np.nan_to_num(heuristic[blind, 0], nan=1.), -META_D_BOUND, META_D_BOUND)
+
+    criteria = _criteria_from_rates(meta_d, meta_d * ratio, far, hr, n_far, n_hr, nRatings)
+    return np.column_stack((meta_d, criteria))
+
+
+def fast_estimate(nR_S1, nR_S2, s=1, n_iter=0, index=None):
+    """
+    Approximate meta-d' for many tables straight from the index, for screening
+    (e.g. huge simulated datasets) when a full fit isn't needed.
+
+    :param nR_S1: (N, 2*nRatings) counts for S1 presentations (or one table)
+    :param nR_S2: (N, 2*nRatings) counts for S2 presentations (or one table)
+    :param s: sd(S1) / sd(S2); only s = 1 (ValueError otherwise)
+    :param n_iter: Fisher scoring iterations to refine the looked-up values
+                   with (0 = the lookup as is; a few get close to the MLE)
+    :param index: from load_lookup_index (default: the one at LOOKUP_FILE)
+    :return: columnar fit dict as from fit_meta_d_MLE_batch (converged is only
+             True where the refinement converged)
+    """
+    init = lookup_guess(nR_S1, nR_S2, s, index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return fit_meta_d_MLE_batch(nR_S1, nR_S2, init=init, max_iter=n_iter)
@@ -1,20 +1,32 @@
 import warnings
 import numpy as np
-from contextlib import redirect_stdout
-import os
-from utils.meta_d.trials_to_counts import trials_to_counts
-from utils.meta_d.fit_meta_d_MLE import fit_meta_d_MLE
+from functools import partial
+from utils.parallel import parallel_map
+from utils.meta_d.trials_to_counts import infer_n_ratings, trials_to_counts
+from utils.meta_d.fit_meta_d_batch import fit_meta_d_MLE_batch
+from utils.meta_d.hierarchical import fit_meta_d_hierarchical
+from utils.meta_d.fit_cache import fit_cache_key
 
-def compute_meta_d_prime(data, n_ratings=4, pad_cells=1):
+def compute_meta_d_prime(data, n_ratings=4, pad_cells=1, cache=None, n_starts=1):
     """
     Compute meta-d' from a dataframe containing 'stimID', 'response', and 'rating'.
 
     :param data: pandas DataFrame
-    :param n_ratings: number of confidence ratings (default 4)
+    :param n_ratings: number of confidence ratings (default 4); 'infer' takes
+                      the highest rating in the data (see infer_n_ratings)
     :param pad_cells: whether to pad counts to avoid log(0) issues
-    :return: fit dict (meta_d', d', M_ratio, M_diff)
+    :param cache: optional utils.meta_d.fit_cache.FitCache; identical count
+                  tables are then only ever fitted once
+    :param n_starts: if > 1, fit from up to this many starting points and keep
+                     the best (see utils/meta_d/multistart.py)
+    :return: fit dict (meta_d', d', M_ratio, M_diff); how the fit went
+             (time, iterations, convergence, zero cells...) is in fit['diagnostics'],
+             and with n_starts > 1 the spread over starts is in fit['multistart']
     """
 
+    if n_ratings == 'infer':
+        n_ratings = infer_n_ratings(data['rating'])
+
     # number (of) responses (for) stimulus 1,
     # number (of) responses (for) stimulus 2
     nr_s1, nr_s2 = trials_to_counts(
@@ -25,12 +37,125 @@ def compute_meta_d_prime(data, n_ratings=4, pad_cells=1):
         pad_cells=pad_cells # adds vals to all bins to prevent log(0) errors
     )
 
-    # suppress warnings and optimizer chatter
-    with open(os.devnull, 'w') as f, redirect_stdout(f):
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", RuntimeWarning)
-            warnings.simplefilter("ignore", UserWarning)
-            with np.errstate(invalid='ignore', divide='ignore'):
-                fit = fit_meta_d_MLE(nr_s1, nr_s2)
+    if cache is not None:
+        if n_starts > 1:
+            key = fit_cache_key(nr_s1, nr_s2, fitter='fit_meta_d_MLE_multistart', n_starts=n_starts,
+                                n_ratings=n_ratings, pad_cells=pad_cells)
+        else:
+            key = fit_cache_key(nr_s1, nr_s2, fitter='fit_meta_d_MLE', n_ratings=n_ratings, pad_cells=pad_cells)
+        fit = cache.get(key)
+        if fit is not None:
+            return fit
+
+    # imported here so loading this module doesn't pull in scipy.optimize
+    from utils.meta_d.fit_meta_d_MLE import fit_meta_d_MLE, ZeroCountWarning
+
+    # the fitter itself is quiet (optimizer warnings end up in the diagnostics);
+    # zero cells are counted in fit['diagnostics']['zero_cells'] too
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ZeroCountWarning)
+        if n_starts > 1:
+            from utils.meta_d.multistart import fit_meta_d_MLE_multistart
+            fit = fit_meta_d_MLE_multistart(nr_s1, nr_s2, n_starts=n_starts)
+        else:
+            fit = fit_meta_d_MLE(nr_s1, nr_s2)
+
+    if cache is not None:
+        cache.put(key, fit)
+
+    return fit
+
+
+def compute_meta_d_prime_batch(datasets, n_ratings=4, pad_cells=1, fast=False):
+    """
+    Compute meta-d' for many dataframes at once (subjects, sessions, conditions...).
+    All count tables are fitted together by fit_meta_d_MLE_batch.
+
+    :param datasets: list of pandas DataFrames, each like the one compute_meta_d_prime takes
+    :param n_ratings: number of confidence ratings (default 4); 'infer' takes
+                      the highest rating in any of the datasets, so they all
+                      share one scale
+    :param pad_cells: whether to pad counts to avoid log(0) issues
+    :param fast: if True, approximate meta-d' straight from the precomputed
+                 lookup index instead of fitting (for screening; see
+                 utils/meta_d/lookup.py)
+    :return: fit dict of arrays, in the same order as datasets
+    """
+
+    if n_ratings == 'infer':
+        n_ratings = max(infer_n_ratings(data['rating']) for data in datasets)
+
+    counts = [
+        trials_to_counts(
+            data['stimID'],
+            data['response'],
+            data['rating'],
+            n_ratings,
+            pad_cells=pad_cells
+        )
+        for data in datasets
+    ]
+    nr_s1 = np.array([c[0] for c in counts])
+    nr_s2 = np.array([c[1] for c in counts])
+
+    if fast:
+        from utils.meta_d.lookup import fast_estimate
+        return fast_estimate(nr_s1, nr_s2)
+    return fit_meta_d_MLE_batch(nr_s1, nr_s2)
+
+
+def compute_meta_d_prime_group(datasets, n_ratings=4, pad_cells=1, n_samples=2000, n_warmup=2000, n_chains=4,
+                               seed=0):
+    """
+    Hierarchical (group-level) meta-d' over many dataframes, one per subject:
+    log M-ratios are drawn from a common normal distribution, so each subject's
+    estimate borrows strength from the group (see utils/meta_d/hierarchical.py).
+
+    :param datasets: list of pandas DataFrames, one per subject
+    :param n_ratings: number of confidence ratings (default 4); 'infer' takes
+                      the highest rating in any of the datasets, so they all
+                      share one scale
+    :param pad_cells: whether to pad counts to avoid log(0) issues
+    :param n_samples: posterior draws kept per chain
+    :param n_warmup: adaptation iterations per chain
+    :param n_chains: chains (sampled together)
+    :param seed: random seed
+    :return: posterior dict from fit_meta_d_hierarchical (per-subject entries
+             in the same order as datasets)
+    """
+
+    if n_ratings == 'infer':
+        n_ratings = max(infer_n_ratings(data['rating']) for data in datasets)
+
+    counts = [
+        trials_to_counts(data['stimID'], data['response'], data['rating'], n_ratings, pad_cells=pad_cells)
+        for data in datasets
+    ]
+    nr_s1 = np.array([c[0] for c in counts])
+    nr_s2 = np.array([c[1] for c in counts])
+
+    return fit_meta_d_hierarchical(nr_s1, nr_s2, n_samples=n_samples, n_warmup=n_warmup, n_chains=n_chains, seed=seed)
+
+
+def compute_meta_d_prime_many(datasets, n_ratings=4, pad_cells=1, n_workers=None, chunk_size=None, cache=None,
+                              n_starts=1):
+    """
+    Run compute_meta_d_prime on many dataframes across a pool of worker processes.
+
+    :param datasets: list of pandas DataFrames (subjects, halves, conditions...)
+    :param n_ratings: number of confidence ratings (default 4); 'infer' takes
+                      the highest rating in any of the datasets, so they all
+                      share one scale
+    :param pad_cells: whether to pad counts to avoid log(0) issues
+    :param n_workers: number of processes (default: all CPUs; 1 = no pool)
+    :param chunk_size: datasets handed to a worker at a time
+    :param cache: optional FitCache (workers share its on-disk tier, if any)
+    :param n_starts: starting points per fit (see compute_meta_d_prime)
+    :return: list of fit dicts in the same order as datasets; a dataset whose
+             fit raised gets a (falsy) utils.parallel.TaskError instead
+    """
 
-    return fit
\ No newline at end of file
+    if n_ratings == 'infer':
+        n_ratings = max(infer_n_ratings(data['rating']) for data in datasets)
+    fit_one = partial(compute_meta_d_prime, n_ratings=n_ratings, pad_cells=pad_cells, cache=cache, n_starts=n_starts)
+    return parallel_map(fit_one, datasets, n_workers=n_workers, chunk_size=chunk_size)
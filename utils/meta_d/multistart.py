@@ -0,0 +1,129 @@
+import warnings
+
+import numpy as np
+from utils.meta_d.fit_meta_d_batch import (
+    META_D_BOUND, criteria_to_increments, fit_meta_d_MLE_batch, increments_to_criteria, initial_guess_batch,
+)
+
+# Multi-start fitting: fit_meta_d_MLE from a single heuristic guess can end up
+# in a poor local optimum, or get stuck on the -1e300 clamp in fit_meta_d_logL.
+# Here the same table is fitted from several starting points. Each wave of
+# starts is one fit_meta_d_MLE_batch call (the starts are just stacked copies
+# of the table with different init rows), so a wave costs about as much as a
+# single start. Waves stop once enough starts agree on the best logL, and the
+# best start is then polished by fit_meta_d_MLE, so the result is an ordinary
+# fit dict plus a fit['multistart'] report.
+
+# per-start fields kept in fit['multistart']
+START_STATS = ('logL', 'meta_da', 'M_ratio', 'converged')
+
+
+def multistart_points(nR_S1, nR_S2, n_starts, jitter=0.5, seed=None):
+    """
+    Starting points for one table: the fit_meta_d_MLE heuristic first, then
+    meta-d' on a grid of M-ratios from 0 to 2 (in shuffled order, so every wave
+    covers the range), each with type 2 criteria spacings jittered around the
+    heuristic ones.
+
+    :param nR_S1: counts for S1 presentations
+    :param nR_S2: counts for S2 presentations
+    :param n_starts: number of starting points
+    :param jitter: sd of the jitter on the log spacings between criteria
+    :param seed: seed or numpy Generator
+    :return: (n_starts, 2*nRatings - 1) [meta_d1, t2c1 - meta_c1], usable as init rows
+    """
+    rng = np.random.default_rng(seed)
+    nRatings = len(nR_S1) // 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, _, guess = initial_guess_batch(nR_S1, nR_S2)
+    d1 = d1[0] if np.isfinite(d1[0]) else 1.
+
+    increments = criteria_to_increments(guess[:, 1:], nRatings)
+    increments = np.repeat(increments, n_starts, axis=0)
+    increments[1:] += jitter * rng.standard_normal(increments[1:].shape)
+
+    meta_d1 = np.empty(n_starts)
+    meta_d1[0] = guess[0, 0]
+    meta_d1[1:] = d1 * rng.permutation(np.linspace(0., 2., n_starts - 1))
+
+    points = np.column_stack((meta_d1, increments_to_criteria(increments, nRatings, jacobian=False)))
+    points[:, 0] = np.clip(np.nan_to_num(points[:, 0], nan=1.), -META_D_BOUND, META_D_BOUND)
+    return points
+
+
+def fit_meta_d_MLE_multistart(nR_S1, nR_S2, s=1, n_starts=16, wave_size=4, confirm=2, logL_tol=1e-3,
+                              jitter=0.5, seed=0, solver='trust-constr', analytic_grad=False):
+    """
+    fit_meta_d_MLE, started from several points, keeping the best.
+
+    :param nR_S1: counts for S1 presentations
+    :param nR_S2: counts for S2 presentations
+    :param s: sd(S1) / sd(S2)
+    :param n_starts: most starting points to try (see multistart_points)
+    :param wave_size: starts fitted together per wave
+    :param confirm: stop after a wave once this many starts reached the best
+                    logL so far (within logL_tol)
+    :param logL_tol: logL difference still counted as the same optimum
+    :param jitter: sd of the jitter on the log criterion spacings
+    :param seed: seed for the jitter/grid order
+    :param solver, analytic_grad: passed on to fit_meta_d_MLE for the final polish
+    :return: fit dict as from fit_meta_d_MLE, plus fit['multistart']: per-start
+             arrays (START_STATS, in start order, for the starts that were run),
+             'best' (index of the start that was polished), 'n_starts' (run),
+             'n_confirmed', 'stopped_early', 'n_failed' (starts stuck at the
+             logL clamp), and the spread among the converged starts
+             ('logL_range', 'meta_da_range', 'meta_da_sd')
+    """
+    # imported here so loading this module doesn't pull in scipy.optimize
+    from utils.meta_d.fit_meta_d_MLE import fit_meta_d_MLE
+
+    nR_S1 = np.asarray(nR_S1, dtype=float)
+    nR_S2 = np.asarray(nR_S2, dtype=float)
+    points = multistart_points(nR_S1, nR_S2, n_starts, jitter, seed)
+
+    runs = []
+    n_confirmed = 0
+    for start in range(0, n_starts, wave_size):
+        init = points[start:start + wave_size]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wave = fit_meta_d_MLE_batch(
+                np.repeat(nR_S1[None], len(init), axis=0), np.repeat(nR_S2[None], len(init), axis=0),
+                s=s, init=init,
+            )
+        runs.append(wave)
+
+        logL = np.concatenate([run['logL'] for run in runs])
+        n_confirmed = int(np.sum(logL >= np.max(logL) - logL_tol))
+        if n_confirmed >= confirm:
+            break
+
+    starts = {stat: np.concatenate([run[stat] for run in runs]) for stat in START_STATS}
+    params = np.concatenate([run['params'] for run in runs])
+    # starts that never left the clamp (or the heuristic's nan) didn't fit at all
+    failed = ~np.isfinite(starts['logL']) | (starts['logL'] <= -1e+300)
+    best = int(np.argmax(np.where(failed, -np.inf, starts['logL'])))
+
+    # the usual fit dict (and diagnostics), started from the best start
+    fit = fit_meta_d_MLE(nR_S1, nR_S2, s=s, analytic_grad=analytic_grad, solver=solver,
+                         init=None if failed[best] else params[best])
+
+    ok = starts['converged'] & ~failed
+    report = dict(starts)
+    report.update({
+        'best': best,
+        'n_starts': len(params),
+        'n_confirmed': n_confirmed,
+        'stopped_early': len(params) < n_starts,
+        'n_failed': int(np.sum(failed)),
+        'logL_range': float(np.ptp(starts['logL'][ok])) if ok.any() else np.nan,
+        'meta_da_range': float(np.ptp(starts['meta_da'][ok])) if ok.any() else np.nan,
+        'meta_da_sd': float(np.std(starts['meta_da'][ok])) if ok.any() else np.nan,
+    })
+    if n_confirmed < confirm:
+        warnings.warn(
+            f"only {n_confirmed} of {len(params)} starts reached the best logL; the fit may be a local optimum",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+    fit['multistart'] = report
+    return fit
@@ -0,0 +1,261 @@
+import argparse
+import itertools
+import json
+import os
+import warnings
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from utils.parallel import parallel_map
+from utils.simulate import simulate_trials
+from utils.meta_d.trials_to_counts import trials_to_cells
+
+# Parameter-recovery study: simulate sessions from known (d', meta-d'), fit
+# them, and see how far off the estimates are.
+#
+# The grid (true parameters x trial counts x pad_cells settings) is split into
+# chunks of replicates. Each chunk is simulated and fitted by one worker, which
+# writes its rows to <out_dir>/chunks/ before returning, so an interrupted run
+# picks up where it left off: finished chunks are skipped, and every chunk's
+# random seed depends only on its place in the grid.
+
+GRID_FILE = "grid.json"
+RESULTS_FILE = "results.csv"
+SUMMARY_FILE = "summary.csv"
+
+# estimates that get compared with the true values in the summary
+RECOVERED = ("meta_da", "da", "M_ratio")
+# kept from each fit's diagnostics, to spot slow or boundary-stuck fits
+DIAGNOSTICS = ("converged", "nfev", "wall_time", "meta_d_at_bound")
+
+FITTERS = ("mle", "batch")
+
+
+def recovery_grid(d_prime=(1.,), meta_d=(0.5, 1.), n_trials=(100, 200, 500), pad_cells=(0, 1)):
+    """
+    Every combination of the true parameters and settings, one row per condition.
+
+    :return: DataFrame with condition, d_prime, meta_d, n_trials, pad_cells
+    """
+    grid = pd.DataFrame(
+        list(itertools.product(d_prime, meta_d, n_trials, pad_cells)),
+        columns=["d_prime", "meta_d", "n_trials", "pad_cells"],
+    )
+    grid.insert(0, "condition", np.arange(len(grid)))
+    return grid
+
+
+def _counts_per_session(trials, n_sessions, n_ratings, pad_cells):
+    # trials_to_counts for every simulated session at once
+    valid, cell = trials_to_cells(trials["stimID"], trials["response"], trials["rating"], n_ratings)
+    session = trials["subject"].to_numpy()
+    counts = np.bincount(
+        session[valid] * 4 * n_ratings + cell[valid], minlength=n_sessions * 4 * n_ratings
+    ).reshape(n_sessions, 4 * n_ratings).astype(float)
+    if pad_cells:
+        counts += 1 / (2 * n_ratings)  # same padding as trials_to_counts
+    return counts[:, :2 * n_ratings], counts[:, 2 * n_ratings:]
+
+
+def _fit_mle(nr_s1, nr_s2):
+    from utils.meta_d.fit_meta_d_MLE import fit_meta_d_MLE, ZeroCountWarning
+
+    rows = []
+    for s1, s2 in zip(nr_s1, nr_s2):
+        try:
+            # zero cells are expected here (pad_cells=0), no need to warn each time
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", ZeroCountWarning)
+                fit = fit_meta_d_MLE(s1, s2, analytic_grad=True)
+            row = {stat: fit[stat] for stat in (*RECOVERED, "logL")}
+            row.update({key: fit["diagnostics"][key] for key in DIAGNOSTICS})
+        except Exception:
+            # e.g. the optimizer giving up on an extreme table
+            row = {stat: np.nan for stat in (*RECOVERED, "logL", *DIAGNOSTICS)}
+            row["converged"] = False
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _fit_batch(nr_s1, nr_s2):
+    from utils.meta_d.fit_meta_d_batch import fit_meta_d_MLE_batch
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fit = fit_meta_d_MLE_batch(nr_s1, nr_s2)
+    columns = {stat: fit[stat] for stat in (*RECOVERED, "logL")}
+    columns.update({key: fit["diagnostics"][key] for key in DIAGNOSTICS})
+    return pd.DataFrame(columns)
+
+
+def _chunk_path(out_dir, condition, start):
+    return os.path.join(out_dir, "chunks", f"c{condition:06d}_r{start:07d}.csv")
+
+
+def _run_recovery_chunk(task, out_dir, n_ratings, c1, fitter, seed):
+    # runs in a worker: simulate one chunk of replicates, fit them, save the rows
+    condition, start, size = task["condition"], task["start"], task["size"]
+    rng = np.random.default_rng([seed, condition, start])
+
+    trials = simulate_trials(
+        task["n_trials"], n_subjects=size, d_prime=task["d_prime"], meta_d=task["meta_d"], c1=c1,
+        n_ratings=n_ratings, seed=rng,
+    )
+    nr_s1, nr_s2 = _counts_per_session(trials, size, n_ratings, task["pad_cells"])
+    fits = _fit_mle(nr_s1, nr_s2) if fitter == "mle" else _fit_batch(nr_s1, nr_s2)
+
+    rows = pd.DataFrame({
+        "condition": condition,
+        "d_prime": task["d_prime"],
+        "meta_d": task["meta_d"],
+        "n_trials": task["n_trials"],
+        "pad_cells": task["pad_cells"],
+        "rep": np.arange(start, start + size),
+    })
+    rows = pd.concat([rows, fits], axis=1)
+
+    # written to a temp file first, so a half-written chunk is never mistaken for a finished one
+    path = _chunk_path(out_dir, condition, start)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    rows.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return len(rows)
+
+
+def run_recovery(out_dir, grid=None, n_reps=100, n_ratings=4, c1=0., fitter="mle", chunk_size=25,
+                 n_workers=None, seed=0):
+    """
+    Run (or resume) a parameter-recovery study.
+
+    :param out_dir: folder for the results; re-running with the same folder
+                    and settings only does the chunks that aren't finished
+    :param grid: DataFrame from recovery_grid (default: recovery_grid())
+    :param n_reps: simulated sessions per condition
+    :param n_ratings: confidence levels
+    :param c1: true type 1 criterion for every session
+    :param fitter: "mle" = fit_meta_d_MLE, one table at a time (what
+                   compute_meta_d_prime uses); "batch" = fit_meta_d_MLE_batch
+                   on a whole chunk at once (same estimator, much faster)
+    :param chunk_size: replicates per chunk (= per saved file)
+    :param n_workers: processes (default: all CPUs; 1 = no process pool)
+    :param seed: base random seed
+    :return: (results, summary) DataFrames, also saved as results.csv/summary.csv
+    """
+
+    if fitter not in FITTERS:
+        raise ValueError(f"fitter must be one of {FITTERS}")
+    if grid is None:
+        grid = recovery_grid()
+
+    # refuse to mix results from different studies in one folder
+    spec = {
+        "grid": grid.to_dict(orient="list"), "n_reps": n_reps, "n_ratings": n_ratings, "c1": c1,
+        "fitter": fitter, "chunk_size": chunk_size, "seed": seed,
+    }
+    spec = json.loads(json.dumps(spec, default=float))
+    os.makedirs(os.path.join(out_dir, "chunks"), exist_ok=True)
+    spec_path = os.path.join(out_dir, GRID_FILE)
+    if os.path.exists(spec_path):
+        with open(spec_path) as f:
+            if json.load(f) != spec:
+                raise ValueError(f"{out_dir} holds a study with different settings; use another folder")
+    else:
+        with open(spec_path, "w") as f:
+            json.dump(spec, f, indent=1)
+
+    tasks = [
+        {**condition, "start": start, "size": min(chunk_size, n_reps - start)}
+        for condition in grid.to_dict(orient="records")
+        for start in range(0, n_reps, chunk_size)
+    ]
+    pending = [task for task in tasks if not os.path.exists(_chunk_path(out_dir, task["condition"], task["start"]))]
+    print(f"{len(tasks) - len(pending)} of {len(tasks)} chunks already done")
+
+    run = partial(_run_recovery_chunk, out_dir=out_dir, n_ratings=n_ratings, c1=c1, fitter=fitter, seed=seed)
+    # one chunk at a time per worker, so an interruption loses at most one chunk each
+    failed = [result for result in parallel_map(run, pending, n_workers=n_workers, chunk_size=1) if not result]
+    for error in failed:
+        warnings.warn(f"recovery chunk {pending[error.index]} failed: {error.error!r}", RuntimeWarning)
+
+    results = collect_recovery(out_dir)
+    summary = summarize_recovery(results)
+    results.to_csv(os.path.join(out_dir, RESULTS_FILE), index=False)
+    summary.to_csv(os.path.join(out_dir, SUMMARY_FILE), index=False)
+    return results, summary
+
+
+def collect_recovery(out_dir):
+    """
+    :return: every finished chunk's rows as one tidy DataFrame (one row per fit)
+    """
+    chunk_dir = os.path.join(out_dir, "chunks")
+    files = sorted(name for name in os.listdir(chunk_dir) if name.endswith(".csv"))
+    if not files:
+        return pd.DataFrame()
+    results = pd.concat([pd.read_csv(os.path.join(chunk_dir, name)) for name in files], ignore_index=True)
+    return results.sort_values(["condition", "rep"], ignore_index=True)
+
+
+def summarize_recovery(results):
+    """
+    Bias, spread and RMSE of each estimate, per condition. Fits that failed or
+    didn't converge are left out of the statistics (and counted in n_failed).
+
+    :param results: DataFrame from run_recovery/collect_recovery
+    :return: DataFrame, one row per condition and parameter
+    """
+
+    keys = ["condition", "d_prime", "meta_d", "n_trials", "pad_cells"]
+    rows = []
+    for values, group in results.groupby(keys, sort=True):
+        condition = dict(zip(keys, values))
+        # with s = 1, da and meta_da are just d' and meta-d'
+        truth = {"meta_da": condition["meta_d"], "da": condition["d_prime"],
+                 "M_ratio": condition["meta_d"] / condition["d_prime"]}
+        ok = group[group["converged"].astype(bool)]
+        for estimate in RECOVERED:
+            true = truth[estimate]
+            error = ok[estimate] - true
+            rows.append({
+                **condition,
+                "parameter": estimate,
+                "true": true,
+                "mean": ok[estimate].mean(),
+                "bias": error.mean(),
+                "sd": ok[estimate].std(),
+                "rmse": np.sqrt(np.mean(error ** 2)),
+                "median": ok[estimate].median(),
+                "n": len(ok),
+                "n_failed": len(group) - len(ok),
+            })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+
+    # e.g. python -m utils.meta_d.recovery recovery_out --n-trials 100 200 500 --n-reps 1000
+    parser = argparse.ArgumentParser(description="Parameter recovery study for fit_meta_d_MLE")
+    parser.add_argument("out_dir")
+    parser.add_argument("--d-prime", type=float, nargs="+", default=[1.])
+    parser.add_argument("--meta-d", type=float, nargs="+", default=[0.5, 1.])
+    parser.add_argument("--n-trials", type=int, nargs="+", default=[100, 200, 500])
+    parser.add_argument("--pad-cells", type=int, nargs="+", default=[0, 1])
+    parser.add_argument("--n-reps", type=int, default=100)
+    parser.add_argument("--n-ratings", type=int, default=4)
+    parser.add_argument("--fitter", choices=FITTERS, default="mle")
+    parser.add_argument("--chunk-size", type=int, default=25)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    _, summary = run_recovery(
+        args.out_dir,
+        recovery_grid(args.d_prime, args.meta_d, args.n_trials, args.pad_cells),
+        n_reps=args.n_reps,
+        n_ratings=args.n_ratings,
+        fitter=args.fitter,
+        chunk_size=args.chunk_size,
+        n_workers=args.workers,
+        seed=args.seed,
+    )
+    print(summary.to_string(index=False))
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+from utils.meta_d.trials_to_counts import infer_n_ratings, trials_to_cells
+from utils.meta_d.fit_meta_d_batch import fit_meta_d_MLE_batch
+
+
+def rolling_counts(cell, valid, n_ratings, window, step=1):
+    """
+    Response counts for every window of trials, updated incrementally: each step
+    only adds the trials entering the window and drops the ones leaving it.
+
+    :param cell: count cell of every trial (from trials_to_cells)
+    :param valid: which trials count (from trials_to_cells)
+    :param n_ratings: number of confidence ratings
+    :param window: trials per window
+    :param step: trials to move the window by each time
+    :return: starts (n_windows,), and counts (n_windows, 4 * n_ratings) --
+             [:, :2 * n_ratings] is nr_s1, [:, 2 * n_ratings:] is nr_s2
+    """
+    n_cells = 4 * n_ratings
+    # invalid trials go to a spare cell that gets dropped at the end
+    cell = np.where(valid, cell, n_cells)
+
+    starts = np.arange(0, len(cell) - window + 1, step)
+    counts = np.zeros((len(starts), n_cells + 1), dtype=np.int64)
+    if len(starts) == 0:
+        return starts, counts[:, :n_cells]
+
+    running = np.bincount(cell[:window], minlength=n_cells + 1)
+    counts[0] = running
+    for i in range(1, len(starts)):
+        start, prev = starts[i], starts[i - 1]
+        # trials [prev, start) leave, trials [prev + window, start + window) enter
+        # (these overlap when step > window; the ones in between cancel out)
+        np.subtract.at(running, cell[prev:start], 1)
+        np.add.at(running, cell[prev + window:start + window], 1)
+        counts[i] = running
+
+    return starts, counts[:, :n_cells]
+
+
+def rolling_meta_d_prime(data, window=100, step=1, n_ratings=4, pad_cells=1):
+    """
+    Meta-d', d', M_ratio and M_diff over a sliding window of trials.
+
+    Window counts are updated incrementally (see rolling_counts) and all windows
+    are fitted together by fit_meta_d_MLE_batch, warm-started from the fit to
+    the whole session.
+
+    :param data: pandas DataFrame with 'stimID', 'response', and 'rating', in trial order
+    :param window: trials per window (invalid trials still take up a slot)
+    :param step: trials to move the window by each time
+    :param n_ratings: number of confidence ratings (default 4); 'infer' takes
+                      the highest rating in the data (see infer_n_ratings)
+    :param pad_cells: whether to pad counts to avoid log(0) issues
+    :return: DataFrame with one row per window ('start', 'stop', 'n_trials',
+             'meta_da', 'da', 'M_ratio', 'M_diff', 'logL', 'converged')
+    """
+
+    if n_ratings == 'infer':
+        n_ratings = infer_n_ratings(data['rating'])
+    valid, cell = trials_to_cells(data['stimID'], data['response'], data['rating'], n_ratings)
+    starts, counts = rolling_counts(cell, valid, n_ratings, window, step)
+    pad_amount = 1 / (2 * n_ratings) if pad_cells else 0.
+
+    # the whole session is a good warm start for every window
+    full = np.bincount(cell[valid], minlength=4 * n_ratings) + pad_amount
+    init = fit_meta_d_MLE_batch(full[:2 * n_ratings], full[2 * n_ratings:])['params'][0]
+
+    n_trials = counts.sum(axis=1)
+    counts = counts + pad_amount
+    fit = fit_meta_d_MLE_batch(counts[:, :2 * n_ratings], counts[:, 2 * n_ratings:], init=init)
+
+    return pd.DataFrame(
+        {
+            "start": starts,
+            "stop": starts + window,
+            "n_trials": n_trials,
+            "meta_da": fit["meta_da"],
+            "da": fit["da"],
+            "M_ratio": fit["M_ratio"],
+            "M_diff": fit["M_diff"],
+            "logL": fit["logL"],
+            "converged": fit["converged"],
+        }
+    )
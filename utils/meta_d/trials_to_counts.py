@@ -78,68 +78,121 @@ function [nR_S1, nR_S2] = trials2counts(stimID, response, rating, nRatings, padC
 ###### conf.:  4   3   2   1   1   2   3   4
 
 
-def trials_to_counts(stim_id, response, rating, n_ratings, pad_cells=0, pad_amount=None):
-    """
+import numpy as np
 
-    :param stim_id:
-    :param response:
-    :param rating:
-    :param n_ratings:
-    :param pad_cells:
-    :param pad_amount:
-    :return:
+
+def trials_to_cells(stim_id, response, rating, n_ratings):
+    """
+    Maps every trial to its response count cell (see the index diagram above).
+
+    :param stim_id: 0 = S1, 1 = S2 (list, numpy array or pandas Series)
+    :param response: 0 = "S1", 1 = "S2"
+    :param rating: 1 to n_ratings
+    :param n_ratings: number of confidence ratings
+    :return: valid (bool mask of the trials that get counted), and cell (index
+             into [*nr_s1, *nr_s2] for every trial; only meaningful where valid)
     """
+    stim_id = np.asarray(stim_id)
+    response = np.asarray(response)
+    rating = np.asarray(rating)
+
     # check for valid inputs
-    if not (len(stim_id) == len(response)) and (len(stim_id) == len(rating)):
-        raise ('stim_id, response, and rating input vectors must have the same lengths')
-
-    ''' filter bad trials '''
-    temp_stim = []
-    temp_resp = []
-    temp_ratg = []
-    for s, rp, rt in zip(stim_id, response, rating):
-        if (s == 0 or s == 1) and (rp == 0 or rp == 1) and (rt >= 1 and rt <= n_ratings):
-            temp_stim.append(s)
-            temp_resp.append(rp)
-            temp_ratg.append(rt)
-    stim_id = temp_stim
-    response = temp_resp
-    rating = temp_ratg
+    if not (len(stim_id) == len(response) == len(rating)):
+        raise ValueError('stim_id, response, and rating input vectors must have the same lengths')
+
+    ''' filter bad trials ''' # (non-integer ratings never matched a bin either)
+    valid = (
+        ((stim_id == 0) | (stim_id == 1))
+        & ((response == 0) | (response == 1))
+        & (rating >= 1) & (rating <= n_ratings) & (rating % 1 == 0)
+    )
+
+    # "S1" responses count down from rating n_ratings, "S2" responses up from 1
+    # (done in float so compact int8 inputs can't overflow)
+    rating_bin = np.where(response == 0, n_ratings - rating.astype(float), n_ratings - 1 + rating.astype(float))
+    cell = np.where(valid, 2.0 * n_ratings * stim_id + rating_bin, 0).astype(np.intp)
+
+    return valid, cell
+
+
+def infer_n_ratings(rating):
+    """
+    The number of confidence ratings, taken as the highest valid rating in the
+    data (pass n_ratings explicitly if the top of the scale may go unused).
+
+    :param rating: ratings (list, numpy array or pandas Series); anything that
+                   isn't a positive integer (e.g. missed trials) is ignored
+    :return: int
+    """
+    rating = np.asarray(rating, dtype=float)
+    rated = rating[(rating >= 1) & (rating % 1 == 0)]
+    if rated.size == 0:
+        raise ValueError('no valid ratings (1, 2, ...) to infer n_ratings from')
+    return int(rated.max())
+
+
+def confidence_to_ratings(confidence, n_ratings, edges=None):
+    """
+    Bins continuous confidence (e.g. a slider) into ratings 1 .. n_ratings at
+    its quantiles, so every rating gets about the same number of trials.
+
+    Heavily tied values (e.g. lots of trials at the end of the slider) can make
+    neighbouring edges equal, leaving some ratings empty -- pad the counts, or
+    use fewer ratings.
+
+    :param confidence: confidence per trial; NaN (no response) gets rating 0,
+                       which trials_to_counts leaves out
+    :param n_ratings: number of ratings to bin into
+    :param edges: n_ratings - 1 increasing cut points from an earlier call, to
+                  bin more data (another session, say) the same way
+    :return: ratings (int16 array, ready for trials_to_counts), and edges
+    """
+    confidence = np.asarray(confidence, dtype=float)
+    answered = np.isfinite(confidence)
+
+    if edges is None:
+        if not answered.any():
+            raise ValueError('no finite confidence values to bin')
+        edges = np.quantile(confidence[answered], np.arange(1, n_ratings) / n_ratings)
+    else:
+        edges = np.asarray(edges, dtype=float)
+        if edges.shape != (n_ratings - 1,) or np.any(np.diff(edges) < 0):
+            raise ValueError(f'edges must be {n_ratings - 1} increasing cut points')
+
+    # values on an edge go to the rating above it
+    ratings = np.zeros(len(confidence), dtype=np.int16)
+    ratings[answered] = 1 + np.searchsorted(edges, confidence[answered], side='right')
+    return ratings, edges
+
+
+def trials_to_counts(stim_id, response, rating, n_ratings, pad_cells=0, pad_amount=None):
+    """
+    Converts trial-by-trial data into response counts, with one bincount pass.
+
+    :param stim_id: 0 = S1, 1 = S2 (list, numpy array or pandas Series)
+    :param response: 0 = "S1", 1 = "S2"
+    :param rating: 1 (least confident) to n_ratings (most)
+    :param n_ratings: number of confidence ratings
+    :param pad_cells: if truthy, pad_amount is added to every count
+    :param pad_amount: defaults to 1 / (2 * n_ratings)
+    :return: nr_s1, nr_s2 as numpy arrays of length 2 * n_ratings
+    """
+
+    valid, cell = trials_to_cells(stim_id, response, rating, n_ratings)
+
+    ''' compute response counts '''
+    counts = np.bincount(cell[valid], minlength=4 * n_ratings)
+    nr_s1 = counts[:2 * n_ratings]
+    nr_s2 = counts[2 * n_ratings:]
 
     ''' set input defaults ''' # Padding for log(0) errors.
     if pad_amount is None:
         pad_amount = 1 / (2 * n_ratings)
 
-    ''' compute response counts '''
-    nr_s1 = []
-    nr_s2 = []
-
-    # s1 responses
-    for r in range(n_ratings, 0, -1):
-        cs1, cs2 = 0, 0
-        for s, rp, rt in zip(stim_id, response, rating):
-            if s == 0 and rp == 0 and rt == r:
-                cs1 += 1
-            if s == 1 and rp == 0 and rt == r:
-                cs2 += 1
-        nr_s1.append(cs1)
-        nr_s2.append(cs2)
-
-    # s2 responses
-    for r in range(1, n_ratings + 1, 1):
-        cs1, cs2 = 0, 0
-        for s, rp, rt in zip(stim_id, response, rating):
-            if s == 0 and rp == 1 and rt == r:
-                cs1 += 1
-            if s == 1 and rp == 1 and rt == r:
-                cs2 += 1
-        nr_s1.append(cs1)
-        nr_s2.append(cs2)
-
     # pad response counts to avoid zeros
     if pad_cells:
-        nr_s1 = [n + pad_amount for n in nr_s1]
-        nr_s2 = [n + pad_amount for n in nr_s2]
+        nr_s1 = nr_s1 + pad_amount
+        nr_s2 = nr_s2 + pad_amount
 
     return nr_s1, nr_s2
 
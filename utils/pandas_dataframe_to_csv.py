@@ -1,5 +1,5 @@
 import pandas as pd
-from main import load_data
+from utils.load_data import load_data
 
 loaded_data = load_data("../grating2AFC S11.mat")
 
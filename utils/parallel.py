@@ -0,0 +1,81 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+
+class TaskError:
+    """
+    Stand-in result for a task that raised, so one bad dataset doesn't sink a
+    whole batch. Falsy, so failed tasks are easy to filter out.
+    """
+
+    def __init__(self, index, error, trace=""):
+        self.index = index
+        self.error = error
+        self.traceback = trace
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return f"TaskError(index={self.index}, error={self.error!r})"
+
+
+def _run_chunk(func, start, chunk):
+    # runs inside a worker: call func on every task, catching errors per task
+    results = []
+    for offset, task in enumerate(chunk):
+        try:
+            results.append(func(task))
+        except Exception as e:
+            results.append(TaskError(start + offset, e, traceback.format_exc()))
+    return results
+
+
+def parallel_map(func, tasks, n_workers=None, chunk_size=None):
+    """
+    Apply func to every task in a pool of worker processes.
+
+    Results come back in the same order as tasks, whatever order the workers
+    finish in. A task that raises gives a TaskError in its slot instead of
+    stopping the run.
+
+    :param func: picklable (module-level) function of one argument
+    :param tasks: iterable of arguments for func
+    :param n_workers: number of processes (default: all CPUs); 1 runs in-process
+    :param chunk_size: tasks sent to a worker at a time
+                       (default: about 4 chunks per worker)
+    :return: list of results (or TaskErrors), one per task
+    """
+
+    tasks = list(tasks)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, len(tasks)))
+
+    # no point paying for a pool with one worker (also easier to debug)
+    if n_workers == 1:
+        return _run_chunk(func, 0, tasks)
+
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(tasks) // (4 * n_workers)))  # ceil division
+
+    starts = range(0, len(tasks), chunk_size)
+    results = [None] * len(tasks)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = {
+            start: pool.submit(_run_chunk, func, start, tasks[start:start + chunk_size])
+            for start in starts
+        }
+        for start, future in futures.items():
+            chunk = tasks[start:start + chunk_size]
+            try:
+                results[start:start + len(chunk)] = future.result()
+            except Exception as e:
+                # the worker itself died (BrokenProcessPool), or results couldn't be pickled
+                results[start:start + len(chunk)] = [
+                    TaskError(start + offset, e) for offset in range(len(chunk))
+                ]
+
+    return results
@@ -0,0 +1,68 @@
+import matplotlib
+
+# Helpers for drawing figures without a screen (servers, batch jobs, worker
+# processes), where plt.show() would block or fail.
+#
+# Figures that get drawn over and over (one per subject in a cohort report) are
+# kept per process, keyed by layout, and their axes cleared between uses rather
+# than building a new Figure every time.
+_FIGURES = {}
+
+
+def use_headless():
+    """
+    Switch matplotlib to the non-interactive Agg backend, so figures can only
+    be written to files. Call before drawing anything.
+    """
+    matplotlib.use("Agg")
+
+
+def reusable_axes(name, nrows=1, figsize=(5, 4), sharex=False):
+    """
+    A figure (and its axes) that is created once per process and cleared on
+    every later call with the same layout.
+
+    :param name: what the figure is for (figures with different names are never shared)
+    :param nrows: number of stacked axes
+    :param figsize: (width, height) in inches
+    :param sharex: share the x-axis between the stacked axes
+    :return: fig, ax (or an array of nrows axes)
+    """
+    import matplotlib.pyplot as plt
+
+    key = (name, nrows, tuple(figsize), sharex)
+    if key not in _FIGURES:
+        _FIGURES[key] = plt.subplots(nrows, 1, figsize=figsize, sharex=sharex)
+        return _FIGURES[key]
+
+    fig, axes = _FIGURES[key]
+    for ax in fig.axes:
+        ax.clear()
+    return fig, axes
+
+
+def axes_or_new(ax=None, nrows=1, figsize=(5, 4), sharex=False):
+    """
+    :param ax: axes to draw into (or an array of nrows axes); None = new figure
+    :return: fig, ax
+    """
+    if ax is not None:
+        first = ax if nrows == 1 else ax[0]
+        return first.figure, ax
+
+    import matplotlib.pyplot as plt
+    return plt.subplots(nrows, 1, figsize=figsize, sharex=sharex)
+
+
+def show_or_save(fig, save_to=None, show=True):
+    """
+    Write the figure to save_to (format from the file extension), or else pop it
+    up with plt.show().
+
+    :param show: False = neither save nor show (the caller owns the figure)
+    """
+    if save_to is not None:
+        fig.savefig(save_to)
+    elif show:
+        import matplotlib.pyplot as plt
+        plt.show()
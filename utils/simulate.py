@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+from utils.trial_data import compact_trials
+
+# Synthetic trials from the meta-d' model (Maniscalco & Lau, 2012), equal variance:
+#
+# type 1 -- evidence ~ N(+-d'/2, 1) for S2/S1; respond S2 (1) if it's above c1
+# type 2 -- confidence comes from a second look at the evidence, distributed
+#           N(+-meta-d'/2, 1) and cut off at meta_c1 = meta-d' * c1 / d' (the
+#           same "relative" criterion fit_meta_d_MLE uses), then binned by the
+#           type 2 criteria on the side of the response given
+#
+# so fitting meta-d' to the simulated counts gives back (roughly) the meta-d'
+# that went in. Everything is drawn for all trials of all subjects at once.
+
+# codes the recorded data uses for a trial with no response
+MISSED_RESPONSE = -1
+MISSED_RATING = -5
+
+
+def default_type2_criteria(n_ratings):
+    """
+    Evenly spaced type 2 criteria, 0.5 apart, as distances from meta_c1
+    (e.g. [0.5, 1.0, 1.5] for 4 ratings).
+    """
+    return 0.5 * np.arange(1, n_ratings)
+
+
+def _per_subject(value, n_subjects, name):
+    value = np.asarray(value, dtype=float)
+    if value.ndim == 0:
+        return np.full(n_subjects, float(value))
+    if value.shape != (n_subjects,):
+        raise ValueError(f"{name} must be a scalar or have one value per subject ({n_subjects})")
+    return value
+
+
+def _per_subject_criteria(value, n_subjects, n_ratings, name):
+    value = np.asarray(value, dtype=float)
+    value = np.broadcast_to(value, (n_subjects, n_ratings - 1)) if value.ndim == 1 else value
+    if value.shape != (n_subjects, n_ratings - 1):
+        raise ValueError(f"{name} must have shape ({n_ratings - 1},) or ({n_subjects}, {n_ratings - 1})")
+    if np.any(value <= 0) or np.any(np.diff(value, axis=1) <= 0):
+        raise ValueError(f"{name} must be positive and increasing (distances from meta_c1)")
+    return value
+
+
+def simulate_trials(n_trials, n_subjects=1, d_prime=1.5, meta_d=None, c1=0., t2c_rS2=None, t2c_rS1=None,
+                    n_ratings=4, p_signal=0.5, p_miss=0., d_prime_drift=0., meta_d_drift=0., c1_drift=0.,
+                    rt_median=0.75, rt_sigma=0.35, rt_confidence_effect=0.05, seed=None, compact=False):
+    """
+    Simulate trials from the meta-d' model for one or many subjects.
+
+    Model parameters are a scalar (same for everyone) or one value per subject.
+    Drifts are the total change over a session, applied linearly from the first
+    trial to the last (e.g. d_prime_drift=-0.5 for a subject getting tired).
+
+    :param n_trials: trials per subject
+    :param n_subjects: number of subjects
+    :param d_prime: type 1 sensitivity
+    :param meta_d: type 2 sensitivity (default: same as d_prime, i.e. M-ratio 1)
+    :param c1: type 1 criterion (0 = unbiased)
+    :param t2c_rS2: type 2 criteria for "S2" responses, as n_ratings - 1
+                    increasing distances above meta_c1 (or one row per subject);
+                    default: default_type2_criteria
+    :param t2c_rS1: same for "S1" responses (distances below meta_c1);
+                    default: same as t2c_rS2
+    :param n_ratings: number of confidence levels
+    :param p_signal: probability that a trial is S2 (stimID 1)
+    :param p_miss: probability of no response (coded like the recorded data:
+                   response -1, rating -5, RT 0)
+    :param rt_median: median RT in seconds, at the lowest confidence
+    :param rt_sigma: sd of log RT
+    :param rt_confidence_effect: how much log RT drops per confidence level
+                                 (more confident responses are faster)
+    :param seed: seed or numpy Generator, for reproducible data
+    :param compact: return the compact dtypes (see utils/trial_data.py)
+    :return: DataFrame with load_data's columns (stimID, response, rating,
+             responseRT), plus "subject" and "trial" (0-based, within subject)
+    """
+
+    rng = np.random.default_rng(seed)
+    n_total = n_trials * n_subjects
+
+    d_prime = _per_subject(d_prime, n_subjects, "d_prime")
+    meta_d = d_prime if meta_d is None else _per_subject(meta_d, n_subjects, "meta_d")
+    c1 = _per_subject(c1, n_subjects, "c1")
+    t2c_rS2 = _per_subject_criteria(
+        default_type2_criteria(n_ratings) if t2c_rS2 is None else t2c_rS2, n_subjects, n_ratings, "t2c_rS2"
+    )
+    t2c_rS1 = t2c_rS2 if t2c_rS1 is None else _per_subject_criteria(t2c_rS1, n_subjects, n_ratings, "t2c_rS1")
+
+    subject = np.repeat(np.arange(n_subjects, dtype=np.int32), n_trials)
+    trial = np.tile(np.arange(n_trials, dtype=np.int32), n_subjects)
+
+    # per-trial parameters (only differ within a subject if there's drift)
+    progress = trial / max(n_trials - 1, 1)
+    d_t = d_prime[subject] + _per_subject(d_prime_drift, n_subjects, "d_prime_drift")[subject] * progress
+    meta_d_t = meta_d[subject] + _per_subject(meta_d_drift, n_subjects, "meta_d_drift")[subject] * progress
+    c1_t = c1[subject] + _per_subject(c1_drift, n_subjects, "c1_drift")[subject] * progress
+
+    # type 1
+    stim_id = (rng.random(n_total) < p_signal).astype(np.uint8)
+    sign = stim_id - 0.5  # -0.5 for S1, +0.5 for S2
+    evidence = rng.standard_normal(n_total) + sign * d_t
+    response = (evidence > c1_t).astype(np.int16)
+
+    # type 2: draw the second look at the evidence from its normal distribution
+    # truncated to the side of the response that was given (inverse CDF, so one
+    # uniform draw per trial)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        meta_c1 = np.where(d_t != 0, meta_d_t * c1_t / d_t, c1_t)
+    mu2 = sign * meta_d_t
+    below = ndtr(meta_c1 - mu2)  # P(second look < meta_c1)
+    u = rng.random(n_total)
+    quantile = np.where(response == 1, below + u * (1 - below), u * below)
+    evidence2 = mu2 + ndtri(quantile)
+
+    # confidence = 1 + number of type 2 criteria passed, moving away from meta_c1
+    distance = np.abs(evidence2 - meta_c1)
+    criteria = np.where(response[:, None] == 1, t2c_rS2[subject], t2c_rS1[subject])
+    rating = (1 + np.sum(distance[:, None] >= criteria, axis=1)).astype(np.int16)
+
+    # RTs: lognormal, faster with confidence
+    log_rt = np.log(rt_median) - rt_confidence_effect * (rating - 1) + rt_sigma * rng.standard_normal(n_total)
+    response_rt = np.exp(log_rt)
+
+    if p_miss:
+        missed = rng.random(n_total) < p_miss
+        response[missed] = MISSED_RESPONSE
+        rating[missed] = MISSED_RATING
+        response_rt[missed] = 0.
+
+    trials = pd.DataFrame(
+        {
+            "stimID": stim_id,
+            "response": response,
+            "rating": rating,
+            "responseRT": response_rt,
+            "subject": subject,
+            "trial": trial,
+        }
+    )
+    if compact:
+        trials = compact_trials(trials)
+    return trials
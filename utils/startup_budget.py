@@ -0,0 +1,75 @@
+import subprocess
+import sys
+
+# Startup-time budget: how long a fresh interpreter may take to import each
+# entry point, and which heavy modules it must not drag in just by importing.
+# Run from the repo root (non-zero exit = over budget):
+#
+#     python -m utils.startup_budget
+#
+# Budgets are ~2x what they measured at (best of 5): numpy + pandas alone are
+# ~0.45 s of main's ~0.55 s, so a plotting/scipy.stats import sneaking back in
+# to module level (+1-2 s) blows the budget.
+BUDGETS = {
+    "main": 1.2,
+    "utils.load_data": 1.0,
+    "utils.meta_d.meta_d_prime_master": 1.0,
+    "utils.meta_d.trials_to_counts": 0.5,
+}
+
+# only imported on first use (plots, t-tests, the fitter, parsing a .mat)
+LAZY_MODULES = ("matplotlib", "seaborn", "scipy.stats", "scipy.optimize", "scipy.io")
+
+_PROBE = """
+import sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(elapsed)
+print(",".join(m for m in {lazy!r} if m in sys.modules))
+"""
+
+
+def measure_import(module, repeats=5):
+    """
+    Time importing module in fresh interpreters.
+
+    :param module: dotted module name
+    :param repeats: how many interpreters to start; the fastest one counts
+    :return: (best wall time in seconds, heavy modules that got imported)
+    """
+
+    best = float("inf")
+    loaded = set()
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, lazy=LAZY_MODULES)],
+            capture_output=True, text=True, check=True,
+        ).stdout.split("\n")
+        best = min(best, float(out[0]))
+        loaded.update(m for m in out[1].split(",") if m)
+    return best, sorted(loaded)
+
+
+def check_budgets(budgets=BUDGETS, repeats=5):
+    """
+    :return: list of failure messages (empty = everything within budget)
+    """
+
+    failures = []
+    for module, budget in budgets.items():
+        elapsed, loaded = measure_import(module, repeats)
+        status = "ok" if elapsed <= budget and not loaded else "FAIL"
+        print(f"{module:40s} {elapsed:6.3f} s  (budget {budget:.2f} s)  {status}")
+        if elapsed > budget:
+            failures.append(f"importing {module} took {elapsed:.3f} s (budget {budget:.2f} s)")
+        if loaded:
+            failures.append(f"importing {module} eagerly imported {', '.join(loaded)}")
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_budgets()
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
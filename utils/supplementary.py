@@ -1,15 +1,19 @@
-import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter1d
 # custom import!
-from main import load_data
+from utils.load_data import load_data
+from utils.meta_d.rolling_meta_d import rolling_meta_d_prime
+from utils.render import axes_or_new, show_or_save
 
 
-def rolling_averages(data, first_half_trials, window=20, sigma=5):
+def rolling_averages(data, first_half_trials, window=20, sigma=5, axes=None, save_to=None):
     """
     Plot rolling averages (with Gaussian smoothing) for:
     - Hit Rate
     - False Alarm Rate
     - Confidence Ratings
+
+    :param axes: pair of (top, bottom) axes to draw into (default: a new figure, shown at the end)
+    :param save_to: save the figure to this file instead of showing it
     """
 
     # --- Rolling means ---
@@ -25,15 +29,14 @@ def rolling_averages(data, first_half_trials, window=20, sigma=5):
     conf_smooth = gaussian_filter1d(conf_roll.bfill(), sigma=sigma)
 
     # --- Plot ---
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
+    fig, (ax1, ax2) = axes_or_new(axes, nrows=2, figsize=(10, 8), sharex=True)
 
     # Top: Hit & FA
     ax1.plot(hit_smooth, label="Hit Rate", color="green")
     ax1.plot(fa_smooth, label="False Alarm Rate", color="red")
     ax1.axvline(first_half_trials, color='blue', linestyle='--', alpha=0.6)
 
-    # Force draw before measuring limits
-    plt.draw()
+    # (get_ylim applies any pending autoscaling itself, no need to draw first)
     ymin1, ymax1 = ax1.get_ylim()
     ax1.text(first_half_trials - 10, ymin1 + (ymax1 - ymin1) * 0.95,
              'Halfway', color='blue', fontsize=10, rotation=0, ha='right', va='top')
@@ -55,8 +58,35 @@ def rolling_averages(data, first_half_trials, window=20, sigma=5):
     ax2.legend(loc="upper right")
     ax2.set_title(f"Rolling Confidence (window={window}, σ={sigma})")
 
-    plt.tight_layout()
-    plt.show()
+    fig.tight_layout()
+    show_or_save(fig, save_to, show=axes is None)
+
+
+def rolling_meta_d(data, first_half_trials, window=100, step=1, ax=None, save_to=None):
+    """
+    Plot meta-d' and d' over a sliding window of trials.
+    Each window is fitted separately (see utils/meta_d/rolling_meta_d.py).
+
+    :param ax: axes to draw into (default: a new figure, shown at the end)
+    :param save_to: save the figure to this file instead of showing it
+    """
+
+    rolled = rolling_meta_d_prime(data, window=window, step=step)
+    # x = trial at the middle of each window
+    centers = (rolled["start"] + rolled["stop"]) / 2
+
+    fig, ax_roll = axes_or_new(ax, figsize=(10, 4))
+    ax_roll.plot(centers, rolled["da"], label="d′", color="0.6")
+    ax_roll.plot(centers, rolled["meta_da"], label="meta-d′", color="black")
+    ax_roll.axvline(first_half_trials, color='blue', linestyle='--', alpha=0.6)
+
+    ax_roll.set_ylabel("d′ / meta-d′")
+    ax_roll.set_xlabel("Trial (window center)")
+    ax_roll.legend(loc="upper right")
+    ax_roll.set_title(f"Rolling d′ / meta-d′ (window={window}, step={step})")
+
+    fig.tight_layout()
+    show_or_save(fig, save_to, show=ax is None)
 
 if __name__ == "__main__":
 
@@ -79,4 +109,6 @@ if __name__ == "__main__":
     # Apply all filters at once
     valid_data = loaded_data[valid_stim_mask & valid_resp_mask & valid_rating_mask]
 
-    rolling_averages(valid_data, first_half_trials)
\ No newline at end of file
+    rolling_averages(valid_data, first_half_trials)
+
+    rolling_meta_d(valid_data, first_half_trials)
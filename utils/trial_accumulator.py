@@ -0,0 +1,186 @@
+import copy
+import math
+
+import numpy as np
+from scipy.special import ndtri
+from utils.meta_d.trials_to_counts import trials_to_cells
+
+
+class TrialAccumulator:
+    """
+    Running statistics for a session that is still being recorded.
+
+    Trials go in one at a time (add) or in small batches (add_batch); counts,
+    hit/FA rates, d', type 2 response counts and RT mean/variance are kept up
+    to date in O(1) per trial, so nothing needs re-reading after each block.
+    Accumulators from different sessions/workers can be combined with merge.
+
+    Validity rules: type 1 stats (hits, FAs, d', RTs) use trials with stimID
+    and response in {0, 1}. calc_d_prime only drops negative responses, so the
+    two agree on 0/1-coded data, but other codes (e.g. a stimID of 2) are left
+    out here. Type 2 counts additionally need a rating in 1..n_ratings, like
+    trials_to_counts.
+    """
+
+    def __init__(self, n_ratings=4):
+        self.n_ratings = n_ratings
+        self.n_trials = 0
+        # type 1 counts, indexed [stimID][response]
+        self.type1 = [[0, 0], [0, 0]]
+        # type 2 counts, laid out like [*nr_s1, *nr_s2] from trials_to_counts
+        self.type2 = [0] * (4 * n_ratings)
+        # RT moments (Welford): count, mean, sum of squared deviations
+        self.rt_n = 0
+        self.rt_mean = 0.
+        self._rt_m2 = 0.
+
+    ### ---------- adding trials ---------- ###
+
+    def add(self, stim_id, response, rating, response_rt=None):
+        """
+        Add one trial.
+        """
+        self.n_trials += 1
+        if stim_id not in (0, 1) or response not in (0, 1):
+            return
+        stim_id, response = int(stim_id), int(response)
+        self.type1[stim_id][response] += 1
+
+        n = self.n_ratings
+        if 1 <= rating <= n and rating % 1 == 0:
+            # same cell layout as trials_to_cells
+            rating_bin = n - rating if response == 0 else n - 1 + rating
+            self.type2[stim_id * 2 * n + int(rating_bin)] += 1
+
+        if response_rt is not None and math.isfinite(response_rt):
+            self.rt_n += 1
+            delta = response_rt - self.rt_mean
+            self.rt_mean += delta / self.rt_n
+            self._rt_m2 += delta * (response_rt - self.rt_mean)
+
+    def add_batch(self, stim_id, response, rating, response_rt=None):
+        """
+        Add a block of trials (lists, arrays or pandas Series) in one vectorized step.
+        """
+        stim_id = np.asarray(stim_id)
+        response = np.asarray(response)
+        batch = TrialAccumulator(self.n_ratings)
+        batch.n_trials = len(stim_id)
+
+        type1_ok = np.isin(stim_id, (0, 1)) & np.isin(response, (0, 1))
+        type1 = np.bincount(2 * stim_id[type1_ok].astype(np.intp) + response[type1_ok].astype(np.intp), minlength=4)
+        batch.type1 = type1.reshape(2, 2).tolist()
+
+        valid, cell = trials_to_cells(stim_id, response, rating, self.n_ratings)
+        batch.type2 = np.bincount(cell[valid], minlength=4 * self.n_ratings).tolist()
+
+        if response_rt is not None:
+            rts = np.asarray(response_rt, dtype=float)[type1_ok]
+            rts = rts[np.isfinite(rts)]
+            if rts.size:
+                batch.rt_n = rts.size
+                batch.rt_mean = rts.mean()
+                batch._rt_m2 = np.sum((rts - batch.rt_mean) ** 2)
+
+        return self.merge(batch)
+
+    def merge(self, other):
+        """
+        Fold another accumulator (e.g. from a parallel session) into this one.
+
+        :return: self
+        """
+        if other.n_ratings != self.n_ratings:
+            raise ValueError('cannot merge accumulators with different n_ratings')
+
+        self.n_trials += other.n_trials
+        for s in (0, 1):
+            for r in (0, 1):
+                self.type1[s][r] += other.type1[s][r]
+        self.type2 = [a + b for a, b in zip(self.type2, other.type2)]
+
+        # combine RT moments (Chan et al.'s parallel variance update)
+        n = self.rt_n + other.rt_n
+        if n:
+            delta = other.rt_mean - self.rt_mean
+            self._rt_m2 += other._rt_m2 + delta ** 2 * self.rt_n * other.rt_n / n
+            self.rt_mean += delta * other.rt_n / n
+            self.rt_n = n
+        return self
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    ### ---------- statistics ---------- ###
+
+    @property
+    def hits(self):
+        return self.type1[1][1]
+
+    @property
+    def misses(self):
+        return self.type1[1][0]
+
+    @property
+    def false_alarms(self):
+        return self.type1[0][1]
+
+    @property
+    def correct_rejections(self):
+        return self.type1[0][0]
+
+    @property
+    def hit_rate(self):
+        n_signal = self.hits + self.misses
+        return self.hits / n_signal if n_signal else np.nan
+
+    @property
+    def fa_rate(self):
+        n_noise = self.false_alarms + self.correct_rejections
+        return self.false_alarms / n_noise if n_noise else np.nan
+
+    @property
+    def d_prime(self):
+        # same as calc_d_prime: +-inf if a rate is exactly 0 or 1
+        return ndtri(self.hit_rate) - ndtri(self.fa_rate)
+
+    @property
+    def rt_var(self):
+        # sample variance, like pandas .var()
+        return self._rt_m2 / (self.rt_n - 1) if self.rt_n > 1 else np.nan
+
+    @property
+    def rt_sd(self):
+        return math.sqrt(self.rt_var) if self.rt_n > 1 else np.nan
+
+    def counts(self, pad_cells=0, pad_amount=None):
+        """
+        Type 2 response counts, ready for fit_meta_d_MLE (same as trials_to_counts).
+
+        :return: nr_s1, nr_s2 numpy arrays
+        """
+        counts = np.array(self.type2, dtype=float if pad_cells else int)
+        if pad_cells:
+            counts += 1 / (2 * self.n_ratings) if pad_amount is None else pad_amount
+        return counts[:2 * self.n_ratings], counts[2 * self.n_ratings:]
+
+    def snapshot(self):
+        """
+        Current statistics as a plain dict (cheap, safe to log or send elsewhere).
+        """
+        nr_s1, nr_s2 = self.counts()
+        return {
+            'n_trials': self.n_trials,
+            'hits': self.hits,
+            'misses': self.misses,
+            'false_alarms': self.false_alarms,
+            'correct_rejections': self.correct_rejections,
+            'hit_rate': self.hit_rate,
+            'fa_rate': self.fa_rate,
+            'd_prime': self.d_prime,
+            'nR_S1': nr_s1,
+            'nR_S2': nr_s2,
+            'rt_n': self.rt_n,
+            'rt_mean': self.rt_mean if self.rt_n else np.nan,
+            'rt_sd': self.rt_sd,
+        }
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+
+# Parsed trial columns get saved next to their source file as an .npz bundle of
+# typed numpy arrays, e.g. "grating2AFC S11.mat" -> "grating2AFC S11.trials.npz".
+# Reading that back is much faster than parsing the .mat (or a CSV) again.
+CACHE_SUFFIX = ".trials.npz"
+# bump if the bundle layout changes, so old bundles get rebuilt
+CACHE_FORMAT = 1
+
+# bundle entries holding bookkeeping rather than trial columns
+_META = ("_format", "_source_size", "_source_mtime_ns", "_source_sha256")
+
+
+def cache_path(source):
+    """
+    :return: where the cached columns for source live
+    """
+    return os.path.splitext(source)[0] + CACHE_SUFFIX
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _write_bundle(path, columns, stat, digest):
+    # write to a temp file first, so a crash never leaves a half-written cache
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp,
+        _format=np.array(CACHE_FORMAT),
+        _source_size=np.array(stat.st_size),
+        _source_mtime_ns=np.array(stat.st_mtime_ns),
+        _source_sha256=np.array(digest),
+        **columns,
+    )
+    os.replace(tmp, path)
+
+
+def load_cached_columns(source, parse, use_cache=True):
+    """
+    Load a session's trial columns, parsing the source file only when needed.
+
+    The cache is trusted while the source's size and mtime are unchanged. If
+    the mtime changed but the content hash did not (e.g. the file was copied),
+    the cache is still used and re-stamped. Otherwise the source is re-parsed
+    and the cache rewritten.
+
+    :param source: path to the source file (e.g. a .mat file)
+    :param parse: function source -> dict of column name -> numpy array
+    :param use_cache: False = always parse, and don't touch the cache
+    :return: dict of column name -> numpy array
+    """
+
+    if not use_cache:
+        return parse(source)
+
+    path = cache_path(source)
+    stat = os.stat(source)
+    digest = None
+
+    if os.path.exists(path):
+        try:
+            with np.load(path, allow_pickle=False) as bundle:
+                columns = {key: bundle[key] for key in bundle.files if key not in _META}
+                fresh = int(bundle["_format"]) == CACHE_FORMAT and int(bundle["_source_size"]) == stat.st_size
+                same_mtime = int(bundle["_source_mtime_ns"]) == stat.st_mtime_ns
+                cached_digest = str(bundle["_source_sha256"])
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # unreadable/corrupt cache: just rebuild it below
+            fresh = False
+
+        if fresh and same_mtime:
+            return columns
+        if fresh:
+            digest = _sha256(source)
+            if digest == cached_digest:
+                try:
+                    _write_bundle(path, columns, stat, digest)
+                except OSError:
+                    pass
+                return columns
+
+    columns = {key: np.asarray(value) for key, value in parse(source).items()}
+    try:
+        _write_bundle(path, columns, stat, digest or _sha256(source))
+    except OSError:
+        # e.g. read-only data directory; caching is only an optimization
+        pass
+    return columns
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+# Smallest dtypes that hold every column: stimID/response are 0/1 codes (and
+# small negative error codes), and ratings are 1-4 (or negative). RTs stay
+# float64, so statistics on them come out exactly as from the full-size data.
+# 3 x int8 + float64 = 11 bytes per trial, vs 32 with int64/float64.
+COMPACT_DTYPES = {
+    "stimID": np.int8,
+    "response": np.int8,
+    "rating": np.int8,
+    "responseRT": np.float64,
+}
+
+
+def _fits_int8(values):
+    info = np.iinfo(np.int8)
+    values = np.asarray(values)
+    return values.size == 0 or (values.min() >= info.min and values.max() <= info.max)
+
+
+def _as_int8(values, name):
+    # like np.asarray(values, dtype=np.int8), but refuses to silently wrap around
+    values = np.asarray(values)
+    if values.dtype != np.int8 and not _fits_int8(values):
+        raise ValueError(f"column {name!r} has values that don't fit in int8")
+    return values.astype(np.int8, copy=False)
+
+
+def compact_trials(data):
+    """
+    Convert a load_data style DataFrame to the COMPACT_DTYPES.
+    Other columns are left alone.
+
+    :param data: pandas DataFrame
+    :return: new DataFrame with compact dtypes
+    """
+
+    dtypes = {col: dtype for col, dtype in COMPACT_DTYPES.items() if col in data.columns}
+    for col, dtype in dtypes.items():
+        if dtype == np.int8:
+            _as_int8(data[col], col)  # only checking the range here
+    return data.astype(dtypes)
+
+
+def half_labels(trial_numbers, first_half_n_trials, labels=("1-500", "501-1000")):
+    """
+    Categorical first/second half labels: 1 byte per trial plus the two label
+    strings, rather than one Python string per row.
+
+    :param trial_numbers: 0-based trial number of each row (e.g. data.index)
+    :param first_half_n_trials: trials numbered below this are the first half
+    :return: pandas Categorical
+    """
+
+    codes = (np.asarray(trial_numbers) >= first_half_n_trials).astype(np.int8)
+    return pd.Categorical.from_codes(codes, categories=list(labels))
+
+
+class TrialData:
+    """
+    Compact, array-backed trials: a leaner take on the TrialData class in test.py.
+
+    Each column is one contiguous numpy array in COMPACT_DTYPES, and __slots__
+    keeps the per-object overhead fixed, so whole cohorts of these can be held
+    in memory at once. block holds optional categorical labels (e.g. halves).
+    """
+
+    __slots__ = ("stim_id", "response", "rating", "response_rt", "block")
+
+    def __init__(self, stim_id, response, rating, response_rt, block=None):
+        self.stim_id = _as_int8(stim_id, "stimID")
+        self.response = _as_int8(response, "response")
+        self.rating = _as_int8(rating, "rating")
+        self.response_rt = np.asarray(response_rt, dtype=COMPACT_DTYPES["responseRT"])
+        self.block = None if block is None else pd.Categorical(block)
+
+        if not (len(self.stim_id) == len(self.response) == len(self.rating) == len(self.response_rt)):
+            raise ValueError("all trial columns must have the same length")
+        if self.block is not None and len(self.block) != len(self.stim_id):
+            raise ValueError("block labels must have one entry per trial")
+
+    @classmethod
+    def from_frame(cls, data, block=None):
+        """
+        :param data: DataFrame like the one load_data returns
+        :param block: optional column name holding block labels
+        """
+        return cls(
+            data["stimID"].to_numpy(),
+            data["response"].to_numpy(),
+            data["rating"].to_numpy(),
+            data["responseRT"].to_numpy(),
+            None if block is None else data[block],
+        )
+
+    def __len__(self):
+        return len(self.stim_id)
+
+    def __getitem__(self, index):
+        # slices/masks give a TrialData; (numpy) views where numpy allows it
+        return TrialData(
+            self.stim_id[index],
+            self.response[index],
+            self.rating[index],
+            self.response_rt[index],
+            None if self.block is None else self.block[index],
+        )
+
+    def with_halves(self, first_half_n_trials, labels=("1-500", "501-1000")):
+        """
+        Same trials, with block set to first/second half labels.
+        """
+        return TrialData(
+            self.stim_id, self.response, self.rating, self.response_rt,
+            half_labels(np.arange(len(self)), first_half_n_trials, labels),
+        )
+
+    @property
+    def nbytes(self):
+        n = self.stim_id.nbytes + self.response.nbytes + self.rating.nbytes + self.response_rt.nbytes
+        if self.block is not None:
+            n += self.block.nbytes
+        return n
+
+    def to_frame(self):
+        """
+        :return: DataFrame with the load_data column names (+ 'block' if set)
+        """
+        columns = {
+            "stimID": self.stim_id,
+            "response": self.response,
+            "rating": self.rating,
+            "responseRT": self.response_rt,
+        }
+        if self.block is not None:
+            columns["block"] = self.block
+        return pd.DataFrame(columns)
@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Consolidated on-disk trial store for many subjects/sessions.
+#
+# <path>/
+#     index.json       -- column dtypes, total trials, and one entry per session:
+#                         {"subject", "session", "start", "stop"}
+#     stimID.bin       -- every session's trials back to back, one raw binary
+#     response.bin        file per column, opened with np.memmap
+#     rating.bin
+#     responseRT.bin
+#
+# Opening a store only reads index.json; trial data is paged in by the OS as
+# it's touched, and the pages are shared between every process that maps them.
+#
+# A store is written into a temporary directory next to <path> and renamed
+# into place once complete, so a failed build never leaves half-written
+# columns behind (or clobbers the store it was replacing).
+
+STORE_DTYPES = {
+    "stimID": np.int16,
+    "response": np.int16,
+    "rating": np.int16,
+    "responseRT": np.float64,
+}
+
+
+def _as_store_dtype(values, dtype, name):
+    # like np.asarray(values, dtype=dtype), but refuses to silently wrap around
+    # (or truncate non-integers) when the store column is an integer type
+    values = np.asarray(values)
+    dtype = np.dtype(dtype)
+    if dtype.kind == "i" and values.dtype != dtype and values.size:
+        if values.dtype.kind == "f" and not np.all(np.isfinite(values) & (values == np.round(values))):
+            raise ValueError(f"{name} has non-integer values, but is stored as {dtype}")
+        if values.dtype.kind not in "iuf":
+            raise ValueError(f"{name} has {values.dtype} values, but is stored as {dtype}")
+        info = np.iinfo(dtype)
+        if values.min() < info.min or values.max() > info.max:
+            raise ValueError(f"{name} has values that don't fit in {dtype}")
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+def build_trial_store(path, sessions):
+    """
+    Write sessions into a new trial store, one session at a time.
+
+    e.g. build_trial_store("store", ((f"S{i}", 1, load_data(fn)) for i, fn in files))
+
+    :param path: directory to create the store in; an existing store there is
+                 replaced, but only once the new one is complete
+    :param sessions: iterable of (subject, session, trials), where trials is a
+                     DataFrame (or dict of arrays) with the STORE_DTYPES columns
+    :return: the opened TrialStore
+    :raises ValueError: if a session's columns differ in length, or have values
+                        the STORE_DTYPES can't hold exactly
+    :raises FileExistsError: if path is a non-empty directory that isn't a store
+    """
+
+    path = os.path.abspath(path)
+    if os.path.isdir(path) and os.listdir(path) and not os.path.exists(os.path.join(path, "index.json")):
+        raise FileExistsError(f"{path} exists and isn't a trial store")
+    parent, name = os.path.split(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=f".{name}.", dir=parent)
+
+    try:
+        index = []
+        n_trials = 0
+
+        files = {col: open(os.path.join(tmp_path, f"{col}.bin"), "wb") for col in STORE_DTYPES}
+        try:
+            for subject, session, trials in sessions:
+                lengths = {len(trials[col]) for col in STORE_DTYPES}
+                if len(lengths) != 1:
+                    raise ValueError(f"columns of subject {subject!r}, session {session!r} differ in length")
+                n = lengths.pop()
+
+                for col, dtype in STORE_DTYPES.items():
+                    label = f"column {col!r} of subject {subject!r}, session {session!r}"
+                    files[col].write(_as_store_dtype(trials[col], dtype, label).tobytes())
+
+                index.append({"subject": subject, "session": session, "start": n_trials, "stop": n_trials + n})
+                n_trials += n
+        finally:
+            for f in files.values():
+                f.close()
+
+        with open(os.path.join(tmp_path, "index.json"), "w") as f:
+            json.dump(
+                {
+                    "dtypes": {col: np.dtype(dtype).str for col, dtype in STORE_DTYPES.items()},
+                    "n_trials": n_trials,
+                    "sessions": index,
+                },
+                f,
+                default=str,
+            )
+
+        # swap the finished store in; processes that still map the old one keep
+        # their (now unlinked) files until they close them
+        if os.path.isdir(path):
+            old_path = tempfile.mkdtemp(prefix=f".{name}.old.", dir=parent)
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    return TrialStore(path)
+
+
+class TrialStore:
+    """
+    Read-only view of a store written by build_trial_store.
+
+    Columns come back as memory-mapped arrays, so slicing one subject (or
+    pooling everyone) never loads more than is used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            meta = json.load(f)
+        self.n_trials = meta["n_trials"]
+        self.sessions = pd.DataFrame(meta["sessions"], columns=["subject", "session", "start", "stop"])
+        self._columns = {}
+        for col, dtype in meta["dtypes"].items():
+            if self.n_trials:
+                self._columns[col] = np.memmap(os.path.join(path, f"{col}.bin"), dtype=dtype, mode="r")
+            else:
+                # np.memmap can't map an empty file
+                self._columns[col] = np.empty(0, dtype=dtype)
+
+    # worker processes re-open the maps rather than receiving pickled copies
+    def __reduce__(self):
+        return TrialStore, (self.path,)
+
+    def __len__(self):
+        return self.n_trials
+
+    @property
+    def subjects(self):
+        return list(dict.fromkeys(self.sessions["subject"]))
+
+    def _ranges(self, subject=None, session=None):
+        rows = self.sessions
+        if subject is not None:
+            rows = rows[rows["subject"] == subject]
+        if session is not None:
+            rows = rows[rows["session"] == session]
+        if rows.empty:
+            raise KeyError(f"no sessions for subject={subject!r}, session={session!r}")
+        return rows
+
+    def columns(self, subject=None, session=None):
+        """
+        Trial columns for one subject/session, or everyone pooled (no arguments).
+
+        :return: dict of column name -> array; memory-mapped views when the
+                 selected sessions are stored back to back, copies otherwise
+        """
+        if subject is None and session is None:
+            return dict(self._columns)
+
+        rows = self._ranges(subject, session)
+        starts, stops = rows["start"].to_numpy(), rows["stop"].to_numpy()
+        if np.all(starts[1:] == stops[:-1]):
+            return {col: arr[starts[0]:stops[-1]] for col, arr in self._columns.items()}
+        return {
+            col: np.concatenate([arr[a:b] for a, b in zip(starts, stops)])
+            for col, arr in self._columns.items()
+        }
+
+    def frame(self, subject=None, session=None):
+        """
+        Same as columns, as a DataFrame like the one load_data returns.
+
+        Building the DataFrame copies the selected trials into memory, so a
+        subject or session has to be given; for the whole store pooled, use
+        columns() (memory-mapped) instead.
+        """
+        if subject is None and session is None:
+            raise ValueError("frame() copies trials into memory; select a subject/session, or use columns()")
+        return pd.DataFrame(self.columns(subject, session))